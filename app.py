@@ -1,12 +1,22 @@
 import sys
-from typing import List
-from PyQt5.QtWidgets import QApplication, QWidget
-from PyQt5.QtGui import QPainter
-from PyQt5.QtCore import Qt, QPoint, QRect
+import threading
+from typing import Iterable, List, Set
+
+import numpy as np
+from PyQt5.QtWidgets import QApplication, QWidget, QFileDialog, QRubberBand
+from PyQt5.QtGui import QPainter, QRegion, QCursor
+from PyQt5.QtCore import Qt, QPoint, QRect, QSize, QTimer
 
 from rectangle import Rectangle
-from connection import Connection
-from collision import Collision
+from connection import Connection, ConnectionGraph
+from engine import CollisionEngine, REJECTED
+from history import History, Create, CreateMany, Delete, Connect, Disconnect, Move, MoveGroup, MoveMany
+from instrumentation import Instrumentation
+from layout import ForceLayout
+from renderer import SceneRenderer
+from scene_io import save_scene, load_scene, export_json
+from spatial_index import SpatialIndex
+from view import View
 
 class MainWindow(QWidget):
     def __init__(
@@ -14,445 +24,538 @@ class MainWindow(QWidget):
         app_height: int = 800,
         app_width: int = 800,
         rect_height: int = 40,
+        index: SpatialIndex = None,
+        frame_rate: int = 60,
+        instrumentation: Instrumentation = None,
+        world_width: int = None,
+        world_height: int = None,
     ):
         super().__init__()
         self.rect_height = rect_height
         self.rect_width = rect_height * 2
 
-        self.rectangles: List[Rectangle] = []
-        self.connections: List[Connection] = []
+        # Without a world size the world is the window and follows its size
+        self.world_follows_window = world_width is None and world_height is None
+
+        # Geometry and drag resolution, free of any Qt types
+        self.engine = CollisionEngine(
+            width=world_width or app_width,
+            height=world_height or app_height,
+            rect_width=self.rect_width,
+            rect_height=self.rect_height,
+            index=index,
+        )
+        self.connections = ConnectionGraph(self.engine.store)
+
+        # Part of the world shown in the window, panned with the middle button
+        self.view = View()
+        self.pan_pos: QPoint = None
+        self.renderer = SceneRenderer(self.engine, self.connections, self.view)
 
         self.active_rectangle: Rectangle = None
 
         self.offset: QPoint = QPoint()
-        self.collision_x: Collision = None
-        self.collision_y: Collision = None
+        # Position of the dragged rectangle when it was pressed
+        self.drag_start: QPoint = None
+
+        # Rectangles picked with the rubber band, dragged together
+        self.selection: Set[int] = set()
+        # Ids of the selection while it is dragged, the active rectangle leads
+        self.group: np.ndarray = None
+        self.band_origin: QPoint = None
+        self.rubber_band = QRubberBand(QRubberBand.Rectangle, self)
+
+        # Edits for undo and redo
+        self.history = History(self.engine, self.connections)
+
+        # Automatic layout, computed in a thread and applied by the timer
+        self.layout: ForceLayout = None
+        self.layout_timer = QTimer(self)
+        self.layout_timer.setInterval(16)
+        self.layout_timer.timeout.connect(self.on_layout)
+
+        # Latest cursor position not yet resolved, moves are coalesced
+        # and resolved at most frame_rate times per second (0 - on every event)
+        self.pending_pos: QPoint = None
+        self.frame_timer: QTimer = None
+        if frame_rate:
+            self.frame_timer = QTimer(self)
+            self.frame_timer.setInterval(max(1, round(1000 / frame_rate)))
+            self.frame_timer.timeout.connect(self.on_frame)
 
         # Current rectangle selected for connection
         self.first_connection_rectangle: Rectangle = None
 
+        # Timings of the handlers, shown over the scene with F3
+        self.instrumentation = instrumentation
+        self.overlay_timer: QTimer = None
+        if instrumentation is not None:
+            instrumentation.attach(self)
+            self.overlay_timer = QTimer(self)
+            self.overlay_timer.setInterval(250)
+            self.overlay_timer.timeout.connect(lambda: self.update(self.renderer.overlay_area))
+
         self.setWindowTitle("Collision of rectangles")
         self.setGeometry(50, 50, app_width, app_height)
+        self.renderer.resize(self.size())
 
 
     def mouseDoubleClickEvent(self, event) -> None:
         if event.button() == Qt.LeftButton:
-            mouse_pos = event.pos()
-
-            if self.is_rectangle_within_window(mouse_pos):
-                colors = [r.color for r in self.rectangles]
-                new_rect = Rectangle(
-                    x=event.x(),
-                    y=event.y(),
-                    height=self.rect_height,
-                    colors=colors,
+            self.stop_layout()
+            mouse_pos = self.view.to_world(event.pos())
+
+            if QRect(0, 0, self.engine.width, self.engine.height).contains(mouse_pos):
+                # Taken spots snap to the closest place the rectangle fits in
+                place = self.engine.place(
+                    mouse_pos.x() - self.rect_width // 2,
+                    mouse_pos.y() - self.rect_height // 2,
                 )
-                if not self.has_intersections(new_rect):
-                    self.rectangles.append(new_rect)
-                    self.update()
+                if place is not None:
+                    top_left = QPoint(*place)
+                    rect = self.add_rectangle(top_left)
+                    self.history.record(Create(
+                        rect.id, top_left.x(), top_left.y(), int(self.engine.store.color[rect.id])
+                    ))
+                    self.repaint_area(self.renderer.item_area(rect.id))
 
 
     def mousePressEvent(self, event):
-        mouse_pos = event.pos()
-        if event.button() == Qt.LeftButton:
+        mouse_pos = self.view.to_world(event.pos())
+        self.flush_move()
+        if event.button() != Qt.MiddleButton:
+            self.stop_layout()
+        if event.button() == Qt.MiddleButton:
+            self.pan_pos = event.pos()
+        elif event.button() == Qt.LeftButton:
             # Check if we are clicking on an existing rectangle
-            for rectangle in self.rectangles:
-                if rectangle.contains(mouse_pos):
-                    if rectangle != self.active_rectangle:
-                        self.reset_collisions()
-
-                    self.active_rectangle = rectangle
-                    self.offset = mouse_pos - rectangle.topLeft()
-                    break
+            rectangle = self.rectangle_at(mouse_pos)
+            if rectangle is not None:
+                if rectangle.id in self.selection:
+                    self.group = np.array(sorted(self.selection), dtype=np.int64)
+                else:
+                    self.clear_selection()
+
+                self.engine.start_drag(rectangle.id)
+                self.renderer.set_active(self.selection if self.group is not None else [rectangle.id])
+                # Connections of the dragged rectangles are drawn above the rest
+                self.update(self.renderer.items_area(self.renderer.active))
+
+                self.active_rectangle = rectangle
+                self.offset = mouse_pos - rectangle.topLeft()
+                self.drag_start = rectangle.topLeft()
+            else:
+                # Start selecting the rectangles for a group drag
+                self.clear_selection()
+                self.band_origin = event.pos()
+                self.rubber_band.setGeometry(QRect(self.band_origin, QSize()))
+                self.rubber_band.show()
         elif event.button() == Qt.RightButton:
             # Start creating a connection between two rectangles or remove a connection
-            clicked_connection = None
-            for conn in self.connections:
-                if conn.contains(mouse_pos):
-                    clicked_connection = conn
-                    break
+            damage = QRegion()
+            clicked_connection = self.connections.connection_at(
+                mouse_pos.x(), mouse_pos.y()
+            )
             if clicked_connection is not None:
+                damage = damage.united(self.renderer.connection_area(clicked_connection))
                 self.connections.remove(clicked_connection)
+                self.history.record(
+                    Disconnect(clicked_connection.rect1.id, clicked_connection.rect2.id)
+                )
             else:
-                clicked_on_rectangle = False
-                for rect in self.rectangles:
-                    if rect.contains(mouse_pos):
-                        clicked_on_rectangle = True
-                        if not self.first_connection_rectangle:
-                            # Start the connection
-                            self.first_connection_rectangle = rect
-                            rect.is_highlighted = True  # Highlight the selected rectangle
-                        else:
-                            # Complete the connection
-                            new_conn = Connection(self.first_connection_rectangle, rect)
-                            conn_exists = False
-                            for conn in self.connections:
-                                if (
-                                    (
-                                        conn.rect1 == new_conn.rect1
-                                        and conn.rect2 == new_conn.rect2
-                                    ) or (
-                                        conn.rect1 == new_conn.rect2
-                                        and conn.rect2 == new_conn.rect1
-                                    )
-                                ):
-                                    conn_exists = True
-                                    break
-                            if not conn_exists:
-                                self.connections.append(new_conn)
-
-                                self.first_connection_rectangle.is_highlighted = False
-                                self.first_connection_rectangle = None
-                        break
-
-                if not clicked_on_rectangle and self.first_connection_rectangle:
+                rect = self.rectangle_at(mouse_pos)
+                if rect is not None:
+                    if not self.first_connection_rectangle:
+                        # Start the connection
+                        self.first_connection_rectangle = rect
+                        rect.is_highlighted = True  # Highlight the selected rectangle
+                        damage = damage.united(self.renderer.rectangle_area(rect.id))
+                    else:
+                        # Complete the connection
+                        new_conn = Connection(self.first_connection_rectangle, rect)
+                        if self.connections.add(new_conn):
+                            self.history.record(Connect(new_conn.rect1.id, new_conn.rect2.id))
+                            damage = damage.united(self.renderer.connection_area(new_conn))
+                            damage = damage.united(
+                                self.renderer.rectangle_area(self.first_connection_rectangle.id)
+                            )
+                            self.first_connection_rectangle.is_highlighted = False
+                            self.first_connection_rectangle = None
+
+                if rect is None and self.first_connection_rectangle:
                     # Undo the first connection selection by clicking on empty space
+                    damage = damage.united(
+                        self.renderer.rectangle_area(self.first_connection_rectangle.id)
+                    )
                     self.first_connection_rectangle.is_highlighted = False
                     self.first_connection_rectangle = None
 
-            self.update()
+            self.repaint_area(damage)
 
 
     def mouseMoveEvent(self, event) -> None:
-        if self.active_rectangle:
-            current_rect = self.active_rectangle.rect
-
-            new_top_left: QPoint = event.pos() - self.offset
-            new_top_left = self.limit_to_window(new_top_left)
-
-            closest_rectangle = self.find_closest_rectangle(new_top_left)
-
-            # Point to which movement is possible
-            to: QPoint = None
-
-            # No obstacles on the path from the active rectangle to the cursor point
-            if (
-                closest_rectangle is None
-                and self.collision_y is None
-                and self.collision_x is None
-            ):
-                self.active_rectangle.moveTo(new_top_left)
-
-            # Presence of collision along the OX axis
-            elif (
-                closest_rectangle is None
-                and self.collision_y is None
-                and self.collision_x is not None
-            ):
-                collision_rect = self.collision_x.rectangle.rect
-                is_in_y_range = (
-                    collision_rect.top() - self.rect_height
-                    <= new_top_left.y()
-                    <= collision_rect.bottom()
-                )
+        if self.pan_pos is not None:
+            delta = event.pos() - self.pan_pos
+            self.pan_pos = event.pos()
+            self.view.pan(delta.x(), delta.y())
+            self.repaint_view()
+        elif self.band_origin is not None:
+            self.rubber_band.setGeometry(QRect(self.band_origin, event.pos()).normalized())
+        elif self.active_rectangle:
+            self.pending_pos = self.view.to_world(event.pos())
 
-                if self.collision_x.direction == Collision.RL:
-                    if (
-                        new_top_left.x() < collision_rect.right()
-                        and is_in_y_range
-                    ):
-                        to = QPoint(collision_rect.right(), new_top_left.y())
-                        self.active_rectangle.moveTo(to)
-                    else:
-                        self.collision_x = None
-                        to = new_top_left
-                else:
-                    if (
-                        new_top_left.x() + self.rect_width > collision_rect.left()
-                        and is_in_y_range
-                    ):
-                        to = QPoint(collision_rect.left() - self.rect_width, new_top_left.y())
-                        self.active_rectangle.moveTo(to)
-                    else:
-                        self.collision_x = None
-                        to = new_top_left
-
-            # Presence of collision along the OY axis
-            elif (
-                closest_rectangle is None
-                and self.collision_y is not None
-                and self.collision_x is None
-            ):
-                collision_rect = self.collision_y.rectangle.rect
-                is_in_x_range = (
-                    collision_rect.left() - self.rect_width
-                    <= new_top_left.x()
-                    <= collision_rect.right()
-                )
+            if self.frame_timer is None:
+                self.flush_move()
+            elif not self.frame_timer.isActive():
+                # The first move after a pause is resolved without waiting
+                self.flush_move()
+                self.frame_timer.start()
 
-                if self.collision_y.direction == Collision.BT:
-                    if (
-                        new_top_left.y() < collision_rect.bottom()
-                        and is_in_x_range
-                    ):
-                        to = QPoint(new_top_left.x(), collision_rect.bottom())
-                    else:
-                        self.collision_y = None
-                        to = new_top_left
-                else:
-                    if (
-                        new_top_left.y() + self.rect_height > collision_rect.top()
-                        and is_in_x_range
-                    ):
-                        to = QPoint(new_top_left.x(), collision_rect.top() - self.rect_height)
-                    else:
-                        self.collision_y = None
-                        to = new_top_left
-
-            # Presence of only the closest rectangle
-            elif (
-                closest_rectangle is not None
-                and self.collision_y is None
-                and self.collision_x is None
-            ):
-                closest_rect = closest_rectangle.rect
-
-                if closest_rect.right() - current_rect.left() <= 1:
-                    self.collision_x = Collision(closest_rectangle, Collision.RL)
-                elif current_rect.right() - closest_rect.left() <= 1:
-                    self.collision_x = Collision(closest_rectangle, Collision.LR)
-                elif closest_rect.bottom() - current_rect.top() <= 1:
-                    self.collision_y = Collision(closest_rectangle, Collision.BT)
-                elif current_rect.bottom() - closest_rect.top() <= 1:
-                    self.collision_y = Collision(closest_rectangle, Collision.TB)
-
-            # Presence of the closest rectangle and collision along the OX axis
-            elif (
-                closest_rectangle is not None
-                and self.collision_y is None
-                and self.collision_x is not None
-            ):
-                closest_rect = closest_rectangle.rect
-                if closest_rect.bottom() - current_rect.top() <= 1:
-                    self.collision_y = Collision(closest_rectangle, Collision.BT)
-                elif current_rect.bottom() - closest_rect.top() <= 1:
-                    self.collision_y = Collision(closest_rectangle, Collision.TB)
-
-            # Presence of the closest rectangle and collision along the OY axis
-            elif (
-                closest_rectangle is not None
-                and self.collision_y is not None
-                and self.collision_x is None
-            ):
-                closest_rect = closest_rectangle.rect
-                if closest_rect.right() - current_rect.left() <= 1:
-                    self.collision_x = Collision(closest_rectangle, Collision.RL)
-                elif current_rect.right() - closest_rect.left() <= 1:
-                    self.collision_x = Collision(closest_rectangle, Collision.LR)
-
-            # Presence of the both collisions
-            elif (
-                self.collision_y is not None
-                and self.collision_x is not None
-            ):
-                rect_x = self.collision_x.rectangle.rect
-                rect_y = self.collision_y.rectangle.rect
-
-                # Collision handling in the upper left corner
-                if (
-                    self.collision_x.direction == Collision.RL
-                    and self.collision_y.direction == Collision.BT
-                ):
-                    if (
-                        new_top_left.x() > rect_x.right()
-                        and new_top_left.y() > rect_y.bottom()
-                    ):
-                        to = new_top_left
-                    elif (
-                        new_top_left.x() < rect_x.right()
-                        and new_top_left.y() > rect_y.bottom()
-                    ):
-                        to = QPoint(rect_x.right(), new_top_left.y())
-                        if new_top_left.y() > rect_x.bottom():
-                            self.reset_collisions()
-                    elif (
-                        new_top_left.x() > rect_x.right()
-                        and new_top_left.y() < rect_y.bottom()
-                    ):
-                        to = QPoint(new_top_left.x(), rect_y.bottom())
-                        if new_top_left.x() > rect_y.right():
-                            self.reset_collisions()
-
-                # Collision handling in the upper right corner
-                elif (
-                    self.collision_x.direction == Collision.LR
-                    and self.collision_y.direction == Collision.BT
-                ):
-                    current_x = new_top_left.x() + self.rect_width
-                    if (
-                        current_x < rect_x.left()
-                        and new_top_left.y() > rect_y.bottom()
-                    ):
-                        to = new_top_left
-                    elif (
-                        current_x > rect_x.left()
-                        and new_top_left.y() > rect_y.bottom()
-                    ):
-                        to = QPoint(rect_x.left() - self.rect_width, new_top_left.y())
-                        if new_top_left.y() > rect_x.bottom():
-                            self.reset_collisions()
-                    elif (
-                        current_x < rect_x.left()
-                        and new_top_left.y() < rect_y.bottom()
-                    ):
-                        to = QPoint(new_top_left.x(), rect_y.bottom())
-                        if new_top_left.x() < rect_y.left():
-                            self.reset_collisions()
-
-                # Collision handling in the lower left corner
-                elif (
-                    self.collision_x.direction == Collision.RL
-                    and self.collision_y.direction == Collision.TB
-                ):
-                    current_y = new_top_left.y() + self.rect_height
-                    if (
-                        new_top_left.x() > rect_x.right()
-                        and current_y < rect_y.top()
-                    ):
-                        to = new_top_left
-                    elif (
-                        new_top_left.x() < rect_x.right()
-                        and current_y < rect_y.top()
-                    ):
-                        to = QPoint(rect_x.right(), new_top_left.y())
-                        if current_y < rect_x.top():
-                            self.reset_collisions()
-                    elif (
-                        new_top_left.x() > rect_x.right()
-                        and current_y > rect_y.top()
-                    ):
-                        to = QPoint(new_top_left.x(), rect_y.top() - self.rect_height)
-                        if new_top_left.x() > rect_y.right():
-                            self.reset_collisions()
-
-                # Collision handling in the lower right corner
-                elif (
-                    self.collision_x.direction == Collision.LR
-                    and self.collision_y.direction == Collision.TB
-                ):
-                    current_x = new_top_left.x() + self.rect_width
-                    current_y = new_top_left.y() + self.rect_height
-                    if (
-                        current_x < rect_x.left()
-                        and current_y < rect_y.top()
-                    ):
-                        to = new_top_left
-                    elif (
-                        current_x > rect_x.left()
-                        and current_y < rect_y.top()
-                    ):
-                        to = QPoint(rect_x.left() - self.rect_width, new_top_left.y())
-                        if current_y < rect_x.top():
-                            self.reset_collisions()
-                    elif (
-                        current_x < rect_x.left()
-                        and current_y > rect_y.top()
-                    ):
-                        to = QPoint(new_top_left.x(), rect_y.top() - self.rect_height)
-                        if new_top_left.x() < rect_y.left():
-                            self.reset_collisions()
-
-            if to is not None:
-                self.active_rectangle.moveTo(to)
 
-            self.update()
+    def on_frame(self) -> None:
+        if self.pending_pos is None:
+            self.frame_timer.stop()
+        else:
+            self.flush_move()
+
+
+    def flush_move(self) -> None:
+        """ Resolves the drag to the latest cursor position. """
+
+        mouse_pos = self.pending_pos
+        self.pending_pos = None
+        if mouse_pos is None or self.active_rectangle is None:
+            return
+
+        new_top_left: QPoint = mouse_pos - self.offset
+
+        # Only the area left and entered by the rectangles and their connections is repainted
+        damage = self.renderer.items_area(self.renderer.active)
+        old_position = self.active_rectangle.topLeft()
+
+        target = (new_top_left.x(), new_top_left.y())
+        if self.group is not None:
+            self.engine.drag_group(self.group, self.active_rectangle.id, target)
+        else:
+            self.engine.drag(self.active_rectangle.id, target)
+
+        if self.active_rectangle.topLeft() != old_position:
+            damage = damage.united(self.renderer.items_area(self.renderer.active))
+            self.update(damage)
 
 
     def mouseReleaseEvent(self, event) -> None:
-        if event.button() == Qt.LeftButton:
+        if event.button() == Qt.MiddleButton:
+            self.pan_pos = None
+        elif event.button() == Qt.LeftButton:
+            self.flush_move()
+            if self.frame_timer is not None:
+                self.frame_timer.stop()
+            if self.band_origin is not None:
+                self.select(self.view.to_world_rect(self.rubber_band.geometry()))
+                self.rubber_band.hide()
+                self.band_origin = None
+
+            if self.active_rectangle is not None:
+                dragged = self.renderer.active
+                self.renderer.set_active([])
+                self.update(self.renderer.items_area(dragged))
+
+                end = self.active_rectangle.topLeft()
+                if end != self.drag_start:
+                    if self.group is not None:
+                        shift = end - self.drag_start
+                        self.history.record(MoveGroup(self.group, shift.x(), shift.y()))
+                    else:
+                        self.history.record(Move(
+                            self.active_rectangle.id,
+                            self.drag_start.x(), self.drag_start.y(), end.x(), end.y(),
+                        ))
             self.active_rectangle = None
+            self.group = None
+            self.engine.end_drag()
+
+
+    def wheelEvent(self, event) -> None:
+        self.view.zoom_at(event.pos(), 1.25 ** (event.angleDelta().y() / 120))
+        self.repaint_view()
+
+
+    def keyPressEvent(self, event) -> None:
+        if self.instrumentation is not None:
+            if event.key() == Qt.Key_F3:
+                self.toggle_overlay()
+                return
+            if event.key() == Qt.Key_T and event.modifiers() & Qt.ControlModifier:
+                path, _ = QFileDialog.getSaveFileName(self, "Export trace", "", "Trace (*.json)")
+                if path:
+                    self.instrumentation.export_trace(path)
+                return
+
+        if event.key() == Qt.Key_Delete:
+            rect = self.rectangle_at(self.view.to_world(self.mapFromGlobal(QCursor.pos())))
+            if rect is not None and self.active_rectangle is None:
+                self.stop_layout()
+                self.remove_rectangle(rect)
+            return
+
+        if event.modifiers() & Qt.ControlModifier:
+            if event.key() == Qt.Key_Z:
+                if event.modifiers() & Qt.ShiftModifier:
+                    self.redo()
+                else:
+                    self.undo()
+                return
+            if event.key() == Qt.Key_Y:
+                self.redo()
+                return
+            if event.key() == Qt.Key_L:
+                if self.layout is None:
+                    self.start_layout()
+                else:
+                    self.stop_layout()
+                return
+            if event.key() == Qt.Key_S:
+                path, _ = QFileDialog.getSaveFileName(self, "Save scene", "", "Scenes (*.rcs)")
+                if path:
+                    self.save_scene(path)
+                return
+            if event.key() == Qt.Key_O:
+                path, _ = QFileDialog.getOpenFileName(self, "Load scene", "", "Scenes (*.rcs)")
+                if path:
+                    self.load_scene(path)
+                return
+            if event.key() == Qt.Key_E:
+                path, _ = QFileDialog.getSaveFileName(self, "Export scene", "", "JSON (*.json)")
+                if path:
+                    export_json(path, self.engine, self.connections)
+                return
+        super().keyPressEvent(event)
+
+
+    def toggle_overlay(self) -> None:
+        if self.overlay_timer.isActive():
+            self.overlay_timer.stop()
+            self.update(self.renderer.overlay_area)
+        else:
+            self.overlay_timer.start()
+            self.update()
+
+
+    def select(self, area: QRect) -> None:
+        """ Selects the rectangles meeting the world area. """
+
+        self.clear_selection()
+        rect_ids = self.engine.rectangles_in(area.x(), area.y(), area.width(), area.height())
+        for rect_id in rect_ids:
+            self.rectangle(rect_id).is_selected = True
+        self.selection = set(rect_ids)
+        if rect_ids:
+            self.repaint_area(self.renderer.items_area(rect_ids))
+
+
+    def clear_selection(self) -> None:
+        if not self.selection:
+            return
+        damage = self.renderer.items_area(self.selection)
+        for rect_id in self.selection:
+            self.rectangle(rect_id).is_selected = False
+        self.selection = set()
+        self.repaint_area(damage)
+
+
+    def undo(self) -> None:
+        self.replay(self.history.undo)
+
+
+    def redo(self) -> None:
+        self.replay(self.history.redo)
+
+
+    def replay(self, step) -> None:
+        """ Undoes or redoes an edit, not in the middle of a drag. """
+
+        if self.active_rectangle is not None:
+            return
+        self.stop_layout()
+        self.clear_selection()
+        if self.first_connection_rectangle is not None:
+            # The selected rectangle may be about to disappear
+            self.first_connection_rectangle.is_highlighted = False
+            self.first_connection_rectangle = None
+        if step() is not None:
+            self.repaint_view()
+
+
+    def start_layout(self) -> None:
+        """ Lays the scene out by the connections, without blocking the
+        window. The layout stops at any edit, keeping what it moved. """
+
+        if self.active_rectangle is not None:
+            return
+        self.clear_selection()
+        self.layout = ForceLayout(self.engine, self.connections)
+        threading.Thread(target=self.layout.compute, daemon=True).start()
+        self.layout_timer.start()
+
+
+    def on_layout(self) -> None:
+        if not self.layout.computed:
+            return
+        if self.layout.apply():
+            self.repaint_view()
+        if self.layout.finished:
+            self.stop_layout()
+
+
+    def stop_layout(self) -> None:
+        """ Cancels the layout and records the moves it made. """
+
+        if self.layout is None:
+            return
+        layout, self.layout = self.layout, None
+        layout.cancelled.set()
+        self.layout_timer.stop()
+
+        moved = layout.moved()
+        if len(moved):
+            rect_ids = layout.rect_ids[moved]
+            store = self.engine.store
+            self.history.record(MoveMany(
+                rect_ids, layout.start_x[moved], layout.start_y[moved],
+                store.x[rect_ids], store.y[rect_ids],
+            ))
+
+
+    def save_scene(self, path: str) -> None:
+        save_scene(path, self.engine, self.connections)
+
+
+    def load_scene(self, path: str) -> None:
+        """ Adds the rectangles and connections of a saved scene. """
+
+        self.stop_layout()
+        rect_ids = load_scene(path, self.engine, self.connections)
+        rect_ids = rect_ids[rect_ids != REJECTED]
+        store = self.engine.store
+        edges = list(dict.fromkeys(
+            key for rect_id in rect_ids.tolist()
+            for key in self.connections.adjacency.get(rect_id, ())
+        ))
+        self.history.record(CreateMany(
+            rect_ids, store.x[rect_ids], store.y[rect_ids], store.color[rect_ids], edges
+        ))
+        self.renderer.invalidate()
+        self.update()
+
+
+    def resizeEvent(self, event) -> None:
+        super().resizeEvent(event)
+        if self.world_follows_window:
+            self.engine.resize(self.width(), self.height())
+        self.renderer.resize(self.size())
 
 
     def paintEvent(self, event) -> None:
         painter = QPainter(self)
+        self.renderer.paint(painter, event.rect())
+        if self.overlay_timer is not None and self.overlay_timer.isActive():
+            self.renderer.paint_overlay(painter, self.instrumentation.summary())
 
-        for conn in self.connections:
-            conn.draw(painter)
 
-        for rect in self.rectangles:
-            rect.draw(painter)
+    def repaint_area(self, area: QRegion) -> None:
+        """ Redraws the area after a change of the static items. """
 
+        self.renderer.invalidate(area)
+        self.update(area)
 
-    def is_rectangle_within_window(self, mouse_pos) -> bool:
-        if (
-            mouse_pos.x() - self.rect_width // 2 < 0
-            or mouse_pos.x() + self.rect_width // 2 > self.width()
-            or mouse_pos.y() - self.rect_height // 2 < 0
-            or mouse_pos.y() + self.rect_height // 2 > self.height()
-        ):
-            return False
-        return True
 
+    def repaint_view(self) -> None:
+        """ Redraws the window after a pan or zoom. """
 
-    def has_intersections(self, rectangle: Rectangle) -> bool:
-        for r in self.rectangles:
-            if rectangle != r and rectangle.intersects(r):
-                return True
-        return False
+        self.renderer.invalidate()
+        self.update()
 
 
-    def limit_to_window(self, pos: QPoint) -> QPoint:
-        # Prevents going outside the window in the OY axis
-        if pos.y() < 0:
-            pos.setY(0)
-        elif pos.y() + self.rect_height > self.height():
-            pos.setY(self.height() - self.rect_height)
+    def is_rectangle_within_window(self, mouse_pos) -> bool:
+        return self.engine.is_within_window(mouse_pos.x(), mouse_pos.y())
 
-        # Prevents going outside the window in the OX axis
-        if pos.x() < 0:
-            pos.setX(0)
-        elif pos.x() + self.rect_width > self.width():
-            pos.setX(self.width() - self.rect_width)
 
-        return pos
+    def has_intersections(self, top_left: QPoint, exclude: Rectangle = None) -> bool:
+        return self.engine.has_intersections(
+            top_left.x(),
+            top_left.y(),
+            exclude=exclude.id if exclude is not None else None,
+        )
 
 
-    def find_closest_rectangle(self, top_left: QPoint) -> Rectangle:
-        """ The nearest rectangle lying on the path
-        from the active rectangle to the current cursor position. """
+    def add_rectangle(self, top_left: QPoint) -> Rectangle:
+        rect_id = self.engine.add(top_left.x(), top_left.y())
+        return self.rectangle(rect_id)
 
-        current_top_left = self.active_rectangle.topLeft()
 
-        area = QRect(
-            min(current_top_left.x(), top_left.x()),
-            min(current_top_left.y(), top_left.y()),
-            abs(current_top_left.x() - top_left.x()) + self.rect_width,
-            abs(current_top_left.y() - top_left.y()) + self.rect_height
+    def add_rectangles(self, top_lefts: Iterable[QPoint]) -> List[Rectangle]:
+        """ Adds the rectangles that fit in the window and overlap nothing,
+        earlier ones winning, and returns the added rectangles. """
+
+        top_lefts = list(top_lefts)
+        rect_ids = self.engine.add_rectangles(
+            np.array([point.x() for point in top_lefts], dtype=np.int32),
+            np.array([point.y() for point in top_lefts], dtype=np.int32),
         )
+        added = [self.rectangle(int(rect_id)) for rect_id in rect_ids if rect_id != REJECTED]
+        if added:
+            store = self.engine.store
+            rect_ids = rect_ids[rect_ids != REJECTED]
+            self.history.record(CreateMany(
+                rect_ids, store.x[rect_ids], store.y[rect_ids], store.color[rect_ids], []
+            ))
+            self.renderer.invalidate()
+            self.update()
+        return added
 
-        min_distance = float('inf')
 
-        closest_rectangle: Rectangle = None
+    def remove_rectangle(self, rect: Rectangle) -> None:
+        """ Removes the rectangle and its connections. """
+
+        damage = self.renderer.item_area(rect.id)
+        x, y = self.engine.position(rect.id)
+        color = int(self.engine.store.color[rect.id])
+        if rect == self.first_connection_rectangle:
+            self.first_connection_rectangle = None
+        self.selection.discard(rect.id)
+
+        removed = self.connections.remove_rectangle(rect.id)
+        self.engine.remove(rect.id)
+        self.history.record(Delete(
+            rect.id, x, y, color,
+            [self.connections.key(conn.rect1.id, conn.rect2.id) for conn in removed],
+        ))
+        self.repaint_area(damage)
+
+
+    @property
+    def rectangles(self) -> List[Rectangle]:
+        return [self.rectangle(int(rect_id)) for rect_id in self.engine.store.ids()]
 
-        for rectangle in self.rectangles:
-            if rectangle != self.active_rectangle:
-                if (
-                    (
-                        self.collision_x is not None
-                        and self.collision_x.rectangle == rectangle
-                    ) or (
-                        self.collision_y is not None
-                        and self.collision_y.rectangle == rectangle
-                    )
-                ):
-                    continue
-                rect = rectangle.rect
-                if area.intersects(rect):
-                    distance = (
-                        (area.topLeft().x() - rect.topLeft().x()) ** 2
-                        + (area.topLeft().y() - rect.topLeft().y()) ** 2
-                    ) ** 0.5
 
-                    if distance < min_distance:
-                        min_distance = distance
-                        closest_rectangle = rectangle
+    def rectangle(self, rect_id: int) -> Rectangle:
+        return Rectangle(self.engine.store, rect_id)
 
-        return closest_rectangle
+
+    def rectangle_at(self, pos: QPoint) -> Rectangle:
+        rect_id = self.engine.rectangle_at(pos.x(), pos.y())
+        if rect_id is None:
+            return None
+        return self.rectangle(rect_id)
+
+
+    def limit_to_window(self, pos: QPoint) -> QPoint:
+        return QPoint(*self.engine.limit_to_window(pos.x(), pos.y()))
 
 
     def reset_collisions(self) -> None:
-        self.collision_x = None
-        self.collision_y = None
+        self.engine.reset_collisions()
 
 
 if __name__ == '__main__':
@@ -461,6 +564,9 @@ if __name__ == '__main__':
         app_height=800,
         app_width=1200,
         rect_height=80,
+        instrumentation=(
+            Instrumentation(tracing=True) if "--instrument" in sys.argv else None
+        ),
     )
     window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,423 @@
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from collision import Collision
+
+
+# Value of the blocker arrays for movers that reached their target freely
+NO_BLOCKER = -1
+
+# Sweeps per move: flights, slides and flights again after the slides
+MAX_PASSES = 32
+
+
+class MoverBatch:
+    """ Structure-of-arrays description of rectangles moving simultaneously.
+
+    After resolution `x`/`y` hold the reached top-left corners and
+    `blocker_x`/`blocker_y` the ids of the rectangles that stopped
+    the movement along each axis. """
+
+    def __init__(
+        self,
+        rect_ids: Iterable[int],
+        start_x: Iterable[int],
+        start_y: Iterable[int],
+        target_x: Iterable[int],
+        target_y: Iterable[int],
+    ):
+        self.rect_ids = np.asarray(rect_ids, dtype=np.int64)
+        self.start_x = np.asarray(start_x, dtype=np.int32)
+        self.start_y = np.asarray(start_y, dtype=np.int32)
+        self.target_x = np.asarray(target_x, dtype=np.int32)
+        self.target_y = np.asarray(target_y, dtype=np.int32)
+
+        self.x = self.start_x.copy()
+        self.y = self.start_y.copy()
+        self.blocker_x = np.full(len(self.rect_ids), NO_BLOCKER, dtype=np.int64)
+        self.blocker_y = np.full(len(self.rect_ids), NO_BLOCKER, dtype=np.int64)
+
+
+    def __len__(self) -> int:
+        return len(self.rect_ids)
+
+
+    def collisions(self, i: int) -> Tuple[Optional[Collision], Optional[Collision]]:
+        """ Collisions of the i-th mover in terms of the single drag. """
+
+        collision_x = collision_y = None
+        if self.blocker_x[i] != NO_BLOCKER:
+            direction = Collision.LR if self.target_x[i] > self.start_x[i] else Collision.RL
+            collision_x = Collision(int(self.blocker_x[i]), direction)
+        if self.blocker_y[i] != NO_BLOCKER:
+            direction = Collision.TB if self.target_y[i] > self.start_y[i] else Collision.BT
+            collision_y = Collision(int(self.blocker_y[i]), direction)
+        return collision_x, collision_y
+
+
+def sweep(
+    sx: np.ndarray,
+    sy: np.ndarray,
+    dx: np.ndarray,
+    dy: np.ndarray,
+    bx: np.ndarray,
+    by: np.ndarray,
+    rect_width: int,
+    rect_height: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """ Time of impact of every (mover, blocker) pair along the motion
+    s + t * d, t in [0, 1), or inf when the pair does not collide.
+
+    The top-left corner of a mover must stay out of the open box
+    (bx - w + 1, bx + w - 1) x (by - h + 1, by + h - 1): as with the
+    RL/BT collisions of a single drag, touching rectangles may share
+    one column or row of pixels. Also returns whether the contact
+    happened on the OX axis. """
+
+    x_lo = bx - rect_width + 1
+    x_hi = bx + rect_width - 1
+    y_lo = by - rect_height + 1
+    y_hi = by + rect_height - 1
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tx0, tx1 = axis_times(sx, dx, x_lo, x_hi)
+        ty0, ty1 = axis_times(sy, dy, y_lo, y_hi)
+
+    t_entry = np.maximum(tx0, ty0)
+    t_exit = np.minimum(tx1, ty1)
+
+    hit = (t_entry < t_exit) & (t_entry >= 0) & (t_entry < 1)
+    return np.where(hit, t_entry, np.inf), tx0 >= ty0
+
+
+def axis_times(
+    s: np.ndarray,
+    d: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Without movement the times are infinite, of opposite signs only
+    # inside the span, or NaN on its edges, which never overlap either
+    t_lo = (lo - s) / d
+    t_hi = (hi - s) / d
+    return np.minimum(t_lo, t_hi), np.maximum(t_lo, t_hi)
+
+
+def toward_start(value: np.ndarray, d: np.ndarray) -> np.ndarray:
+    """ Rounds the coordinates reached at a contact back to integers
+    without passing the exact position in the direction of movement. """
+
+    return np.where(d > 0, np.floor(value + 1e-6), np.ceil(value - 1e-6)).astype(np.int64)
+
+
+def left_behind(
+    position: np.ndarray,
+    goal: np.ndarray,
+    blocker: np.ndarray,
+    size: int,
+) -> np.ndarray:
+    """ Whether the coordinates are out of the span a blocker keeps
+    the other axis blocked in, its own span widened by the size, and
+    the goal does not lead back into it. A mover touching the corner of
+    a blocker is still held while it heads into that span. """
+
+    return (
+        ((position <= blocker - size + 1) & (goal <= position))
+        | ((position >= blocker + size - 1) & (goal >= position))
+    )
+
+
+def resolve_pairs(
+    batch: MoverBatch,
+    movers: np.ndarray,
+    pair_mover: np.ndarray,
+    pair_blocker_id: np.ndarray,
+    pair_bx: np.ndarray,
+    pair_by: np.ndarray,
+    rect_width: int,
+    rect_height: int,
+) -> None:
+    """ Moves the given movers of the batch from their start positions
+    to their targets, stopping at the first blocker and sliding along
+    it on the free axis. Once the slide leaves the blocker behind, the
+    blocked axis moves towards the target again. `pair_mover` holds
+    positions within the batch and every pair is a candidate for
+    collision. """
+
+    w, h = rect_width, rect_height
+    x = batch.start_x[movers].astype(np.int64)
+    y = batch.start_y[movers].astype(np.int64)
+    goal_x = batch.target_x[movers].astype(np.int64)
+    goal_y = batch.target_y[movers].astype(np.int64)
+
+    # Position of every mover of the batch within `movers`
+    slot = np.full(len(batch), -1, dtype=np.int64)
+    slot[movers] = np.arange(len(movers))
+    pair_slot = slot[pair_mover]
+
+    # Blockers holding back each axis
+    blocker_x = np.full(len(movers), NO_BLOCKER, dtype=np.int64)
+    blocker_y = np.full(len(movers), NO_BLOCKER, dtype=np.int64)
+    held_x = np.zeros(len(movers), dtype=bool)
+    held_y = np.zeros(len(movers), dtype=bool)
+    # Top of the blocker holding the OX axis, left of the one holding OY
+    holder_top = np.zeros(len(movers), dtype=np.int64)
+    holder_left = np.zeros(len(movers), dtype=np.int64)
+
+    # Free flights and slides along blockers, a few per move at most
+    holding = False
+    for _ in range(MAX_PASSES):
+        aim_x = goal_x
+        aim_y = goal_y
+        sliding = False
+        if holding:
+            # Blocked axes move again once their blockers are left behind
+            held_x &= ~left_behind(y, goal_y, holder_top, h)
+            held_y &= ~left_behind(x, goal_x, holder_left, w)
+
+            # A slide stops where it leaves the blocker behind
+            down = goal_y > y
+            edge_y = np.where(down, holder_top + h - 1, holder_top - h + 1)
+            frees_x = held_x & ~held_y & np.where(down, goal_y >= edge_y, goal_y <= edge_y)
+            right = goal_x > x
+            edge_x = np.where(right, holder_left + w - 1, holder_left - w + 1)
+            frees_y = held_y & ~held_x & np.where(right, goal_x >= edge_x, goal_x <= edge_x)
+            aim_x = np.where(held_x, x, np.where(frees_y, edge_x, goal_x))
+            aim_y = np.where(held_y, y, np.where(frees_x, edge_y, goal_y))
+            sliding = (frees_x | frees_y).any()
+
+        dx = aim_x - x
+        dy = aim_y - y
+        moving = (dx != 0) | (dy != 0)
+        if not moving.any():
+            break
+
+        pairs = np.flatnonzero(moving[pair_slot])
+        slots = pair_slot[pairs]
+        t, on_x = sweep(
+            x[slots], y[slots], dx[slots], dy[slots], pair_bx[pairs], pair_by[pairs], w, h,
+        )
+
+        # The earliest hit of every mover, the first pair on ties
+        hits = np.flatnonzero(t < np.inf)
+        if len(hits) == 0:
+            # Without slides ending at blockers every mover is where it stops
+            x, y = aim_x.copy(), aim_y.copy()
+            if not sliding:
+                break
+            continue
+        hits = hits[np.lexsort((t[hits], slots[hits]))]
+        hit_slots = slots[hits]
+        first = np.ones(len(hits), dtype=bool)
+        first[1:] = hit_slots[1:] != hit_slots[:-1]
+        first_pairs = hits[first]
+        hit_slots = hit_slots[first]
+
+        hit_t = t[first_pairs]
+        hit_on_x = on_x[first_pairs]
+        hit_pairs = pairs[first_pairs]
+        bx = pair_bx[hit_pairs]
+        by = pair_by[hit_pairs]
+        hdx = dx[hit_slots]
+        hdy = dy[hit_slots]
+
+        # The blocked axis stops at the contact, the free one where it was
+        # reached then, and the movers without hits at their aims
+        free_s = np.where(hit_on_x, y[hit_slots], x[hit_slots])
+        free_d = np.where(hit_on_x, hdy, hdx)
+        reached = toward_start(free_s + hit_t * free_d, free_d)
+        contact_x = np.where(hdx > 0, bx - w + 1, bx + w - 1)
+        contact_y = np.where(hdy > 0, by - h + 1, by + h - 1)
+        x, y = aim_x.copy(), aim_y.copy()
+        x[hit_slots] = np.where(hit_on_x, contact_x, reached)
+        y[hit_slots] = np.where(hit_on_x, reached, contact_y)
+
+        # Only the free axis keeps moving towards the target
+        blocker_ids = pair_blocker_id[hit_pairs]
+        on_x_slots = hit_slots[hit_on_x]
+        on_y_slots = hit_slots[~hit_on_x]
+        held_x[on_x_slots] = True
+        blocker_x[on_x_slots] = blocker_ids[hit_on_x]
+        holder_top[on_x_slots] = by[hit_on_x]
+        held_y[on_y_slots] = True
+        blocker_y[on_y_slots] = blocker_ids[~hit_on_x]
+        holder_left[on_y_slots] = bx[~hit_on_x]
+        holding = True
+
+    # Only the blockers still holding an axis stopped it
+    if holding:
+        held_x &= ~left_behind(y, goal_y, holder_top, h)
+        held_y &= ~left_behind(x, goal_x, holder_left, w)
+
+    batch.x[movers] = x
+    batch.y[movers] = y
+    batch.blocker_x[movers] = np.where(held_x, blocker_x, NO_BLOCKER)
+    batch.blocker_y[movers] = np.where(held_y, blocker_y, NO_BLOCKER)
+
+
+def swept_bounds(
+    batch: MoverBatch,
+    end_x: np.ndarray,
+    end_y: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ Top-left and bottom-right corners of the area
+    swept by the top-left corners of the movers. """
+
+    return (
+        np.minimum(batch.start_x, end_x),
+        np.minimum(batch.start_y, end_y),
+        np.maximum(batch.start_x, end_x),
+        np.maximum(batch.start_y, end_y),
+    )
+
+
+def overlapping_on_x(
+    lefts: np.ndarray,
+    x1: np.ndarray,
+    x2: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """ Pairs (query, item) whose left edge lies within [x1, x2]
+    of the query, found with a sort on the OX axis. """
+
+    order = np.argsort(lefts, kind="stable")
+    sorted_lefts = lefts[order]
+
+    lo = np.searchsorted(sorted_lefts, x1, side="left")
+    hi = np.searchsorted(sorted_lefts, x2, side="right")
+    counts = hi - lo
+
+    query = np.repeat(np.arange(len(x1)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return query, order[lo[query] + offsets]
+
+
+def sweep_and_prune(
+    scene_x: np.ndarray,
+    scene_y: np.ndarray,
+    x1: np.ndarray,
+    y1: np.ndarray,
+    x2: np.ndarray,
+    y2: np.ndarray,
+    rect_width: int,
+    rect_height: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """ Pairs (query, scene rectangle) whose rectangles can overlap
+    the areas swept by the top-left corners of the queries. """
+
+    query, candidate = overlapping_on_x(
+        scene_x, x1 - rect_width + 1, x2 + rect_width - 1
+    )
+
+    keep = (
+        (scene_y[candidate] >= y1[query] - rect_height + 1)
+        & (scene_y[candidate] <= y2[query] + rect_height - 1)
+    )
+    return query[keep], candidate[keep]
+
+
+def overlapping_boxes(
+    item_x: np.ndarray,
+    item_y: np.ndarray,
+    query_x: np.ndarray,
+    query_y: np.ndarray,
+    rect_width: int,
+    rect_height: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """ Pairs (query, item) of equally sized rectangles sharing pixels.
+
+    The sweep on the OX axis runs within horizontal strips as high
+    as a rectangle, so only the neighbouring strips are compared. """
+
+    item_x = np.asarray(item_x, dtype=np.int64)
+    item_y = np.asarray(item_y, dtype=np.int64)
+    query_x = np.asarray(query_x, dtype=np.int64)
+    query_y = np.asarray(query_y, dtype=np.int64)
+    if len(item_x) == 0 or len(query_x) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # Strips laid end to end on one axis, apart enough not to meet
+    x_min = min(item_x.min(), query_x.min()) - rect_width
+    span = max(item_x.max(), query_x.max()) - x_min + 2 * rect_width
+    item_keys = item_y // rect_height * span + item_x - x_min
+    query_strip = query_y // rect_height
+
+    queries, items = [], []
+    for strip in (-1, 0, 1):
+        start = (query_strip + strip) * span + query_x - x_min
+        query, item = overlapping_on_x(
+            item_keys, start - rect_width + 1, start + rect_width - 1
+        )
+        keep = np.abs(item_y[item] - query_y[query]) < rect_height
+        queries.append(query[keep])
+        items.append(item[keep])
+    return np.concatenate(queries), np.concatenate(items)
+
+
+def resolve_batch(engine, batch: MoverBatch) -> MoverBatch:
+    """ Resolves all movers of the batch against the scene of the engine.
+
+    The movers are swept in parallel against the scene as it was before
+    the call. Movers whose swept areas meet each other are then resolved
+    again one by one in the batch order, so the result never overlaps. """
+
+    w, h = engine.rect_width, engine.rect_height
+
+    batch.target_x = np.clip(batch.target_x, 0, engine.width - w).astype(np.int32)
+    batch.target_y = np.clip(batch.target_y, 0, engine.height - h).astype(np.int32)
+
+    scene_ids, scene_x, scene_y = engine.store.columns()
+
+    x1, y1, x2, y2 = swept_bounds(batch, batch.target_x, batch.target_y)
+    pair_mover, candidate = sweep_and_prune(scene_x, scene_y, x1, y1, x2, y2, w, h)
+
+    not_self = scene_ids[candidate] != batch.rect_ids[pair_mover]
+    pair_mover = pair_mover[not_self]
+    candidate = candidate[not_self]
+
+    resolve_pairs(
+        batch,
+        np.arange(len(batch)),
+        pair_mover,
+        scene_ids[candidate],
+        scene_x[candidate].astype(np.int64),
+        scene_y[candidate].astype(np.int64),
+        w,
+        h,
+    )
+
+    # Movers interfering with each other
+    x1, y1, x2, y2 = swept_bounds(batch, batch.x, batch.y)
+    # Of two meeting areas at least one contains the left edge of the other
+    query, other = overlapping_on_x(x1, x1, x2 + w - 1)
+    meet = (
+        (query != other)
+        & (y1[other] <= y2[query] + h - 1) & (y1[query] <= y2[other] + h - 1)
+    )
+    conflicts = np.zeros(len(batch), dtype=bool)
+    conflicts[query[meet]] = True
+    conflicts[other[meet]] = True
+
+    for i in np.flatnonzero(~conflicts):
+        engine.move_to(int(batch.rect_ids[i]), int(batch.x[i]), int(batch.y[i]))
+
+    for i in np.flatnonzero(conflicts):
+        rect_id = int(batch.rect_ids[i])
+        sx, sy = int(batch.start_x[i]), int(batch.start_y[i])
+        ex, ey = int(batch.target_x[i]), int(batch.target_y[i])
+
+        blockers = engine.blockers_on_path(rect_id, sx, sy, ex, ey)
+
+        resolve_pairs(
+            batch,
+            np.array([i]),
+            np.full(len(blockers), i, dtype=np.int64),
+            blockers,
+            engine.store.x[blockers].astype(np.int64),
+            engine.store.y[blockers].astype(np.int64),
+            w,
+            h,
+        )
+        engine.move_to(rect_id, int(batch.x[i]), int(batch.y[i]))
+
+    return batch
@@ -0,0 +1 @@
+""" Headless performance benchmarks, run with `python -m benchmarks`. """
@@ -0,0 +1,67 @@
+""" Headless benchmarks of the event handlers of MainWindow.
+
+    python -m benchmarks --sizes 100 1000 --save benchmarks/baselines/local.json
+    python -m benchmarks --sizes 100 1000 --compare benchmarks/baselines/local.json
+"""
+
+import argparse
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--scenarios", nargs="+", default=None,
+                        help="scenarios to run, all by default")
+    parser.add_argument("--sizes", nargs="+", type=int,
+                        default=[10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6],
+                        help="numbers of rectangles in the scene")
+    parser.add_argument("--events", type=int, default=1000,
+                        help="timed events per scenario and size")
+    parser.add_argument("--budget", type=float, default=30.0,
+                        help="seconds of timed events per scenario and size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", metavar="PATH",
+                        help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH",
+                        help="fail on regressions against a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+
+    from benchmarks.runner import run, save_baseline, compare
+    from benchmarks.scenarios import SCENARIOS
+
+    results = []
+    print("{:<14}{:>9}{:>14}{:>11}{:>11}{:>12}".format(
+        "scenario", "size", "events/s", "p50 ms", "p99 ms", "peak MB"
+    ))
+    for scenario in args.scenarios or SCENARIOS:
+        for size in args.sizes:
+            result = run(scenario, size, args.events, args.seed, args.budget)
+            results.append(result)
+            print("{:<14}{:>9}{:>14.0f}{:>11.3f}{:>11.3f}{:>12.1f}".format(
+                scenario, size, result.events_per_second,
+                result.p50_ms, result.p99_ms, result.peak_memory_mb,
+            ), flush=True)
+
+    if args.save:
+        save_baseline(args.save, results)
+
+    if args.compare:
+        regressions = compare(args.compare, results, args.tolerance)
+        for regression in regressions:
+            print("Regression:", regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.scenarios import SCENARIOS
+
+
+@dataclass
+class Result:
+    scenario: str
+    size: int
+    events: int
+    events_per_second: float
+    p50_ms: float
+    p99_ms: float
+    # Peak of the traced allocations while building the scene and warming up
+    peak_memory_mb: float
+
+    @property
+    def key(self) -> str:
+        return "{}/{}".format(self.scenario, self.size)
+
+
+def run(scenario: str, size: int, events: int, seed: int = 0, budget: float = 30.0) -> Result:
+    """ Times up to `events` events, stopping early once
+    the timed events took `budget` seconds. """
+
+    build, script = SCENARIOS[scenario]
+    rng = np.random.default_rng(seed)
+
+    # Memory is traced apart from the timed events, tracing slows them down
+    tracemalloc.start()
+    window = build(size, rng)
+    steps = script(window, rng, events)
+    warm_up = next(steps, None)
+    if warm_up is not None:
+        warm_up()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies: List[float] = []
+    clock = time.perf_counter
+    started = clock()
+    for step in steps:
+        begin = clock()
+        step()
+        latencies.append(clock() - begin)
+        if begin - started > budget:
+            break
+    elapsed = clock() - started
+
+    timed = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    window.deleteLater()
+    return Result(
+        scenario=scenario,
+        size=size,
+        events=len(latencies),
+        events_per_second=len(latencies) / elapsed if elapsed > 0 else 0.0,
+        p50_ms=float(np.percentile(timed, 50)),
+        p99_ms=float(np.percentile(timed, 99)),
+        peak_memory_mb=peak / 2 ** 20,
+    )
+
+
+def save_baseline(path: str, results: List[Result]) -> None:
+    with open(path, "w") as file:
+        json.dump({result.key: asdict(result) for result in results}, file, indent=2)
+        file.write("\n")
+
+
+def compare(path: str, results: List[Result], tolerance: float) -> List[str]:
+    """ Descriptions of the results slower than the baseline
+    by more than the tolerance, a fraction of the baseline. """
+
+    with open(path) as file:
+        baseline: Dict[str, dict] = json.load(file)
+
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.key)
+        if expected is None:
+            continue
+        if result.events_per_second < expected["events_per_second"] * (1 - tolerance):
+            regressions.append("{}: {:.0f} events/s, baseline {:.0f}".format(
+                result.key, result.events_per_second, expected["events_per_second"]
+            ))
+        if result.p99_ms > expected["p99_ms"] * (1 + tolerance):
+            regressions.append("{}: p99 {:.3f} ms, baseline {:.3f}".format(
+                result.key, result.p99_ms, expected["p99_ms"]
+            ))
+    return regressions
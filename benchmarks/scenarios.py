@@ -0,0 +1,98 @@
+from typing import Callable, Dict, Iterator, Tuple
+
+import numpy as np
+from PyQt5.QtGui import QImage, QMouseEvent
+from PyQt5.QtCore import Qt, QEvent, QPointF
+
+from app import MainWindow
+from benchmarks.scenes import lattice_window, paint_window
+
+
+# Builds the window of the given size and yields the timed events
+Scenario = Callable[[MainWindow, np.random.Generator, int], Iterator[Callable[[], None]]]
+
+
+def mouse_event(kind: QEvent.Type, x: int, y: int, button: Qt.MouseButton) -> QMouseEvent:
+    buttons = Qt.NoButton if kind == QEvent.MouseButtonRelease else button
+    return QMouseEvent(kind, QPointF(x, y), button, buttons, Qt.NoModifier)
+
+
+def drag(window: MainWindow, rng: np.random.Generator, events: int) -> Iterator[Callable[[], None]]:
+    """ A random walk of the cursor dragging a rectangle in the middle of the scene. """
+
+    store = window.engine.store
+    rect_id = int(store.ids()[len(store) // 2])
+    x, y = store.center(rect_id)
+    window.mousePressEvent(mouse_event(QEvent.MouseButtonPress, x, y, Qt.LeftButton))
+
+    steps = rng.integers(-30, 31, size=(events, 2))
+    for dx, dy in steps.tolist():
+        x, y = x + dx, y + dy
+        event = mouse_event(QEvent.MouseMove, x, y, Qt.LeftButton)
+        yield lambda event=event: window.mouseMoveEvent(event)
+
+    window.mouseReleaseEvent(mouse_event(QEvent.MouseButtonRelease, x, y, Qt.LeftButton))
+
+
+def right_click(window: MainWindow, rng: np.random.Generator, events: int) -> Iterator[Callable[[], None]]:
+    """ Right clicks on rectangles and on random points, hit-testing
+    the connections and creating or removing them. """
+
+    store = window.engine.store
+    ids = store.ids()
+    on_rectangles = rng.random(events) < 0.5
+    targets = rng.choice(ids, events)
+    width, height = window.width(), window.height()
+
+    for on_rectangle, rect_id in zip(on_rectangles.tolist(), targets.tolist()):
+        if on_rectangle and store.is_alive(rect_id):
+            x, y = store.center(rect_id)
+        else:
+            x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        event = mouse_event(QEvent.MouseButtonPress, x, y, Qt.RightButton)
+        yield lambda event=event: window.mousePressEvent(event)
+
+
+def creation(window: MainWindow, rng: np.random.Generator, events: int) -> Iterator[Callable[[], None]]:
+    """ Double clicks at random points, most of them on taken spots
+    that snap to the closest free place, each allocating a color. """
+
+    points = np.column_stack((
+        rng.integers(0, window.width(), events),
+        rng.integers(0, window.height(), events),
+    ))
+    for x, y in points.tolist():
+        event = mouse_event(QEvent.MouseButtonDblClick, x, y, Qt.LeftButton)
+        yield lambda event=event: window.mouseDoubleClickEvent(event)
+
+
+def paint(window: MainWindow, rng: np.random.Generator, events: int) -> Iterator[Callable[[], None]]:
+    """ Full repaints into an image, the static layer rebuilt every time. """
+
+    image = QImage(window.size(), QImage.Format_ARGB32_Premultiplied)
+
+    def repaint() -> None:
+        window.renderer.invalidate()
+        window.render(image)
+
+    for _ in range(events):
+        yield repaint
+
+
+def paint_cached(window: MainWindow, rng: np.random.Generator, events: int) -> Iterator[Callable[[], None]]:
+    """ Repaints into an image from the cached static layer. """
+
+    image = QImage(window.size(), QImage.Format_ARGB32_Premultiplied)
+    window.render(image)
+    for _ in range(events):
+        yield lambda: window.render(image)
+
+
+# Name: (scene builder, scenario)
+SCENARIOS: Dict[str, Tuple[Callable[[int, np.random.Generator], MainWindow], Scenario]] = {
+    "drag": (lattice_window, drag),
+    "right_click": (lattice_window, right_click),
+    "creation": (lambda size, rng: lattice_window(size, rng, connected=False), creation),
+    "paint": (paint_window, paint),
+    "paint_cached": (paint_window, paint_cached),
+}
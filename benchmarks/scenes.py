@@ -0,0 +1,68 @@
+import math
+
+import numpy as np
+
+from app import MainWindow
+from connection import Connection
+from rectangle import Rectangle
+
+
+RECT_HEIGHT = 40
+RECT_WIDTH = 2 * RECT_HEIGHT
+
+# Window size of the paint scenarios, whatever the number of rectangles
+PAINT_SIZE = (1200, 800)
+
+
+def lattice_window(size: int, rng: np.random.Generator, connected: bool = True) -> MainWindow:
+    """ Window holding `size` rectangles on a jittered lattice, every
+    rectangle in a cell twice its size, so the density does not depend
+    on the size. Neighbouring rectangles are connected in pairs. """
+
+    columns = max(1, math.ceil(math.sqrt(size / 2)))
+    rows = math.ceil(size / columns)
+    cell_width, cell_height = 2 * RECT_WIDTH, 2 * RECT_HEIGHT
+
+    window = MainWindow(
+        app_height=rows * cell_height,
+        app_width=columns * cell_width,
+        rect_height=RECT_HEIGHT,
+        frame_rate=0,
+    )
+
+    cells = np.arange(size)
+    x = cells % columns * cell_width + rng.integers(0, RECT_WIDTH, size)
+    y = cells // columns * cell_height + rng.integers(0, RECT_HEIGHT, size)
+    rect_ids = window.engine.add_many(x.astype(np.int32), y.astype(np.int32))
+
+    if connected:
+        store = window.engine.store
+        for rect1_id, rect2_id in zip(rect_ids[0:-1:2].tolist(), rect_ids[1::2].tolist()):
+            window.connections.add(
+                Connection(Rectangle(store, rect1_id), Rectangle(store, rect2_id))
+            )
+    return window
+
+
+def paint_window(size: int, rng: np.random.Generator) -> MainWindow:
+    """ Window of PAINT_SIZE crowded with `size` rectangles,
+    overlapping as the benchmark does not drag them. """
+
+    width, height = PAINT_SIZE
+    window = MainWindow(
+        app_height=height,
+        app_width=width,
+        rect_height=RECT_HEIGHT,
+        frame_rate=0,
+    )
+    rect_ids = window.engine.add_many(
+        rng.integers(0, width - RECT_WIDTH, size).astype(np.int32),
+        rng.integers(0, height - RECT_HEIGHT, size).astype(np.int32),
+    )
+
+    store = window.engine.store
+    for rect1_id, rect2_id in zip(rect_ids[0:-1:2].tolist(), rect_ids[1::2].tolist()):
+        window.connections.add(
+            Connection(Rectangle(store, rect1_id), Rectangle(store, rect2_id))
+        )
+    return window
@@ -1,7 +1,5 @@
 from dataclasses import dataclass
 
-from rectangle import Rectangle
-
 
 @dataclass
 class Collision:
@@ -10,5 +8,6 @@ class Collision:
     TB = "TB"
     BT = "BT"
 
-    rectangle: Rectangle
+    # Id of the blocking rectangle in the collision engine
+    rect_id: int
     direction: str
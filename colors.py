@@ -0,0 +1,129 @@
+import random
+from typing import Iterable, List, Set
+
+import numpy as np
+
+
+# RGB value of the border of highlighted rectangles
+HIGHLIGHTED_BORDER_RGB = 0x000000
+
+COLOR_COUNT = 1 << 24
+COLOR_MASK = COLOR_COUNT - 1
+
+
+def scramble(value: int) -> int:
+    """ Bijection of the 24-bit colors, so walking a counter
+    visits every color once in a random-looking order.
+    Also works on int64 arrays. """
+
+    value ^= value >> 12
+    value = (value * 0x9E3779) & COLOR_MASK
+    value ^= value >> 11
+    value = (value * 0x5BD1E5) & COLOR_MASK
+    value ^= value >> 13
+    return value
+
+
+class ColorAllocator:
+    """ Hands out unique 0xRRGGBB colors and takes them back, in O(1). """
+
+    def __init__(
+        self,
+        reserved: Iterable[int] = (HIGHLIGHTED_BORDER_RGB,),
+        seed: int = None,
+    ):
+        self.used: Set[int] = set(reserved)
+        self.reserved_count = len(self.used)
+        self.released: List[int] = []
+
+        # Position in the scrambled sequence of all colors
+        self.start = random.Random(seed).randrange(COLOR_COUNT)
+        self.counter = 0
+
+
+    def allocate(self) -> int:
+        while self.released:
+            color = self.released.pop()
+            if color not in self.used:
+                self.used.add(color)
+                return color
+
+        while self.counter < COLOR_COUNT:
+            color = scramble((self.start + self.counter) & COLOR_MASK)
+            self.counter += 1
+            if color not in self.used:
+                self.used.add(color)
+                return color
+
+        raise RuntimeError("All colors are in use")
+
+
+    def allocate_many(self, count: int) -> np.ndarray:
+        """ Same as calling allocate count times, with the scrambled
+        colors computed in bulk. """
+
+        colors: List[int] = []
+        while self.released and len(colors) < count:
+            color = self.released.pop()
+            if color not in self.used:
+                self.used.add(color)
+                colors.append(color)
+
+        while len(colors) < count and self.counter < COLOR_COUNT:
+            steps = np.arange(
+                self.counter,
+                min(self.counter + count - len(colors), COLOR_COUNT),
+                dtype=np.int64,
+            )
+            self.counter += len(steps)
+
+            fresh = [
+                color for color in scramble((self.start + steps) & COLOR_MASK).tolist()
+                if color not in self.used
+            ]
+            self.used.update(fresh)
+            colors.extend(fresh)
+
+        if len(colors) < count:
+            for color in colors:
+                self.release(color)
+            raise RuntimeError("All colors are in use")
+        return np.array(colors, dtype=np.int32)
+
+
+    def claim(self, color: int) -> bool:
+        """ Marks a color obtained elsewhere, e.g. from a saved scene,
+        as used. Returns False if it was already taken. """
+
+        if color in self.used:
+            return False
+        self.used.add(color)
+        return True
+
+
+    def claim_many(self, colors: Iterable[int]) -> np.ndarray:
+        """ Marks many colors obtained elsewhere as used and returns them.
+        Colors already taken, reserved or repeated in the batch are
+        replaced with newly allocated ones, so no two rectangles share
+        a color and a later release never frees a color still in use. """
+
+        colors = [int(color) for color in colors]
+        taken = [i for i, color in enumerate(colors) if not self.claim(color)]
+        if taken:
+            for i, color in zip(taken, self.allocate_many(len(taken)).tolist()):
+                colors[i] = color
+        return np.array(colors, dtype=np.int32)
+
+
+    def release(self, color: int) -> None:
+        if color in self.used:
+            self.used.remove(color)
+            self.released.append(color)
+
+
+    def __contains__(self, color: int) -> bool:
+        return color in self.used
+
+
+    def __len__(self) -> int:
+        return len(self.used) - self.reserved_count
@@ -1,7 +1,13 @@
+import math
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
 from PyQt5.QtGui import QPainter, QPen
-from PyQt5.QtCore import Qt, QRect, QPoint
+from PyQt5.QtCore import Qt, QPoint
 
 from rectangle import Rectangle
+from spatial_index import SpatialIndex, RTreeIndex
+from store import RectangleStore
 
 class Connection:
     def __init__(self, rect1: Rectangle, rect2: Rectangle):
@@ -34,3 +40,412 @@ class Connection:
             ):
                 return True
         return False
+
+
+class SegmentCache:
+    """ Segments between the centers of connected rectangles,
+    one row of int64 and float64 arrays per connection.
+
+    A row holds the endpoints, the direction, the length, the constant
+    term of the line equation and the bounding box, so drawing and
+    hit-testing do not go back to the rectangles. Rows of removed
+    connections are reused. """
+
+    COLUMNS = (
+        "rect1", "rect2", "order", "x1", "y1", "x2", "y2", "dx", "dy", "offset",
+        "left", "top", "right", "bottom",
+    )
+
+    def __init__(self, store: RectangleStore, capacity: int = 256):
+        self.store = store
+        self.size = 0
+        self.free_rows: List[int] = []
+
+        for name in self.COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype=np.int64))
+        self.length = np.zeros(capacity, dtype=np.float64)
+
+
+    def add(self, rect1_id: int, rect2_id: int, order: int) -> int:
+        if self.free_rows:
+            row = self.free_rows.pop()
+        else:
+            if self.size == len(self.length):
+                self.reserve(2 * self.size)
+            row = self.size
+            self.size += 1
+
+        self.rect1[row] = rect1_id
+        self.rect2[row] = rect2_id
+        self.order[row] = order
+        self.update_row(row)
+        return row
+
+
+    def remove(self, row: int) -> None:
+        self.free_rows.append(row)
+
+
+    def reserve(self, capacity: int) -> None:
+        if capacity <= len(self.length):
+            return
+        for name in self.COLUMNS + ("length",):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+
+    def update(self, rows: np.ndarray) -> None:
+        """ Recomputes the rows from the current centers of the rectangles. """
+
+        x1, y1 = self.store.centers(self.rect1[rows])
+        x2, y2 = self.store.centers(self.rect2[rows])
+        self.x1[rows], self.y1[rows] = x1, y1
+        self.x2[rows], self.y2[rows] = x2, y2
+        self.dx[rows] = x2 - x1
+        self.dy[rows] = y2 - y1
+        self.offset[rows] = x2 * y1 - y2 * x1
+        self.length[rows] = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+        self.left[rows] = np.minimum(x1, x2)
+        self.top[rows] = np.minimum(y1, y2)
+        self.right[rows] = np.maximum(x1, x2)
+        self.bottom[rows] = np.maximum(y1, y2)
+
+
+    def update_row(self, row: int) -> None:
+        """ update() of a single row, on plain integers. """
+
+        x1, y1 = self.store.center(int(self.rect1[row]))
+        x2, y2 = self.store.center(int(self.rect2[row]))
+        self.x1[row], self.y1[row] = x1, y1
+        self.x2[row], self.y2[row] = x2, y2
+        self.dx[row] = x2 - x1
+        self.dy[row] = y2 - y1
+        self.offset[row] = x2 * y1 - y2 * x1
+        self.length[row] = math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+        self.left[row] = min(x1, x2)
+        self.top[row] = min(y1, y2)
+        self.right[row] = max(x1, x2)
+        self.bottom[row] = max(y1, y2)
+
+
+    def bounds(self, row: int, margin: int = 0) -> Tuple[int, int, int, int]:
+        left, top = int(self.left[row]), int(self.top[row])
+        return (
+            left - margin,
+            top - margin,
+            int(self.right[row]) - left + 2 * margin + 1,
+            int(self.bottom[row]) - top + 2 * margin + 1,
+        )
+
+
+    def endpoints(self, rows: np.ndarray) -> np.ndarray:
+        """ Rows of x1, y1, x2, y2. """
+
+        return np.column_stack((self.x1[rows], self.y1[rows], self.x2[rows], self.y2[rows]))
+
+
+    def contains(self, rows: np.ndarray, x0: int, y0: int, variance: int = 10) -> np.ndarray:
+        """ Connection.contains for many cached segments at once. """
+
+        numerator = np.abs(self.dy[rows] * x0 - self.dx[rows] * y0 + self.offset[rows])
+        length = self.length[rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distance = np.where(length != 0, numerator / length, np.inf)
+
+        return (
+            (distance <= variance)
+            & (self.left[rows] <= x0) & (x0 <= self.right[rows])
+            & (self.top[rows] <= y0) & (y0 <= self.bottom[rows])
+        )
+
+
+    def row_contains(self, row: int, x0: int, y0: int, variance: int = 10) -> bool:
+        """ contains() of a single row, for the few candidates of a point. """
+
+        if not (
+            self.left[row] <= x0 <= self.right[row]
+            and self.top[row] <= y0 <= self.bottom[row]
+        ):
+            return False
+        length = self.length[row]
+        if length == 0:
+            return False
+        numerator = abs(int(self.dy[row]) * x0 - int(self.dx[row]) * y0 + int(self.offset[row]))
+        return numerator / length <= variance
+
+
+class ConnectionGraph:
+    """ Connections indexed by the unordered pair of rectangle ids
+    and by every rectangle they touch.
+
+    Given the store of the rectangles, the segments between their
+    centers are cached in a SegmentCache and kept in a spatial index
+    for drawing and hit-testing. Moving a rectangle only marks the
+    segments of its connections as stale, they are recomputed together
+    before the next query. """
+
+    def __init__(
+        self,
+        store: RectangleStore = None,
+        index: SpatialIndex = None,
+        variance: int = 10,
+    ):
+        self.edges: Dict[Tuple[int, int], Connection] = {}
+        # Dicts are used as ordered sets of the keys of the incident edges
+        self.adjacency: Dict[int, Dict[Tuple[int, int], None]] = {}
+
+        # Sequence numbers of the edges, earlier connections win hit-tests
+        self.order: Dict[Tuple[int, int], int] = {}
+        self.next_order = 0
+
+        self.store = store
+        self.variance = variance
+        self.index: SpatialIndex = index if index is not None else RTreeIndex()
+
+        self.segments: Optional[SegmentCache] = None
+        # Rows of the edges in the segment cache
+        self.rows: Dict[Tuple[int, int], int] = {}
+        # Edges whose segments moved since the last query
+        self.stale: Dict[Tuple[int, int], None] = {}
+        if store is not None:
+            self.segments = SegmentCache(store)
+            store.move_listeners.append(self.on_rectangle_moved)
+
+
+    @staticmethod
+    def key(rect1_id: int, rect2_id: int) -> Tuple[int, int]:
+        return (rect1_id, rect2_id) if rect1_id <= rect2_id else (rect2_id, rect1_id)
+
+
+    def add(self, connection: Connection) -> bool:
+        """ Adds the connection unless the rectangles are already connected. """
+
+        key = self.key(connection.rect1.id, connection.rect2.id)
+        if key in self.edges:
+            return False
+
+        self.edges[key] = connection
+        for rect_id in key:
+            self.adjacency.setdefault(rect_id, {})[key] = None
+
+        self.order[key] = self.next_order
+        self.next_order += 1
+        if self.segments is not None:
+            self.rows[key] = self.segments.add(*key, self.order[key])
+        self.index.insert(key, *self.segment_bounds(connection))
+        return True
+
+
+    def remove(self, connection: Connection) -> None:
+        key = self.key(connection.rect1.id, connection.rect2.id)
+        del self.edges[key]
+        del self.order[key]
+        self.index.remove(key)
+        if self.segments is not None:
+            self.segments.remove(self.rows.pop(key))
+            self.stale.pop(key, None)
+        for rect_id in key:
+            incident = self.adjacency.get(rect_id)
+            if incident is not None and key in incident:
+                del incident[key]
+                if not incident:
+                    del self.adjacency[rect_id]
+
+
+    def connect(self, rect1_id: int, rect2_id: int) -> bool:
+        """ Connects two rectangles of the store by their ids,
+        unless they are already connected. """
+
+        return self.add(
+            Connection(Rectangle(self.store, rect1_id), Rectangle(self.store, rect2_id))
+        )
+
+
+    def disconnect(self, rect1_id: int, rect2_id: int) -> bool:
+        """ Removes the connection between the rectangles, if there is one. """
+
+        connection = self.get(rect1_id, rect2_id)
+        if connection is None:
+            return False
+        self.remove(connection)
+        return True
+
+
+    def segment_bounds(self, connection: Connection) -> Tuple[int, int, int, int]:
+        """ Bounding box of the segment between the centers,
+        inflated by the hit-test variance. """
+
+        if self.segments is not None:
+            self.refresh()
+            key = self.key(connection.rect1.id, connection.rect2.id)
+            return self.segments.bounds(self.rows[key], self.variance)
+
+        center1 = connection.rect1.center()
+        center2 = connection.rect2.center()
+        x1, y1 = center1.x(), center1.y()
+        x2, y2 = center2.x(), center2.y()
+
+        return (
+            min(x1, x2) - self.variance,
+            min(y1, y2) - self.variance,
+            abs(x1 - x2) + 2 * self.variance + 1,
+            abs(y1 - y2) + 2 * self.variance + 1,
+        )
+
+
+    def on_rectangle_moved(self, rect_id: int) -> None:
+        self.stale.update(self.adjacency.get(rect_id, {}))
+
+
+    def refresh(self) -> None:
+        """ Recomputes the stale segments and their index entries. """
+
+        if not self.stale:
+            return
+        keys = list(self.stale)
+        self.stale.clear()
+        self.segments.update(np.array([self.rows[key] for key in keys]))
+        for key in keys:
+            self.index.update(key, *self.segments.bounds(self.rows[key], self.variance))
+
+
+    def connections_in(self, x: int, y: int, width: int, height: int) -> List[Connection]:
+        """ Connections whose segments may cross the area, oldest first. """
+
+        self.refresh()
+        keys = sorted(self.index.query(x, y, width, height), key=self.order.__getitem__)
+        return [self.edges[key] for key in keys]
+
+
+    def rows_in(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """ Segment cache rows of connections_in. Requires the store. """
+
+        self.refresh()
+        rows = np.fromiter(
+            (self.rows[key] for key in self.index.query(x, y, width, height)), dtype=np.int64
+        )
+        return rows[np.argsort(self.segments.order[rows], kind="stable")]
+
+
+    def rows_of(self, connections: List[Connection]) -> np.ndarray:
+        self.refresh()
+        return np.array([
+            self.rows[self.key(conn.rect1.id, conn.rect2.id)] for conn in connections
+        ], dtype=np.int64)
+
+
+    def connection_at(self, x: int, y: int) -> Optional[Connection]:
+        """ The earliest connection passing through the point. """
+
+        key = self.key_at(x, y)
+        return self.edges[key] if key is not None else None
+
+
+    def key_at(self, x: int, y: int) -> Optional[Tuple[int, int]]:
+        """ Pair of rectangle ids of connection_at. """
+
+        if self.segments is None:
+            point = QPoint(x, y)
+            found = None
+            for key in self.index.query_point(x, y):
+                if (
+                    (found is None or self.order[key] < self.order[found])
+                    and self.edges[key].contains(point, self.variance)
+                ):
+                    found = key
+            return found
+
+        self.refresh()
+        found = None
+        for key in self.index.query_point(x, y):
+            if (
+                (found is None or self.order[key] < self.order[found])
+                and self.segments.row_contains(self.rows[key], x, y, self.variance)
+            ):
+                found = key
+        return found
+
+
+    def connection_at_vectorized(self, x: int, y: int) -> Optional[Connection]:
+        """ Same as connection_at, testing every segment in one NumPy pass
+        instead of querying the index. Requires the store. """
+
+        if not self.edges:
+            return None
+
+        self.refresh()
+        # Rows are listed in the order the edges were added
+        keys = list(self.rows)
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(keys))
+        hits = np.flatnonzero(self.segments.contains(rows, x, y, self.variance))
+        if len(hits) == 0:
+            return None
+        return self.edges[keys[hits[0]]]
+
+
+    def get(self, rect1_id: int, rect2_id: int) -> Optional[Connection]:
+        return self.edges.get(self.key(rect1_id, rect2_id))
+
+
+    def connected(self, rect1_id: int, rect2_id: int) -> bool:
+        return self.key(rect1_id, rect2_id) in self.edges
+
+
+    def incident(self, rect_id: int) -> List[Connection]:
+        return [self.edges[key] for key in self.adjacency.get(rect_id, ())]
+
+
+    def neighbors(self, rect_id: int) -> List[int]:
+        return [
+            key[1] if key[0] == rect_id else key[0]
+            for key in self.adjacency.get(rect_id, ())
+        ]
+
+
+    def degree(self, rect_id: int) -> int:
+        return len(self.adjacency.get(rect_id, ()))
+
+
+    def remove_rectangle(self, rect_id: int) -> List[Connection]:
+        """ Removes and returns all connections of the rectangle. """
+
+        removed = self.incident(rect_id)
+        for connection in removed:
+            self.remove(connection)
+        return removed
+
+
+    def connected_components(self) -> List[Set[int]]:
+        """ Groups of rectangle ids linked by connections.
+        Rectangles without connections are not included. """
+
+        components = []
+        visited: Set[int] = set()
+        for start in self.adjacency:
+            if start in visited:
+                continue
+            visited.add(start)
+            component = {start}
+            stack = [start]
+            while stack:
+                for neighbor in self.neighbors(stack.pop()):
+                    if neighbor not in visited:
+                        visited.add(neighbor)
+                        component.add(neighbor)
+                        stack.append(neighbor)
+            components.append(component)
+        return components
+
+
+    def __iter__(self) -> Iterator[Connection]:
+        return iter(self.edges.values())
+
+
+    def __len__(self) -> int:
+        return len(self.edges)
+
+
+    def __contains__(self, connection: Connection) -> bool:
+        return self.edges.get(self.key(connection.rect1.id, connection.rect2.id)) is connection
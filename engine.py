@@ -0,0 +1,466 @@
+import math
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from batch import (
+    MoverBatch, overlapping_boxes, resolve_batch, resolve_pairs, sweep_and_prune,
+)
+from collision import Collision
+from colors import ColorAllocator
+from free_space import FreeSpace, closest_free
+from spatial_index import SpatialIndex, GridIndex
+from store import RectangleStore
+
+
+Point = Tuple[int, int]
+
+# Id returned by add_rectangles for the rejected rectangles
+REJECTED = -1
+
+
+class CollisionEngine:
+    """ Qt-free scene of equally sized rectangles and the drag resolution
+    that keeps them from overlapping. Positions are top-left corners. """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        rect_width: int,
+        rect_height: int,
+        index: SpatialIndex = None,
+        store: RectangleStore = None,
+        colors: ColorAllocator = None,
+    ):
+        self.width = width
+        self.height = height
+        self.rect_width = rect_width
+        self.rect_height = rect_height
+
+        self.store = store if store is not None else RectangleStore()
+        self.index: SpatialIndex = (
+            index if index is not None
+            else GridIndex(rect_width, rect_height)
+        )
+        self.colors = colors if colors is not None else ColorAllocator()
+        for rect_id in self.store.ids():
+            self.index.insert(int(rect_id), *self.store.bounds(rect_id))
+            if not self.colors.claim(int(self.store.color[rect_id])):
+                self.store.color[rect_id] = self.colors.allocate()
+        self.store.move_listeners.append(self.on_moved)
+
+        # Cells where a new rectangle fits, for placing rectangles
+        self.free_space = FreeSpace(width, height, rect_width, rect_height)
+        self.free_space.add_many(*self.store.columns())
+
+        # Rectangle being dragged and the obstacles it is resting against
+        self.active_id: Optional[int] = None
+        self.collision_x: Collision = None
+        self.collision_y: Collision = None
+
+
+    def add(self, x: int, y: int, color: int = None) -> int:
+        # A color in use elsewhere is replaced, colors identify rectangles
+        if color is None or not self.colors.claim(color):
+            color = self.colors.allocate()
+
+        rect_id = self.store.add(x, y, self.rect_width, self.rect_height, color)
+        self.index.insert(rect_id, x, y, self.rect_width, self.rect_height)
+        self.free_space.add(rect_id, x, y)
+        return rect_id
+
+
+    def add_many(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        colors: np.ndarray = None,
+    ) -> np.ndarray:
+        """ Adds many rectangles at once without checking for overlaps
+        and returns their ids. Colors in use elsewhere are replaced. """
+
+        if colors is None:
+            colors = self.colors.allocate_many(len(x))
+        else:
+            colors = self.colors.claim_many(colors.tolist())
+
+        width = np.full(len(x), self.rect_width, dtype=np.int32)
+        height = np.full(len(x), self.rect_height, dtype=np.int32)
+        rect_ids = self.store.extend(x, y, width, height, colors)
+        self.index.insert_many(
+            rect_ids.tolist(),
+            np.asarray(x, dtype=np.int64),
+            np.asarray(y, dtype=np.int64),
+            width.astype(np.int64),
+            height.astype(np.int64),
+        )
+        self.free_space.add_many(rect_ids, x, y)
+        return rect_ids
+
+
+    def restore(
+        self,
+        rect_ids: np.ndarray,
+        x: np.ndarray,
+        y: np.ndarray,
+        colors: np.ndarray,
+    ) -> None:
+        """ Adds removed rectangles back with their old ids and colors. """
+
+        colors = self.colors.claim_many(colors.tolist())
+        width = np.full(len(x), self.rect_width, dtype=np.int32)
+        height = np.full(len(x), self.rect_height, dtype=np.int32)
+        self.store.restore(rect_ids, x, y, width, height, colors)
+        self.index.insert_many(
+            rect_ids.tolist(),
+            np.asarray(x, dtype=np.int64),
+            np.asarray(y, dtype=np.int64),
+            width.astype(np.int64),
+            height.astype(np.int64),
+        )
+        self.free_space.add_many(rect_ids, x, y)
+
+
+    def add_rectangles(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """ Adds the rectangles with the given top-left corners that fit
+        in the window and overlap neither the scene nor an earlier
+        rectangle of the batch. Unlike double-clicks and place_rectangles,
+        rectangles on taken spots are rejected, not moved. Returns the ids
+        aligned with the batch, REJECTED for the rest. """
+
+        # Wide enough for corners far out of the window to be rejected, not wrapped
+        x = np.asarray(x, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+
+        accepted = self.placeable(x, y)
+        rect_ids = np.full(len(x), REJECTED, dtype=np.int64)
+        rect_ids[accepted] = self.add_many(x[accepted], y[accepted])
+        return rect_ids
+
+
+    def placeable(self, x: np.ndarray, y: np.ndarray, contact: int = 0) -> np.ndarray:
+        """ Which rectangles of the batch add_rectangles would accept.
+        With contact 1 rectangles may share one column or row of pixels,
+        as dragged rectangles resting against each other do. """
+
+        w, h = self.rect_width, self.rect_height
+
+        accepted = self.is_within_window_many(x + w // 2, y + h // 2)
+
+        # Overlaps with the scene
+        _, scene_x, scene_y = self.store.columns()
+        query, _ = overlapping_boxes(scene_x, scene_y, x, y, w - contact, h - contact)
+        accepted[query] = False
+
+        # Overlaps within the batch, pairs of a later and an earlier rectangle
+        later, earlier = overlapping_boxes(x, y, x, y, w - contact, h - contact)
+        meet = (earlier < later) & accepted[later] & accepted[earlier]
+        later, earlier = later[meet], earlier[meet]
+
+        # Only rectangles meeting an earlier one depend on the batch order
+        order = np.argsort(later, kind="stable")
+        is_accepted = accepted.tolist()
+        for rect, other in zip(later[order].tolist(), earlier[order].tolist()):
+            if is_accepted[other]:
+                is_accepted[rect] = False
+
+        return np.array(is_accepted, dtype=bool)
+
+
+    def place(self, x: int, y: int, max_radius: int = None) -> Optional[Point]:
+        """ The top-left corner closest to the given one where a new
+        rectangle fits in the window without sharing a pixel with another,
+        None if no room was found.
+
+        The closest free cell bounds the search, the exact place is looked
+        for around the point within growing radii. Past max_radius, four
+        rectangles by default, the closest free cell is taken instead. """
+
+        w, h = self.rect_width, self.rect_height
+        if w > self.width or h > self.height:
+            return None
+        x, y = self.limit_to_window(x, y)
+        if not self.has_intersections(x, y):
+            return x, y
+
+        cell = self.free_space.nearest(x, y)
+        if max_radius is None:
+            max_radius = 4 * max(w, h)
+        max_radius = min(max_radius, math.ceil(math.hypot(self.width, self.height)))
+        if cell is not None:
+            max_radius = min(max_radius, math.ceil(math.hypot(cell[0] - x, cell[1] - y)))
+
+        radius = max(w, h)
+        while True:
+            radius = min(radius, max_radius)
+            left, top = max(x - radius - w, 0), max(y - radius - h, 0)
+            right = min(x + radius + w, self.width)
+            bottom = min(y + radius + h, self.height)
+            blockers = np.fromiter(
+                self.index.query(left, top, right - left, bottom - top), dtype=np.int64
+            )
+            found = closest_free(
+                x, y, radius, self.store.x[blockers], self.store.y[blockers],
+                w, h, self.width, self.height,
+            )
+            if found is not None:
+                return found
+            if radius == max_radius:
+                return cell
+            radius *= 2
+
+
+    def place_rectangles(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """ Adds the rectangles in order, each at the place closest to
+        its top-left corner. Returns the ids aligned with the batch,
+        REJECTED for the ones that found no room. """
+
+        rect_ids = np.full(len(x), REJECTED, dtype=np.int64)
+        for i, (rect_x, rect_y) in enumerate(zip(np.asarray(x).tolist(), np.asarray(y).tolist())):
+            place = self.place(rect_x, rect_y)
+            if place is not None:
+                rect_ids[i] = self.add(*place)
+        return rect_ids
+
+
+    def remove(self, rect_id: int) -> None:
+        self.colors.release(int(self.store.color[rect_id]))
+        self.store.remove(rect_id)
+        self.index.remove(rect_id)
+        self.free_space.remove(rect_id)
+
+        if self.active_id == rect_id:
+            self.end_drag()
+        elif (
+            (self.collision_x is not None and self.collision_x.rect_id == rect_id)
+            or (self.collision_y is not None and self.collision_y.rect_id == rect_id)
+        ):
+            self.reset_collisions()
+
+
+    def move_to(self, rect_id: int, x: int, y: int) -> None:
+        self.store.move_to(rect_id, x, y)
+
+
+    def on_moved(self, rect_id: int) -> None:
+        self.index.update(rect_id, *self.store.bounds(rect_id))
+        self.free_space.move(rect_id, *self.store.position(rect_id))
+
+
+    def position(self, rect_id: int) -> Point:
+        return self.store.position(rect_id)
+
+
+    def resize(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.free_space.reset(width, height)
+
+
+    def rectangle_at(self, x: int, y: int) -> Optional[int]:
+        # The oldest rectangle wins where rectangles share pixels
+        return min(self.index.query_point(x, y), default=None)
+
+
+    def rectangles_in(self, x: int, y: int, width: int, height: int) -> List[int]:
+        """ Ids of the rectangles overlapping the area, oldest first. """
+
+        return sorted(self.index.query(x, y, width, height))
+
+
+    def has_intersections(self, x: int, y: int, exclude: int = None) -> bool:
+        for rect_id in self.index.query(x, y, self.rect_width, self.rect_height):
+            if rect_id != exclude:
+                return True
+        return False
+
+
+    def is_within_window(self, center_x: int, center_y: int) -> bool:
+        if (
+            center_x - self.rect_width // 2 < 0
+            or center_x + self.rect_width // 2 > self.width
+            or center_y - self.rect_height // 2 < 0
+            or center_y + self.rect_height // 2 > self.height
+        ):
+            return False
+        return True
+
+
+    def is_within_window_many(self, center_x: np.ndarray, center_y: np.ndarray) -> np.ndarray:
+        return (
+            (center_x - self.rect_width // 2 >= 0)
+            & (center_x + self.rect_width // 2 <= self.width)
+            & (center_y - self.rect_height // 2 >= 0)
+            & (center_y + self.rect_height // 2 <= self.height)
+        )
+
+
+    def limit_to_window(self, x: int, y: int) -> Point:
+        # Prevents going outside the window in the OY axis
+        if y < 0:
+            y = 0
+        elif y + self.rect_height > self.height:
+            y = self.height - self.rect_height
+
+        # Prevents going outside the window in the OX axis
+        if x < 0:
+            x = 0
+        elif x + self.rect_width > self.width:
+            x = self.width - self.rect_width
+
+        return x, y
+
+
+    def start_drag(self, rect_id: int) -> None:
+        if rect_id != self.active_id:
+            self.reset_collisions()
+        self.active_id = rect_id
+
+
+    def end_drag(self) -> None:
+        self.active_id = None
+
+
+    def reset_collisions(self) -> None:
+        self.collision_x = None
+        self.collision_y = None
+
+
+    def drag(self, rect_id: int, target_xy: Point) -> Point:
+        """ Moves the rectangle towards the target top-left corner
+        as far as the obstacles allow and returns its new position.
+
+        The movement is swept continuously: the rectangle stops at the
+        first obstacle on its path and slides along it on the free axis,
+        and once past the obstacle heads for the target again, so one
+        call settles the move. The obstacles that stopped it on each
+        axis are kept in `collision_x` and `collision_y`. """
+
+        self.start_drag(rect_id)
+
+        x, y = self.position(rect_id)
+        target_x, target_y = self.limit_to_window(*target_xy)
+
+        batch = MoverBatch([rect_id], [x], [y], [target_x], [target_y])
+        blockers = self.blockers_on_path(rect_id, x, y, target_x, target_y)
+        resolve_pairs(
+            batch,
+            np.array([0]),
+            np.zeros(len(blockers), dtype=np.int64),
+            blockers,
+            self.store.x[blockers].astype(np.int64),
+            self.store.y[blockers].astype(np.int64),
+            self.rect_width,
+            self.rect_height,
+        )
+
+        self.collision_x, self.collision_y = batch.collisions(0)
+        self.move_to(rect_id, int(batch.x[0]), int(batch.y[0]))
+        return self.position(rect_id)
+
+
+    def drag_group(self, rect_ids: np.ndarray, anchor_id: int, target_xy: Point) -> Point:
+        """ Moves the rectangles together, as a rigid body, with the anchor
+        going towards the target top-left corner, and returns the new
+        position of the anchor.
+
+        The group is swept as one mover: the scene is queried once for the
+        area swept by the whole group, then the candidates are paired with
+        the members whose own swept areas meet them. As all rectangles are
+        equal, a blocker of a member is a blocker of the anchor shifted by
+        the offset of the member, so the anchor alone is resolved. """
+
+        w, h = self.rect_width, self.rect_height
+        rect_ids = np.asarray(rect_ids, dtype=np.int64)
+        self.start_drag(anchor_id)
+
+        x, y = self.position(anchor_id)
+        member_x = self.store.x[rect_ids].astype(np.int64)
+        member_y = self.store.y[rect_ids].astype(np.int64)
+
+        # The whole group stays in the window
+        dx = min(max(target_xy[0] - x, -int(member_x.min())), self.width - w - int(member_x.max()))
+        dy = min(max(target_xy[1] - y, -int(member_y.min())), self.height - h - int(member_y.max()))
+
+        x1, y1 = member_x + min(dx, 0), member_y + min(dy, 0)
+        x2, y2 = member_x + max(dx, 0), member_y + max(dy, 0)
+        left, top = int(x1.min()), int(y1.min())
+        candidates = np.array([
+            other_id for other_id in self.index.query(
+                left, top, int(x2.max()) - left + w, int(y2.max()) - top + h
+            )
+        ], dtype=np.int64)
+        candidates = candidates[~np.isin(candidates, rect_ids)]
+
+        member, candidate = sweep_and_prune(
+            self.store.x[candidates].astype(np.int64),
+            self.store.y[candidates].astype(np.int64),
+            x1, y1, x2, y2, w, h,
+        )
+        blockers = candidates[candidate]
+
+        batch = MoverBatch([anchor_id], [x], [y], [x + dx], [y + dy])
+        resolve_pairs(
+            batch,
+            np.array([0]),
+            np.zeros(len(blockers), dtype=np.int64),
+            blockers,
+            self.store.x[blockers] - (member_x[member] - x),
+            self.store.y[blockers] - (member_y[member] - y),
+            w,
+            h,
+        )
+        self.collision_x, self.collision_y = batch.collisions(0)
+
+        shift_x, shift_y = int(batch.x[0]) - x, int(batch.y[0]) - y
+        if shift_x or shift_y:
+            for rect_id, old_x, old_y in zip(rect_ids.tolist(), member_x.tolist(), member_y.tolist()):
+                self.move_to(rect_id, old_x + shift_x, old_y + shift_y)
+        return self.position(anchor_id)
+
+
+    def blockers_on_path(
+        self,
+        rect_id: int,
+        x: int,
+        y: int,
+        target_x: int,
+        target_y: int,
+    ) -> np.ndarray:
+        """ Ids of the rectangles the given one can meet
+        on its way from (x, y) to the target top-left corner. """
+
+        return np.array([
+            other_id for other_id in self.index.query(
+                min(x, target_x),
+                min(y, target_y),
+                abs(x - target_x) + self.rect_width,
+                abs(y - target_y) + self.rect_height,
+            )
+            if other_id != rect_id
+        ], dtype=np.int64)
+
+
+    def drag_batch(
+        self,
+        rect_ids: Iterable[int],
+        targets: Iterable[Point],
+    ) -> MoverBatch:
+        """ Moves many rectangles at once towards their target top-left
+        corners. The reached positions are `x`/`y` of the returned batch.
+        Targets out of the window are brought back to its edges. """
+
+        rect_ids = np.asarray(list(rect_ids), dtype=np.int64)
+        targets = np.asarray(list(targets), dtype=np.int64).reshape(-1, 2)
+        if self.active_id is not None and (rect_ids == self.active_id).any():
+            self.reset_collisions()
+
+        batch = MoverBatch(
+            rect_ids,
+            self.store.x[rect_ids],
+            self.store.y[rect_ids],
+            targets[:, 0],
+            targets[:, 1],
+        )
+        return resolve_batch(self, batch)
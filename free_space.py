@@ -0,0 +1,231 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+Point = Tuple[int, int]
+
+
+def closest_free(
+    x: int,
+    y: int,
+    radius: int,
+    blocker_x: np.ndarray,
+    blocker_y: np.ndarray,
+    rect_width: int,
+    rect_height: int,
+    width: int,
+    height: int,
+) -> Optional[Point]:
+    """ Top-left corner within radius of the point and closest to it
+    where a rectangle fits in the window without sharing a pixel with
+    the blockers, None if there is none.
+
+    The corners around the point are laid out as pixels, each blocker
+    covers the corners less than a rectangle away from it with one box
+    of a difference array, and the sums give the taken corners. """
+
+    w, h = rect_width, rect_height
+    left, right = max(x - radius, 0), min(x + radius, width - w)
+    top, bottom = max(y - radius, 0), min(y + radius, height - h)
+    if left > right or top > bottom:
+        return None
+    columns, rows = right - left + 1, bottom - top + 1
+
+    blocker_x = np.asarray(blocker_x, dtype=np.int64) - left
+    blocker_y = np.asarray(blocker_y, dtype=np.int64) - top
+    x0 = np.clip(blocker_x - w + 1, 0, columns)
+    x1 = np.clip(blocker_x + w, 0, columns)
+    y0 = np.clip(blocker_y - h + 1, 0, rows)
+    y1 = np.clip(blocker_y + h, 0, rows)
+
+    covered = np.zeros((rows + 1, columns + 1), dtype=np.int32)
+    np.add.at(covered, (y0, x0), 1)
+    np.add.at(covered, (y0, x1), -1)
+    np.add.at(covered, (y1, x0), -1)
+    np.add.at(covered, (y1, x1), 1)
+    covered.cumsum(axis=0, out=covered)
+    covered.cumsum(axis=1, out=covered)
+    taken = covered[:rows, :columns] > 0
+
+    free_y, free_x = np.nonzero(~taken)
+    if len(free_x) == 0:
+        return None
+    free_x += left
+    free_y += top
+    distance2 = (free_x - x) ** 2 + (free_y - y) ** 2
+    closest = int(np.argmin(distance2))
+    # Corners of the square farther than radius may miss closer ones outside
+    if distance2[closest] > radius * radius:
+        return None
+    return int(free_x[closest]), int(free_y[closest])
+
+
+class FreeSpace:
+    """ Occupancy of the window in cells the size of a rectangle.
+
+    Every cell counts the rectangles sharing a pixel with it, so a free
+    cell is a place where a rectangle fits without touching any other.
+    Cells reaching out of the window are never free. The cells are also
+    grouped in square blocks that count their free cells, which lets
+    the search for the closest free cell skip the full blocks.
+
+    Free cells are only some of the free places: a rectangle may fit
+    across cells that are all taken. """
+
+    def __init__(self, width: int, height: int, rect_width: int, rect_height: int, block: int = 16):
+        self.rect_width = rect_width
+        self.rect_height = rect_height
+        self.block = block
+
+        # Positions the rectangles were counted at
+        self.positions: Dict[int, Point] = {}
+        self.reset(width, height)
+
+
+    def reset(self, width: int, height: int) -> None:
+        """ Sizes the cells for a new window and counts the rectangles again. """
+
+        self.width = width
+        self.height = height
+        w, h, block = self.rect_width, self.rect_height, self.block
+
+        # Whole blocks of cells, the cells past the window edge are taken
+        columns = max(1, -(-width // w))
+        rows = max(1, -(-height // h))
+        self.counts = np.zeros(
+            (-(-rows // block) * block, -(-columns // block) * block), dtype=np.int32
+        )
+        self.counts[height // h:, :] = 1
+        self.counts[:, width // w:] = 1
+
+        if self.positions:
+            rect_ids = list(self.positions)
+            x = np.array([self.positions[rect_id][0] for rect_id in rect_ids], dtype=np.int64)
+            y = np.array([self.positions[rect_id][1] for rect_id in rect_ids], dtype=np.int64)
+            rows, columns = self.cells(x, y)
+            np.add.at(self.counts, (rows, columns), 1)
+        self.count_blocks()
+
+
+    def count_blocks(self) -> None:
+        block = self.block
+        rows, columns = self.counts.shape
+        self.free = (self.counts == 0).reshape(
+            rows // block, block, columns // block, block
+        ).sum(axis=(1, 3))
+
+
+    def cells(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ Rows and columns of the cells the rectangles share pixels with,
+        up to four per rectangle, leaving out the ones past the grid. """
+
+        w, h = self.rect_width, self.rect_height
+        rows, columns = [], []
+        for row in (y // h, (y + h - 1) // h):
+            for column in (x // w, (x + w - 1) // w):
+                rows.append(row)
+                columns.append(column)
+
+        # A rectangle aligned with the grid on an axis meets one cell on it
+        keep = [
+            np.ones(len(x), dtype=bool),
+            columns[1] != columns[0],
+            rows[2] != rows[0],
+            (columns[3] != columns[2]) & (rows[3] != rows[1]),
+        ]
+        rows = np.concatenate([row[k] for row, k in zip(rows, keep)])
+        columns = np.concatenate([column[k] for column, k in zip(columns, keep)])
+        inside = (
+            (rows >= 0) & (rows < self.counts.shape[0])
+            & (columns >= 0) & (columns < self.counts.shape[1])
+        )
+        return rows[inside], columns[inside]
+
+
+    def change(self, x: int, y: int, delta: int) -> None:
+        w, h, block = self.rect_width, self.rect_height, self.block
+        counts, free = self.counts, self.free
+        rows, columns = counts.shape
+        for row in range(max(y // h, 0), min((y + h - 1) // h, rows - 1) + 1):
+            for column in range(max(x // w, 0), min((x + w - 1) // w, columns - 1) + 1):
+                count = int(counts[row, column])
+                counts[row, column] = count + delta
+                if count == 0 or count + delta == 0:
+                    free[row // block, column // block] += -1 if count == 0 else 1
+
+
+    def add(self, rect_id: int, x: int, y: int) -> None:
+        self.positions[rect_id] = (x, y)
+        self.change(x, y, 1)
+
+
+    def add_many(self, rect_ids: np.ndarray, x: np.ndarray, y: np.ndarray) -> None:
+        """ Counts many rectangles at once, only the blocks of the cells
+        they take are updated. """
+
+        x = np.asarray(x, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+        self.positions.update(zip(rect_ids.tolist(), zip(x.tolist(), y.tolist())))
+        rows, columns = self.cells(x, y)
+
+        grid_columns = self.counts.shape[1]
+        cells, added = np.unique(rows * grid_columns + columns, return_counts=True)
+        rows, columns = np.divmod(cells, grid_columns)
+        taken = self.counts[rows, columns] == 0
+        self.counts[rows, columns] += added.astype(np.int32)
+        np.subtract.at(self.free, (rows[taken] // self.block, columns[taken] // self.block), 1)
+
+
+    def remove(self, rect_id: int) -> None:
+        self.change(*self.positions.pop(rect_id), -1)
+
+
+    def move(self, rect_id: int, x: int, y: int) -> None:
+        old = self.positions[rect_id]
+        if old != (x, y):
+            self.change(*old, -1)
+            self.positions[rect_id] = (x, y)
+            self.change(x, y, 1)
+
+
+    def nearest(self, x: int, y: int) -> Optional[Point]:
+        """ Top-left corner of the free cell closest to the point,
+        None if no cell is free. Blocks are searched in rings around
+        the point until no block of the next ring can be closer. """
+
+        w, h, block = self.rect_width, self.rect_height, self.block
+        block_rows, block_columns = self.free.shape
+        center_row = min(max(y // h // block, 0), block_rows - 1)
+        center_column = min(max(x // w // block, 0), block_columns - 1)
+        # Blocks of a ring are at least this much farther than the previous ring
+        step = block * min(w, h)
+
+        best: Optional[Point] = None
+        best_distance2 = np.inf
+        for ring in range(max(block_rows, block_columns)):
+            if ring and ((ring - 1) * step) ** 2 > best_distance2:
+                break
+
+            top, bottom = center_row - ring, center_row + ring
+            left, right = center_column - ring, center_column + ring
+            for block_row in range(max(top, 0), min(bottom, block_rows - 1) + 1):
+                on_edge = block_row in (top, bottom)
+                for block_column in (
+                    range(max(left, 0), min(right, block_columns - 1) + 1) if on_edge
+                    else [c for c in (left, right) if 0 <= c < block_columns]
+                ):
+                    if not self.free[block_row, block_column]:
+                        continue
+                    row0, column0 = block_row * block, block_column * block
+                    rows, columns = np.nonzero(
+                        self.counts[row0:row0 + block, column0:column0 + block] == 0
+                    )
+                    cell_x = (columns + column0) * w
+                    cell_y = (rows + row0) * h
+                    distance2 = (cell_x - x) ** 2 + (cell_y - y) ** 2
+                    closest = int(np.argmin(distance2))
+                    if distance2[closest] < best_distance2:
+                        best_distance2 = distance2[closest]
+                        best = int(cell_x[closest]), int(cell_y[closest])
+        return best
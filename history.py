@@ -0,0 +1,308 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from connection import ConnectionGraph
+from engine import CollisionEngine
+from store import ALIVE
+
+
+Edge = Tuple[int, int]
+
+
+def connect(engine: CollisionEngine, connections: ConnectionGraph, edges: List[Edge]) -> None:
+    for rect1_id, rect2_id in edges:
+        connections.connect(rect1_id, rect2_id)
+
+
+def disconnect(engine: CollisionEngine, connections: ConnectionGraph, edges: List[Edge]) -> None:
+    for rect1_id, rect2_id in edges:
+        connections.disconnect(rect1_id, rect2_id)
+
+
+def shift(engine: CollisionEngine, rect_ids: np.ndarray, dx: int, dy: int) -> None:
+    store = engine.store
+    for rect_id, x, y in zip(rect_ids.tolist(), store.x[rect_ids].tolist(), store.y[rect_ids].tolist()):
+        engine.move_to(rect_id, x + dx, y + dy)
+
+
+class Create(NamedTuple):
+    rect_id: int
+    x: int
+    y: int
+    color: int
+
+    def apply(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        engine.restore(
+            np.array([self.rect_id]), np.array([self.x]), np.array([self.y]),
+            np.array([self.color], dtype=np.int32),
+        )
+
+    def revert(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        engine.remove(self.rect_id)
+
+
+class CreateMany(NamedTuple):
+    """ Rectangles added at once, with the connections between them. """
+
+    rect_ids: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    colors: np.ndarray
+    edges: List[Edge]
+
+    def apply(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        engine.restore(self.rect_ids, self.x, self.y, self.colors)
+        connect(engine, connections, self.edges)
+
+    def revert(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        disconnect(engine, connections, self.edges)
+        for rect_id in self.rect_ids.tolist():
+            engine.remove(rect_id)
+
+
+class Delete(NamedTuple):
+    """ A removed rectangle and the connections removed with it. """
+
+    rect_id: int
+    x: int
+    y: int
+    color: int
+    edges: List[Edge]
+
+    def apply(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        connections.remove_rectangle(self.rect_id)
+        engine.remove(self.rect_id)
+
+    def revert(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        Create(self.rect_id, self.x, self.y, self.color).apply(engine, connections)
+        connect(engine, connections, self.edges)
+
+
+class Connect(NamedTuple):
+    rect1_id: int
+    rect2_id: int
+
+    def apply(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        connect(engine, connections, [(self.rect1_id, self.rect2_id)])
+
+    def revert(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        disconnect(engine, connections, [(self.rect1_id, self.rect2_id)])
+
+
+class Disconnect(NamedTuple):
+    rect1_id: int
+    rect2_id: int
+
+    def apply(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        disconnect(engine, connections, [(self.rect1_id, self.rect2_id)])
+
+    def revert(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        connect(engine, connections, [(self.rect1_id, self.rect2_id)])
+
+
+class Move(NamedTuple):
+    """ A whole drag, from the press to the release. """
+
+    rect_id: int
+    from_x: int
+    from_y: int
+    to_x: int
+    to_y: int
+
+    def apply(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        engine.move_to(self.rect_id, self.to_x, self.to_y)
+
+    def revert(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        engine.move_to(self.rect_id, self.from_x, self.from_y)
+
+
+class MoveGroup(NamedTuple):
+    """ A drag of a group, every rectangle shifted by the same distance. """
+
+    rect_ids: np.ndarray
+    dx: int
+    dy: int
+
+    def apply(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        shift(engine, self.rect_ids, self.dx, self.dy)
+
+    def revert(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        shift(engine, self.rect_ids, -self.dx, -self.dy)
+
+
+class MoveMany(NamedTuple):
+    """ Rectangles moved each to its own place at once, as by a layout. """
+
+    rect_ids: np.ndarray
+    from_x: np.ndarray
+    from_y: np.ndarray
+    to_x: np.ndarray
+    to_y: np.ndarray
+
+    def apply(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        for rect_id, x, y in zip(self.rect_ids.tolist(), self.to_x.tolist(), self.to_y.tolist()):
+            engine.move_to(rect_id, x, y)
+
+    def revert(self, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+        for rect_id, x, y in zip(self.rect_ids.tolist(), self.from_x.tolist(), self.from_y.tolist()):
+            engine.move_to(rect_id, x, y)
+
+
+Command = Union[Create, CreateMany, Delete, Connect, Disconnect, Move, MoveGroup, MoveMany]
+
+
+class Snapshot(NamedTuple):
+    """ Columns of the scene at a position of the log. """
+
+    rect_ids: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    colors: np.ndarray
+    edges: np.ndarray
+
+
+class History:
+    """ Log of the edits of a scene as small deltas, for undo and redo.
+
+    Every command stores just what it changed, so undoing or redoing it
+    costs as much as the edit did. Every checkpoint_interval commands
+    a snapshot of the scene columns is kept as well. Seeking far away
+    restores the closest snapshot, changing only what differs from the
+    scene, and replays fewer than checkpoint_interval commands from it.
+    When there are more than max_checkpoints snapshots every other one
+    is dropped and the interval doubles.
+
+    Edits of the scene made around the log leave it inconsistent. """
+
+    def __init__(
+        self,
+        engine: CollisionEngine,
+        connections: ConnectionGraph,
+        checkpoint_interval: int = 1024,
+        max_checkpoints: int = 16,
+    ):
+        self.engine = engine
+        self.connections = connections
+
+        self.commands: List[Command] = []
+        # Number of commands applied, the ones after it can be redone
+        self.position = 0
+
+        self.checkpoint_interval = checkpoint_interval
+        self.max_checkpoints = max_checkpoints
+        self.checkpoints: Dict[int, Snapshot] = {0: self.snapshot()}
+
+
+    def record(self, command: Command) -> None:
+        """ Adds a command that was just applied to the scene,
+        dropping the undone ones. """
+
+        if self.position < len(self.commands):
+            del self.commands[self.position:]
+            for position in [p for p in self.checkpoints if p > self.position]:
+                del self.checkpoints[position]
+
+        self.commands.append(command)
+        self.position += 1
+        if self.position % self.checkpoint_interval == 0:
+            self.checkpoints[self.position] = self.snapshot()
+            if len(self.checkpoints) > self.max_checkpoints:
+                self.checkpoint_interval *= 2
+                for position in list(self.checkpoints):
+                    if position % self.checkpoint_interval:
+                        del self.checkpoints[position]
+
+
+    @property
+    def can_undo(self) -> bool:
+        return self.position > 0
+
+
+    @property
+    def can_redo(self) -> bool:
+        return self.position < len(self.commands)
+
+
+    def undo(self) -> Optional[Command]:
+        if not self.can_undo:
+            return None
+        self.position -= 1
+        command = self.commands[self.position]
+        command.revert(self.engine, self.connections)
+        return command
+
+
+    def redo(self) -> Optional[Command]:
+        if not self.can_redo:
+            return None
+        command = self.commands[self.position]
+        command.apply(self.engine, self.connections)
+        self.position += 1
+        return command
+
+
+    def seek(self, position: int) -> None:
+        """ Brings the scene to the state after the first position commands. """
+
+        position = max(0, min(position, len(self.commands)))
+        closest = max(p for p in self.checkpoints if p <= position)
+        if position - closest < abs(position - self.position):
+            self.restore(self.checkpoints[closest])
+            self.position = closest
+
+        while self.position < position:
+            self.redo()
+        while self.position > position:
+            self.undo()
+
+
+    def snapshot(self) -> Snapshot:
+        rect_ids, x, y = self.engine.store.columns()
+        return Snapshot(
+            rect_ids.copy(),
+            x.copy(),
+            y.copy(),
+            self.engine.store.color[rect_ids],
+            np.array(list(self.connections.edges), dtype=np.int64).reshape(-1, 2),
+        )
+
+
+    def restore(self, snapshot: Snapshot) -> None:
+        """ Changes the scene to the snapshot, touching only
+        the rectangles and connections that differ. """
+
+        engine, connections = self.engine, self.connections
+        store = engine.store
+        rect_ids, x, y = store.columns()
+
+        # Connections first, removed rectangles take theirs with them
+        edges = set(map(tuple, snapshot.edges.tolist()))
+        disconnect(engine, connections, [key for key in connections.edges if key not in edges])
+
+        # Rectangles are matched by id and color, a reused id holds another one
+        kept = np.zeros(len(snapshot.rect_ids), dtype=bool)
+        known = snapshot.rect_ids < store.size
+        kept[known] = (
+            (store.flags[snapshot.rect_ids[known]] & ALIVE).astype(bool)
+            & (store.color[snapshot.rect_ids[known]] == snapshot.colors[known])
+        )
+        wanted = np.zeros(store.size, dtype=bool)
+        wanted[snapshot.rect_ids[kept]] = True
+        for rect_id in rect_ids[~wanted[rect_ids]].tolist():
+            connections.remove_rectangle(rect_id)
+            engine.remove(rect_id)
+
+        kept_ids = snapshot.rect_ids[kept]
+        moved = (store.x[kept_ids] != snapshot.x[kept]) | (store.y[kept_ids] != snapshot.y[kept])
+        for rect_id, x, y in zip(
+            kept_ids[moved].tolist(),
+            snapshot.x[kept][moved].tolist(),
+            snapshot.y[kept][moved].tolist(),
+        ):
+            engine.move_to(rect_id, x, y)
+
+        engine.restore(
+            snapshot.rect_ids[~kept], snapshot.x[~kept], snapshot.y[~kept], snapshot.colors[~kept]
+        )
+        connect(engine, connections, [edge for edge in edges if edge not in connections.edges])
@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+from typing import Callable, Deque, Dict, Hashable, Iterator, List
+
+from spatial_index import SpatialIndex
+
+
+# Upper bounds of the histogram buckets in microseconds, the last one is open
+BUCKETS_US = [2 ** i for i in range(4, 21)]
+
+
+class Stage:
+    """ Statistics of one instrumented function. """
+
+    __slots__ = ("name", "calls", "total", "recent", "buckets", "queries", "candidates")
+
+    def __init__(self, name: str, window: int):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        # Latest durations in seconds, for the rolling percentiles
+        self.recent: Deque[float] = deque(maxlen=window)
+        self.buckets = [0] * (len(BUCKETS_US) + 1)
+
+        # Index queries made and keys they yielded, for the query stages
+        self.queries = 0
+        self.candidates = 0
+
+
+    def record(self, duration: float) -> None:
+        self.calls += 1
+        self.total += duration
+        self.recent.append(duration)
+
+        us = duration * 1e6
+        bucket = 0
+        while bucket < len(BUCKETS_US) and us > BUCKETS_US[bucket]:
+            bucket += 1
+        self.buckets[bucket] += 1
+
+
+    def percentile(self, fraction: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+
+    @property
+    def candidates_per_query(self) -> float:
+        return self.candidates / self.queries if self.queries else 0.0
+
+
+class Instrumentation:
+    """ Opt-in timing of the hot paths of the window.
+
+    Nothing is measured until `attach` wraps the handlers and helpers of
+    a window. Every call then updates the counters and the rolling latency
+    window of its stage, and with `tracing` on also adds a complete event
+    to a bounded trace that can be saved in the Chrome trace format. """
+
+    # Methods wrapped by attach, per attribute of the window
+    HANDLERS = {
+        None: [
+            "mousePressEvent",
+            "mouseMoveEvent",
+            "mouseReleaseEvent",
+            "mouseDoubleClickEvent",
+            "paintEvent",
+            "flush_move",
+        ],
+        "engine": ["drag", "rectangle_at", "has_intersections", "blockers_on_path"],
+        "connections": ["connection_at"],
+        "renderer": ["paint", "draw_layer"],
+    }
+
+    def __init__(self, window: int = 512, tracing: bool = False, trace_limit: int = 100000):
+        self.window = window
+        self.stages: Dict[str, Stage] = {}
+
+        self.tracing = tracing
+        self.trace: Deque[dict] = deque(maxlen=trace_limit)
+        self.origin = time.perf_counter()
+
+        # End times of the latest frames, for the frame rate
+        self.frames: Deque[float] = deque(maxlen=240)
+
+
+    def stage(self, name: str) -> Stage:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(name, self.window)
+        return stage
+
+
+    def attach(self, window) -> None:
+        for attribute, names in self.HANDLERS.items():
+            target = window if attribute is None else getattr(window, attribute)
+            prefix = "" if attribute is None else attribute + "."
+            for name in names:
+                setattr(target, name, self.timed(prefix + name, getattr(target, name)))
+
+        self.count_queries("engine.index", window.engine.index)
+        self.count_queries("connections.index", window.connections.index)
+
+
+    def timed(self, name: str, function: Callable) -> Callable:
+        stage = self.stage(name)
+        clock = time.perf_counter
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                end = clock()
+                stage.record(end - start)
+                if name == "paintEvent":
+                    self.frames.append(end)
+                if self.tracing:
+                    self.add_trace_event(name, start, end)
+
+        return wrapper
+
+
+    def count_queries(self, name: str, index: SpatialIndex) -> None:
+        """ Counts the keys yielded by the queries of the index,
+        the candidates the callers have to examine. """
+
+        stage = self.stage(name)
+        for method in ("query", "query_point"):
+            query = getattr(index, method)
+
+            def counted(*args, query=query) -> Iterator[Hashable]:
+                stage.queries += 1
+                for key in query(*args):
+                    stage.candidates += 1
+                    yield key
+
+            setattr(index, method, counted)
+
+
+    def add_trace_event(self, name: str, start: float, end: float) -> None:
+        self.trace.append({
+            "name": name,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        })
+
+
+    @property
+    def fps(self) -> float:
+        """ Frames painted during the last second. """
+
+        if not self.frames:
+            return 0.0
+        now = time.perf_counter()
+        return float(sum(1 for end in self.frames if now - end <= 1.0))
+
+
+    def summary(self) -> List[str]:
+        lines = ["FPS {:.0f}".format(self.fps)]
+        for stage in self.stages.values():
+            if stage.queries:
+                lines.append("{}: {} queries, {:.1f} candidates/query".format(
+                    stage.name, stage.queries, stage.candidates_per_query
+                ))
+            elif stage.calls:
+                lines.append("{}: {} calls, p50 {:.2f} ms, p99 {:.2f} ms".format(
+                    stage.name, stage.calls,
+                    stage.percentile(0.5) * 1000, stage.percentile(0.99) * 1000,
+                ))
+        return lines
+
+
+    def export_trace(self, path: str) -> None:
+        """ Saves the traced calls for chrome://tracing or Perfetto. """
+
+        with open(path, "w") as file:
+            json.dump({"traceEvents": list(self.trace), "displayTimeUnit": "ms"}, file)
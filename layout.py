@@ -0,0 +1,365 @@
+import math
+import threading
+from typing import List, Tuple
+
+import numpy as np
+
+from batch import overlapping_boxes
+from connection import ConnectionGraph
+from engine import CollisionEngine
+
+
+# Rounds of drags over the pending rectangles, each round retried only
+# if the previous one moved some of them
+MAX_ROUNDS = 16
+
+
+def morton_codes(ix: np.ndarray, iy: np.ndarray, depth: int) -> np.ndarray:
+    """ Interleaves the bits of the cell coordinates, y bits above x bits. """
+
+    codes = np.zeros(len(ix), dtype=np.int64)
+    for bit in range(depth):
+        codes |= ((ix >> bit) & 1) << (2 * bit)
+        codes |= ((iy >> bit) & 1) << (2 * bit + 1)
+    return codes
+
+
+class QuadTree:
+    """ Linear quadtree of points for Barnes-Hut.
+
+    The points are sorted by Morton code, so every node of every level
+    is a run of consecutive points and the children of a node are a run
+    of consecutive nodes of the next level. Levels keep the code prefix,
+    the number of points and the center of mass of each node. """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, depth: int = None):
+        count = len(x)
+        if depth is None:
+            depth = min(16, max(1, math.ceil(math.log(max(count, 2), 4)) + 2))
+        self.depth = depth
+
+        self.left = float(x.min())
+        self.top = float(y.min())
+        self.size = max(float(x.max()) - self.left, float(y.max()) - self.top, 1.0)
+
+        cells = 1 << depth
+        ix = np.minimum(((x - self.left) / self.size * cells).astype(np.int64), cells - 1)
+        iy = np.minimum(((y - self.top) / self.size * cells).astype(np.int64), cells - 1)
+        codes = morton_codes(ix, iy, depth)
+
+        self.order = np.argsort(codes, kind="stable")
+        self.codes = codes[self.order]
+        self.x = x[self.order]
+        self.y = y[self.order]
+
+        self.keys: List[np.ndarray] = []
+        self.counts: List[np.ndarray] = []
+        self.center_x: List[np.ndarray] = []
+        self.center_y: List[np.ndarray] = []
+        for level in range(depth + 1):
+            prefixes = self.codes >> (2 * (depth - level))
+            starts = np.flatnonzero(np.r_[True, prefixes[1:] != prefixes[:-1]])
+            counts = np.diff(np.r_[starts, count])
+            self.keys.append(prefixes[starts])
+            self.counts.append(counts)
+            self.center_x.append(np.add.reduceat(self.x, starts) / counts)
+            self.center_y.append(np.add.reduceat(self.y, starts) / counts)
+
+        # Runs of the children in the next level
+        self.first_child: List[np.ndarray] = []
+        self.last_child: List[np.ndarray] = []
+        for level in range(depth):
+            children = self.keys[level + 1]
+            self.first_child.append(np.searchsorted(children, self.keys[level] << 2))
+            self.last_child.append(np.searchsorted(children, (self.keys[level] + 1) << 2))
+
+
+    def repulsion(self, strength: float, theta: float = 0.8) -> Tuple[np.ndarray, np.ndarray]:
+        """ Sum over the other points of strength * d / |d|^2, d pointing
+        away from them, for every point in the original order.
+
+        A node seen from a point at a distance larger than its side over
+        theta acts as one point at its center of mass. The pairs of points
+        and nodes are opened level by level for all points at once. """
+
+        count = len(self.x)
+        force_x = np.zeros(count)
+        force_y = np.zeros(count)
+
+        body = np.arange(count)
+        node = np.zeros(count, dtype=np.int64)
+        for level in range(self.depth + 1):
+            if len(body) == 0:
+                break
+            shift = 2 * (self.depth - level)
+            own = (self.codes[body] >> shift) == self.keys[level][node]
+            mass = self.counts[level][node] - own
+            center_x = self.center_x[level][node]
+            center_y = self.center_y[level][node]
+
+            side = self.size / (1 << level)
+            if level == self.depth:
+                # The smallest cells act as a whole, without the point itself
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    center_x = np.where(own, (center_x * (mass + 1) - self.x[body]) / mass, center_x)
+                    center_y = np.where(own, (center_y * (mass + 1) - self.y[body]) / mass, center_y)
+                accept = mass > 0
+                opened = np.zeros(len(body), dtype=bool)
+            else:
+                dx = self.x[body] - center_x
+                dy = self.y[body] - center_y
+                accept = ~own & (side * side < theta * theta * (dx * dx + dy * dy))
+                # Nodes holding only the point itself have nothing to add
+                opened = ~accept & (mass > 0)
+
+            if accept.any():
+                b = body[accept]
+                dx = self.x[b] - center_x[accept]
+                dy = self.y[b] - center_y[accept]
+                # Coincident points push each other apart by a unit step
+                distance2 = np.maximum(dx * dx + dy * dy, 1.0)
+                scale = strength * mass[accept] / distance2
+                force_x += np.bincount(b, weights=scale * dx, minlength=count)
+                force_y += np.bincount(b, weights=scale * dy, minlength=count)
+
+            if level == self.depth:
+                break
+            body, node = body[opened], node[opened]
+            first = self.first_child[level][node]
+            children = self.last_child[level][node] - first
+            body = np.repeat(body, children)
+            offsets = np.arange(len(body)) - np.repeat(np.cumsum(children) - children, children)
+            node = np.repeat(first, children) + offsets
+
+        result_x = np.empty(count)
+        result_y = np.empty(count)
+        result_x[self.order] = force_x
+        result_y[self.order] = force_y
+        return result_x, result_y
+
+
+def separate(
+    x: np.ndarray,
+    y: np.ndarray,
+    rect_width: int,
+    rect_height: int,
+    width: int,
+    height: int,
+    rounds: int = 100,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """ Pushes apart the rectangles with the given top-left corners until
+    no two share a pixel, the rule of has_intersections, or the rounds
+    run out. Each overlapping pair is split along the axis it overlaps
+    the least, relative to the rectangle size. """
+
+    x = np.asarray(x, dtype=np.int64).copy()
+    y = np.asarray(y, dtype=np.int64).copy()
+    count = len(x)
+    for _ in range(rounds):
+        query, item = overlapping_boxes(x, y, x, y, rect_width, rect_height)
+        pair = query < item
+        query, item = query[pair], item[pair]
+        if len(query) == 0:
+            break
+
+        dx = x[item] - x[query]
+        dy = y[item] - y[query]
+        depth_x = rect_width - np.abs(dx)
+        depth_y = rect_height - np.abs(dy)
+        on_x = depth_x * rect_height <= depth_y * rect_width
+
+        depth = np.where(on_x, depth_x, depth_y)
+        direction = np.where(np.where(on_x, dx, dy) >= 0, 1, -1)
+        # Both take the larger half, so an odd depth of one pixel splits too
+        item_step = direction * ((depth + 1) // 2)
+        query_step = -item_step
+
+        zero = np.zeros(len(query), dtype=np.int64)
+        move_x = (
+            np.bincount(item, weights=np.where(on_x, item_step, zero), minlength=count)
+            + np.bincount(query, weights=np.where(on_x, query_step, zero), minlength=count)
+        )
+        move_y = (
+            np.bincount(item, weights=np.where(on_x, zero, item_step), minlength=count)
+            + np.bincount(query, weights=np.where(on_x, zero, query_step), minlength=count)
+        )
+        x = np.clip(x + move_x.astype(np.int64), 0, width - rect_width)
+        y = np.clip(y + move_y.astype(np.int64), 0, height - rect_height)
+    return x, y
+
+
+class ForceLayout:
+    """ Force-directed layout of the scene: connections pull the
+    rectangles together like springs and all rectangles push each other
+    away, the Fruchterman-Reingold model with Barnes-Hut repulsion.
+
+    `compute` works on a copy of the positions and can run in another
+    thread. `apply` then moves a batch of the rectangles at a time to
+    their places, each only once its place is free, so the scene never
+    has overlapping rectangles. Rectangles whose places stay taken slide
+    towards their places in rounds, as far as they can get, while the
+    rounds keep moving some of them. """
+
+    def __init__(
+        self,
+        engine: CollisionEngine,
+        connections: ConnectionGraph,
+        iterations: int = 50,
+        theta: float = 0.8,
+    ):
+        self.engine = engine
+        self.iterations = iterations
+        self.theta = theta
+
+        store = engine.store
+        rect_ids, x, y = store.columns()
+        self.rect_ids = rect_ids.copy()
+        self.start_x = x.copy()
+        self.start_y = y.copy()
+
+        # Connections as pairs of positions in rect_ids
+        position = np.full(store.size, -1, dtype=np.int64)
+        position[self.rect_ids] = np.arange(len(self.rect_ids))
+        edges = np.array(list(connections.edges), dtype=np.int64).reshape(-1, 2)
+        edges = position[edges]
+        self.edges = edges[edges[:, 0] != edges[:, 1]]
+
+        # Top-left corners the rectangles go to, set by compute
+        self.target_x: np.ndarray = None
+        self.target_y: np.ndarray = None
+        self.pending = np.zeros(0, dtype=np.int64)
+        # Set once the pending rectangles wait for each other
+        self.sliding = False
+        # Dragged rectangles short of their places, for the next round
+        self.waiting = np.zeros(0, dtype=np.int64)
+        self.rounds = 0
+        self.progress = False
+
+        self.iteration = 0
+        self.cancelled = threading.Event()
+
+
+    def compute(self) -> None:
+        """ Runs the iterations and sets the places of the rectangles,
+        unless cancelled on the way. """
+
+        engine = self.engine
+        w, h = engine.rect_width, engine.rect_height
+        count = len(self.rect_ids)
+        if count == 0:
+            self.target_x = self.target_y = np.zeros(0, dtype=np.int64)
+            return
+
+        x = self.start_x + w / 2
+        y = self.start_y + h / 2
+        # Ideal distance between rectangles, at least one rectangle apart
+        k = max(math.sqrt(engine.width * engine.height / count), 2.0 * math.hypot(w, h))
+        temperature = max(engine.width, engine.height) / 10
+        first, second = self.edges[:, 0], self.edges[:, 1]
+
+        for iteration in range(self.iterations):
+            if self.cancelled.is_set():
+                return
+            self.iteration = iteration
+            force_x, force_y = QuadTree(x, y).repulsion(k * k, self.theta)
+
+            dx = x[second] - x[first]
+            dy = y[second] - y[first]
+            pull = np.hypot(dx, dy) / k
+            force_x += np.bincount(first, weights=pull * dx, minlength=count)
+            force_x -= np.bincount(second, weights=pull * dx, minlength=count)
+            force_y += np.bincount(first, weights=pull * dy, minlength=count)
+            force_y -= np.bincount(second, weights=pull * dy, minlength=count)
+
+            # Steps are limited by a temperature that cools down linearly
+            length = np.maximum(np.hypot(force_x, force_y), 1e-9)
+            step = np.minimum(length, temperature * (1 - iteration / self.iterations))
+            x = np.clip(x + force_x / length * step, w / 2, engine.width - w / 2)
+            y = np.clip(y + force_y / length * step, h / 2, engine.height - h / 2)
+
+        self.target_x, self.target_y = separate(
+            np.round(x - w / 2), np.round(y - h / 2), w, h, engine.width, engine.height
+        )
+        self.pending = np.flatnonzero(
+            (self.target_x != self.start_x) | (self.target_y != self.start_y)
+        )
+
+
+    @property
+    def computed(self) -> bool:
+        return self.target_x is not None
+
+
+    @property
+    def finished(self) -> bool:
+        return self.computed and len(self.pending) == 0
+
+
+    def apply(self, batch_size: int = 2000, drag_size: int = 32) -> int:
+        """ Moves the next pending rectangles whose places are free
+        and returns how many moved. Once a whole pass over the pending
+        rectangles moves none of them, the rest wait for each other and
+        are dragged towards their places, drag_size per call. The ones
+        left short of their places are dragged again in the next round,
+        after another pass for free places, unless the round moved
+        none of them. """
+
+        engine = self.engine
+        w, h = engine.rect_width, engine.rect_height
+        moved_total = 0
+        tried = 0
+        while not self.sliding and tried < len(self.pending):
+            batch, rest = self.pending[:batch_size], self.pending[batch_size:]
+            target_x, target_y = self.target_x[batch], self.target_y[batch]
+            rect_ids = self.rect_ids[batch]
+
+            scene_ids, scene_x, scene_y = engine.store.columns()
+            query, item = overlapping_boxes(scene_x, scene_y, target_x, target_y, w, h)
+            free = np.ones(len(batch), dtype=bool)
+            free[query[scene_ids[item] != rect_ids[query]]] = False
+
+            # Places of the batch taken by an earlier one of the batch
+            later, earlier = overlapping_boxes(target_x, target_y, target_x, target_y, w, h)
+            free[later[earlier < later]] = False
+
+            for rect_id, x, y in zip(
+                rect_ids[free].tolist(), target_x[free].tolist(), target_y[free].tolist()
+            ):
+                engine.move_to(rect_id, x, y)
+
+            self.pending = np.concatenate((rest, batch[~free]))
+            moved = int(free.sum())
+            moved_total += moved
+            if moved:
+                return moved_total
+            tried += len(batch)
+        self.sliding = True
+
+        batch, self.pending = self.pending[:drag_size], self.pending[drag_size:]
+        if len(batch):
+            rect_ids = self.rect_ids[batch]
+            x, y = engine.store.x[rect_ids], engine.store.y[rect_ids]
+            target_x, target_y = self.target_x[batch], self.target_y[batch]
+            reached = engine.drag_batch(rect_ids, np.stack((target_x, target_y), axis=1))
+
+            moved = (reached.x != x) | (reached.y != y)
+            arrived = (reached.x == target_x) & (reached.y == target_y)
+            self.waiting = np.concatenate((self.waiting, batch[~arrived]))
+            self.progress |= bool(moved.any())
+            moved_total += int(moved.sum())
+
+        if len(self.pending) == 0:
+            if self.progress and self.rounds + 1 < MAX_ROUNDS:
+                self.pending = self.waiting
+                self.rounds += 1
+                self.sliding = False
+            self.waiting = np.zeros(0, dtype=np.int64)
+            self.progress = False
+        return moved_total
+
+
+    def moved(self) -> np.ndarray:
+        """ Positions in rect_ids of the rectangles away from their start. """
+
+        x, y = self.engine.store.x[self.rect_ids], self.engine.store.y[self.rect_ids]
+        return np.flatnonzero((x != self.start_x) | (y != self.start_y))
@@ -1,39 +1,98 @@
-import random
-from typing import List
+from typing import Tuple
 
 from PyQt5.QtGui import QPainter, QPen, QColor
 from PyQt5.QtCore import Qt, QRect, QPoint
 
+from colors import HIGHLIGHTED_BORDER_RGB
+from store import RectangleStore, HIGHLIGHTED, SELECTED
 
-HIGHLIGHTED_BORDER_COLOR = Qt.black
 
 class Rectangle:
-    def __init__(self, x: int, y: int, height: int = 40, colors: List[QColor] = []):
-        self.height = height
-        self.width = self.height * 2
-        self.rect = QRect(
-            x - self.width // 2,
-            y - height // 2,
-            self.width,
-            self.height,
+    """ Lightweight handle to a rectangle kept in a RectangleStore. """
+
+    __slots__ = ("store", "id")
+
+    def __init__(self, store: RectangleStore, rect_id: int):
+        self.store = store
+        # Id of the rectangle in the store and the collision engine
+        self.id = rect_id
+
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, Rectangle)
+            and self.id == other.id
+            and self.store is other.store
         )
 
-        # Checks if the rectangle is selected for the connection
-        self.is_highlighted = False
 
-        self.color = self.get_color(colors)
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+
+    @property
+    def rect(self) -> QRect:
+        return QRect(*self.store.bounds(self.id))
+
+
+    @property
+    def width(self) -> int:
+        return int(self.store.width[self.id])
+
+
+    @property
+    def height(self) -> int:
+        return int(self.store.height[self.id])
+
+
+    @property
+    def color(self) -> QColor:
+        return QColor(int(self.store.color[self.id]))
+
+
+    # Checks if the rectangle is selected for the connection
+    @property
+    def is_highlighted(self) -> bool:
+        return bool(self.store.flags[self.id] & HIGHLIGHTED)
+
+
+    @is_highlighted.setter
+    def is_highlighted(self, value: bool) -> None:
+        self.store.set_flag(self.id, HIGHLIGHTED, value)
+
+
+    # Checks if the rectangle is part of the selection dragged as a group
+    @property
+    def is_selected(self) -> bool:
+        return bool(self.store.flags[self.id] & SELECTED)
+
+
+    @is_selected.setter
+    def is_selected(self, value: bool) -> None:
+        self.store.set_flag(self.id, SELECTED, value)
 
 
     def move(self, x: int, y: int) -> None:
-        self.rect.moveCenter(QPoint(x, y))
+        rect = self.rect
+        rect.moveCenter(QPoint(x, y))
+        self.moveTo(rect.topLeft())
 
 
     def contains(self, point: QPoint) -> bool:
-        return self.rect.contains(point)
+        x, y, width, height = self.store.bounds(self.id)
+        return (
+            x <= point.x() < x + width
+            and y <= point.y() < y + height
+        )
 
 
     def intersects(self, rect: "Rectangle") -> bool:
-        return self.rect.intersects(rect.rect)
+        x, y, width, height = self.store.bounds(self.id)
+        other_x, other_y, other_width, other_height = rect.store.bounds(rect.id)
+        return (
+            x < other_x + other_width and other_x < x + width
+            and y < other_y + other_height and other_y < y + height
+        )
 
 
     def center(self) -> QPoint:
@@ -41,11 +100,15 @@ class Rectangle:
 
 
     def topLeft(self) -> QPoint:
-        return self.rect.topLeft()
+        return QPoint(*self.store.position(self.id))
 
 
     def moveTo(self, to: QPoint) -> None:
-        self.rect.moveTo(to)
+        self.store.move_to(self.id, to.x(), to.y())
+
+
+    def bounds(self) -> Tuple[int, int, int, int]:
+        return self.store.bounds(self.id)
 
 
     def draw(self, painter: QPainter) -> None:
@@ -53,19 +116,8 @@ class Rectangle:
 
         border_color = Qt.transparent
         if self.is_highlighted is True:
-            border_color = HIGHLIGHTED_BORDER_COLOR
+            border_color = QColor(HIGHLIGHTED_BORDER_RGB)
 
         painter.setPen(QPen(border_color, 2, Qt.SolidLine))
         painter.drawRect(self.rect)
 
-
-    def get_color(self, colors: List[QColor] = []) -> QColor:
-        while True:
-            color: QColor = QColor(
-                random.randint(0, 255),
-                random.randint(0, 255),
-                random.randint(0, 255),
-            )
-            reserved_colors = colors + [HIGHLIGHTED_BORDER_COLOR]
-            if color not in reserved_colors:
-                return color
@@ -0,0 +1,346 @@
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+from PyQt5.QtGui import QPainter, QPen, QColor, QPixmap, QRegion, QFontMetrics, QImage
+from PyQt5.QtCore import Qt, QLine, QRect, QSize
+
+from colors import HIGHLIGHTED_BORDER_RGB
+from connection import Connection, ConnectionGraph
+from engine import CollisionEngine
+from store import HIGHLIGHTED, SELECTED
+from view import View
+
+
+# Levels of detail of the static layer, chosen by the on-screen rectangle width
+FULL_DETAIL = 0
+POINTS = 1
+DENSITY = 2
+
+# Narrowest on-screen rectangles drawn in full and as points, in pixels
+FULL_DETAIL_WIDTH = 8
+POINTS_WIDTH = 2
+
+# Side of the density tiles and the shortest connections drawn at low zoom
+DENSITY_TILE = 8
+THIN_LENGTH = {POINTS: 4, DENSITY: 4 * DENSITY_TILE}
+
+# Largest group of items whose exact area is computed, larger ones
+# are covered by their bounding box
+EXACT_AREA_ITEMS = 64
+
+# Largest share of the world whose rectangles are looked up in the index
+# when drawn at low zoom, a scan of the store is cheaper for larger areas
+INDEX_QUERY_SHARE = 1 / 1000
+
+
+class SceneRenderer:
+    """ Paints the scene from a cached layer of the static items,
+    with the dragged rectangles and their connections composited on top.
+
+    The static layer is redrawn only where it was invalidated, with
+    the items batched into as few draw calls as possible. Only the items
+    in view are drawn, and at low zoom the rectangles turn into points or
+    density tiles and the short connections are left out. Areas are
+    given in widget coordinates. """
+
+    def __init__(
+        self,
+        engine: CollisionEngine,
+        connections: ConnectionGraph,
+        view: View = None,
+    ):
+        self.engine = engine
+        self.connections = connections
+        self.view = view if view is not None else View()
+
+        self.layer: QPixmap = None
+        self.size = QSize()
+        # Parts of the layer to redraw before the next paint
+        self.dirty = QRegion()
+
+        self.active: Set[int] = set()
+        self.active_ids = np.zeros(0, dtype=np.int64)
+
+        self.line_pen = QPen(Qt.black, 2, Qt.SolidLine)
+        self.thin_line_pen = QPen(Qt.black, 0, Qt.SolidLine)
+        self.border_pen = QPen(Qt.transparent, 2, Qt.SolidLine)
+        self.highlighted_pen = QPen(QColor(HIGHLIGHTED_BORDER_RGB), 2, Qt.SolidLine)
+        self.selected_pen = QPen(QColor(HIGHLIGHTED_BORDER_RGB), 2, Qt.DashLine)
+
+        engine.store.move_listeners.append(self.on_rectangle_moved)
+
+        # Area covered by the performance overlay when it was last painted
+        self.overlay_area = QRect()
+
+
+    def resize(self, size: QSize) -> None:
+        self.size = size
+        self.invalidate()
+
+
+    def invalidate(self, area: QRegion = None) -> None:
+        """ Marks the area of the static layer, or all of it, as outdated. """
+
+        if area is None:
+            self.layer = None
+            self.dirty = QRegion()
+        elif self.layer is not None:
+            self.dirty = self.dirty.united(area)
+
+
+    def set_active(self, rect_ids: Iterable[int]) -> None:
+        """ Moves the rectangles from the static layer to the overlay,
+        and the previously active ones back. """
+
+        active = set(rect_ids)
+        if active == self.active:
+            return
+        for changed in (self.active, active):
+            if changed:
+                self.invalidate(self.items_area(changed))
+        self.active = active
+        self.active_ids = np.fromiter(active, dtype=np.int64, count=len(active))
+
+
+    def on_rectangle_moved(self, rect_id: int) -> None:
+        # The old position is unknown, so other moves outdate the whole layer
+        if rect_id not in self.active:
+            self.invalidate()
+
+
+    def item_area(self, rect_id: int) -> QRegion:
+        """ Area covered by the rectangle and its connections. """
+
+        area = QRegion(self.rectangle_area(rect_id))
+        for conn in self.connections.incident(rect_id):
+            area = area.united(self.connection_area(conn))
+        return area
+
+
+    def items_area(self, rect_ids: Iterable[int]) -> QRegion:
+        """ Area covered by the rectangles and their connections. """
+
+        rect_ids = list(rect_ids)
+        if len(rect_ids) <= EXACT_AREA_ITEMS:
+            area = QRegion()
+            for rect_id in rect_ids:
+                area = area.united(self.item_area(rect_id))
+            return area
+
+        store = self.engine.store
+        segments = self.connections.segments
+        ids = np.array(rect_ids, dtype=np.int64)
+        rows = self.connections.rows_of([
+            conn for rect_id in rect_ids for conn in self.connections.incident(rect_id)
+        ])
+        # Pens stick out of the rectangles by a pixel, segments are inflated by the variance
+        margin = self.connections.variance
+        x, y = store.x[ids].astype(np.int64), store.y[ids].astype(np.int64)
+        left = int(np.concatenate((x - 1, segments.left[rows] - margin)).min())
+        top = int(np.concatenate((y - 1, segments.top[rows] - margin)).min())
+        right = int(np.concatenate((x + store.width[ids] + 1, segments.right[rows] + margin + 1)).max())
+        bottom = int(np.concatenate((y + store.height[ids] + 1, segments.bottom[rows] + margin + 1)).max())
+        return QRegion(self.view.to_screen_rect(QRect(left, top, right - left, bottom - top)))
+
+
+    def rectangle_area(self, rect_id: int) -> QRect:
+        x, y, width, height = self.engine.store.bounds(rect_id)
+        # Pens are 2 pixels wide and stick out of the shapes by a pixel
+        return self.view.to_screen_rect(QRect(x - 1, y - 1, width + 2, height + 2))
+
+
+    def connection_area(self, conn: Connection) -> QRect:
+        return self.view.to_screen_rect(QRect(*self.connections.segment_bounds(conn)))
+
+
+    def detail(self) -> int:
+        width = self.engine.rect_width * self.view.zoom
+        if width >= FULL_DETAIL_WIDTH:
+            return FULL_DETAIL
+        if width >= POINTS_WIDTH:
+            return POINTS
+        return DENSITY
+
+
+    def paint(self, painter: QPainter, area: QRect) -> None:
+        if self.layer is None:
+            self.layer = QPixmap(self.size)
+            self.layer.fill(Qt.transparent)
+            self.draw_layer(self.layer.rect())
+        elif not self.dirty.isEmpty():
+            self.draw_layer(self.dirty.boundingRect(), self.dirty)
+            self.dirty = QRegion()
+
+        painter.drawPixmap(area, self.layer, area)
+
+        if self.active:
+            painter.save()
+            painter.setTransform(self.view.transform())
+            painter.setPen(self.line_pen)
+            rows = np.unique(self.connections.rows_of([
+                conn for rect_id in self.active for conn in self.connections.incident(rect_id)
+            ]))
+            lines = self.lines(rows)
+            if lines:
+                painter.drawLines(lines)
+            self.draw_rectangles(painter, sorted(self.active))
+            painter.restore()
+
+
+    def draw_layer(self, area: QRect, clip: QRegion = None) -> None:
+        painter = QPainter(self.layer)
+        if clip is not None:
+            painter.setClipRegion(clip)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.fillRect(area, Qt.transparent)
+            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+
+        world = self.view.to_world_rect(area)
+        bounds = (world.x() - 1, world.y() - 1, world.width() + 2, world.height() + 2)
+        detail = self.detail()
+
+        painter.setTransform(self.view.transform())
+        segments = self.connections.segments
+        rows = self.connections.rows_in(*bounds)
+        if self.active:
+            rows = rows[
+                ~np.isin(segments.rect1[rows], self.active_ids)
+                & ~np.isin(segments.rect2[rows], self.active_ids)
+            ]
+        if detail == FULL_DETAIL:
+            pen = self.line_pen
+        else:
+            # Connections too short to be told apart from the rectangles are left out
+            shortest = THIN_LENGTH[detail] / self.view.zoom
+            rows = rows[
+                np.maximum(np.abs(segments.dx[rows]), np.abs(segments.dy[rows])) >= shortest
+            ]
+            pen = self.thin_line_pen
+        lines = self.lines(rows)
+        if lines:
+            painter.setPen(pen)
+            painter.drawLines(lines)
+
+        if detail == FULL_DETAIL:
+            self.draw_rectangles(painter, [
+                rect_id for rect_id in self.engine.rectangles_in(*bounds)
+                if rect_id not in self.active
+            ])
+        else:
+            painter.resetTransform()
+            self.draw_low_detail(painter, area, detail, bounds)
+        painter.end()
+
+
+    def draw_low_detail(
+        self, painter: QPainter, area: QRect, detail: int, bounds: Tuple[int, int, int, int]
+    ) -> None:
+        """ Draws the rectangles in view as single-color points
+        or as tiles shaded by the number of rectangles in them.
+        Bounds are the world area of the widget area. """
+
+        view = self.view
+        store = self.engine.store
+        if bounds[2] * bounds[3] <= INDEX_QUERY_SHARE * self.engine.width * self.engine.height:
+            rect_ids = np.array(self.engine.rectangles_in(*bounds), dtype=np.int64)
+            x, y = store.x[rect_ids], store.y[rect_ids]
+        else:
+            rect_ids, x, y = store.columns()
+        if self.active:
+            keep = ~np.isin(rect_ids, self.active_ids)
+            rect_ids, x, y = rect_ids[keep], x[keep], y[keep]
+
+        # Screen position of the centers, culled in bulk
+        width, height = self.engine.rect_width, self.engine.rect_height
+        screen_x = np.floor((x + width / 2 - view.x) * view.zoom).astype(np.int64) - area.x()
+        screen_y = np.floor((y + height / 2 - view.y) * view.zoom).astype(np.int64) - area.y()
+        point_width = max(1, int(width * view.zoom))
+        point_height = max(1, int(height * view.zoom))
+        # Points centered outside the area may still reach into it
+        left, top = (point_width // 2, point_height // 2) if detail == POINTS else (0, 0)
+        right = point_width - left - 1 if detail == POINTS else 0
+        bottom = point_height - top - 1 if detail == POINTS else 0
+        visible = (
+            (screen_x >= -right) & (screen_x < area.width() + left)
+            & (screen_y >= -bottom) & (screen_y < area.height() + top)
+        )
+        rect_ids = rect_ids[visible]
+        screen_x, screen_y = screen_x[visible], screen_y[visible]
+
+        if detail == POINTS:
+            image = QImage(area.width(), area.height(), QImage.Format_ARGB32_Premultiplied)
+            image.fill(Qt.transparent)
+            pixels = np.frombuffer(image.bits().asarray(image.byteCount()), dtype=np.uint32)
+            pixels = pixels.reshape(area.height(), image.bytesPerLine() // 4)
+
+            colors = (store.color[rect_ids].astype(np.uint32) & 0xFFFFFF) | 0xFF000000
+            for dx in range(-left, right + 1):
+                for dy in range(-top, bottom + 1):
+                    px, py = screen_x + dx, screen_y + dy
+                    inside = (px >= 0) & (px < area.width()) & (py >= 0) & (py < area.height())
+                    pixels[py[inside], px[inside]] = colors[inside]
+            painter.drawImage(area.topLeft(), image)
+            return
+
+        columns = -(-area.width() // DENSITY_TILE)
+        rows = -(-area.height() // DENSITY_TILE)
+        counts = np.bincount(
+            screen_y // DENSITY_TILE * columns + screen_x // DENSITY_TILE,
+            minlength=rows * columns,
+        ).reshape(rows, columns)
+
+        # Opacity of a tile is the share of it covered by rectangles
+        covered = counts * (width * height * view.zoom ** 2) / DENSITY_TILE ** 2
+        alpha = (np.minimum(covered, 1.0) * 255).astype(np.uint32)
+        shade = 64
+        tiles = (alpha << 24) | (((shade * alpha) // 255) * 0x010101)
+
+        image = QImage(columns, rows, QImage.Format_ARGB32_Premultiplied)
+        pixels = np.frombuffer(image.bits().asarray(image.byteCount()), dtype=np.uint32)
+        pixels.reshape(rows, image.bytesPerLine() // 4)[:, :columns] = tiles
+        painter.drawImage(
+            QRect(area.x(), area.y(), columns * DENSITY_TILE, rows * DENSITY_TILE), image
+        )
+
+
+    def lines(self, rows: np.ndarray) -> List[QLine]:
+        return [QLine(*line) for line in self.connections.segments.endpoints(rows).tolist()]
+
+
+    def draw_rectangles(self, painter: QPainter, rect_ids: List[int]) -> None:
+        store = self.engine.store
+
+        # One call per brush and pen, in the order of the first rectangle of each
+        groups: Dict[Tuple[int, int], List[QRect]] = {}
+        for rect_id in rect_ids:
+            key = (
+                int(store.color[rect_id]),
+                int(store.flags[rect_id]) & (HIGHLIGHTED | SELECTED),
+            )
+            groups.setdefault(key, []).append(QRect(*store.bounds(rect_id)))
+
+        for (color, flags), rects in groups.items():
+            if flags & HIGHLIGHTED:
+                painter.setPen(self.highlighted_pen)
+            elif flags & SELECTED:
+                painter.setPen(self.selected_pen)
+            else:
+                painter.setPen(self.border_pen)
+            painter.setBrush(QColor(color))
+            painter.drawRects(rects)
+
+
+    def paint_overlay(self, painter: QPainter, lines: List[str]) -> None:
+        """ Draws the lines of text in a box in the top-left corner. """
+
+        metrics = QFontMetrics(painter.font())
+        width = max(metrics.horizontalAdvance(line) for line in lines) + 16
+        self.overlay_area = QRect(4, 4, width, metrics.height() * len(lines) + 12)
+
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(255, 255, 255, 220))
+        painter.drawRect(self.overlay_area)
+
+        painter.setPen(Qt.black)
+        for i, line in enumerate(lines):
+            painter.drawText(12, 10 + metrics.ascent() + i * metrics.height(), line)
@@ -0,0 +1,156 @@
+import json
+import struct
+from itertools import islice
+from typing import Iterator, List
+
+import numpy as np
+
+from connection import Connection, ConnectionGraph
+from engine import CollisionEngine, REJECTED
+from rectangle import Rectangle
+
+
+# Magic bytes, format version, number of rectangles and of connections
+HEADER = struct.Struct("<4sIQQ")
+MAGIC = b"RCSC"
+VERSION = 1
+
+# Little-endian records following the header, rectangles first
+RECTANGLE_RECORD = np.dtype([
+    ("x", "<i4"),
+    ("y", "<i4"),
+    ("width", "<i4"),
+    ("height", "<i4"),
+    ("color", "<i4"),
+])
+# Connections refer to rectangles by their position in the rectangle table
+CONNECTION_RECORD = np.dtype([("rect1", "<i4"), ("rect2", "<i4")])
+
+CHUNK_SIZE = 1 << 16
+
+
+def save_scene(path: str, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+    """ Writes the rectangles and connections to a binary scene file,
+    chunk by chunk so that no full copy of the scene is built. """
+
+    store = engine.store
+    rect_ids = store.ids()
+
+    # Position of every rectangle in the table, by id
+    rows = np.full(store.size, -1, dtype=np.int64)
+    rows[rect_ids] = np.arange(len(rect_ids))
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(rect_ids), len(connections)))
+
+        for start in range(0, len(rect_ids), CHUNK_SIZE):
+            chunk = rect_ids[start:start + CHUNK_SIZE]
+            records = np.empty(len(chunk), dtype=RECTANGLE_RECORD)
+            for name in RECTANGLE_RECORD.names:
+                records[name] = getattr(store, name)[chunk]
+            file.write(records.tobytes())
+
+        for chunk in chunked(iter(connections)):
+            pairs = rows[np.array(
+                [(conn.rect1.id, conn.rect2.id) for conn in chunk], dtype=np.int64
+            )]
+            records = np.empty(len(pairs), dtype=CONNECTION_RECORD)
+            records["rect1"] = pairs[:, 0]
+            records["rect2"] = pairs[:, 1]
+            file.write(records.tobytes())
+
+
+def load_scene(path: str, engine: CollisionEngine, connections: ConnectionGraph) -> np.ndarray:
+    """ Adds the rectangles and connections of a scene file to the scene
+    and returns the ids given to the rectangles, in the order of the file.
+    Rectangles outside the world or overlapping the scene get REJECTED
+    and lose their connections, so loading a file twice adds nothing.
+
+    The file is memory-mapped and its tables are copied to the store
+    and the index in bulk. """
+
+    with open(path, "rb") as file:
+        header = file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("Not a scene file: {}".format(path))
+
+    magic, version, rect_count, connection_count = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a scene file: {}".format(path))
+    if version != VERSION:
+        raise ValueError("Unsupported scene file version: {}".format(version))
+
+    rectangles = np.memmap(
+        path, dtype=RECTANGLE_RECORD, mode="r",
+        offset=HEADER.size, shape=(rect_count,),
+    ) if rect_count else np.empty(0, dtype=RECTANGLE_RECORD)
+    pairs = np.memmap(
+        path, dtype=CONNECTION_RECORD, mode="r",
+        offset=HEADER.size + rect_count * RECTANGLE_RECORD.itemsize,
+        shape=(connection_count,),
+    ) if connection_count else np.empty(0, dtype=CONNECTION_RECORD)
+
+    if (
+        (rectangles["width"] != engine.rect_width).any()
+        or (rectangles["height"] != engine.rect_height).any()
+    ):
+        raise ValueError("The scene has rectangles of another size")
+    if ((pairs["rect1"] < 0) | (pairs["rect1"] >= rect_count)).any() or (
+        (pairs["rect2"] < 0) | (pairs["rect2"] >= rect_count)
+    ).any():
+        raise ValueError("The scene has connections to missing rectangles")
+
+    # Saved rectangles may rest against each other after a drag
+    x = np.asarray(rectangles["x"], dtype=np.int64)
+    y = np.asarray(rectangles["y"], dtype=np.int64)
+    accepted = engine.placeable(x, y, contact=1)
+    rect_ids = np.full(rect_count, REJECTED, dtype=np.int64)
+    rect_ids[accepted] = engine.add_many(
+        x[accepted], y[accepted], np.asarray(rectangles["color"])[accepted]
+    )
+
+    rect1_ids, rect2_ids = rect_ids[pairs["rect1"]], rect_ids[pairs["rect2"]]
+    kept = (rect1_ids != REJECTED) & (rect2_ids != REJECTED)
+
+    store = engine.store
+    for rect1_id, rect2_id in zip(rect1_ids[kept].tolist(), rect2_ids[kept].tolist()):
+        connections.add(Connection(Rectangle(store, rect1_id), Rectangle(store, rect2_id)))
+
+    return rect_ids
+
+
+def export_json(path: str, engine: CollisionEngine, connections: ConnectionGraph) -> None:
+    """ Writes the scene as JSON, with colors as #rrggbb strings
+    and connections as pairs of positions in the rectangle list. """
+
+    store = engine.store
+    rect_ids = store.ids()
+    rows = np.full(store.size, -1, dtype=np.int64)
+    rows[rect_ids] = np.arange(len(rect_ids))
+
+    with open(path, "w") as file:
+        file.write('{"rectangles": [')
+        for i, rect_id in enumerate(rect_ids.tolist()):
+            x, y, width, height = store.bounds(rect_id)
+            file.write(("," if i else "") + "\n  " + json.dumps({
+                "x": x,
+                "y": y,
+                "width": width,
+                "height": height,
+                "color": "#{:06x}".format(int(store.color[rect_id])),
+            }))
+
+        file.write('\n], "connections": [')
+        for i, conn in enumerate(connections):
+            file.write(("," if i else "") + "\n  " + json.dumps([
+                int(rows[conn.rect1.id]), int(rows[conn.rect2.id])
+            ]))
+        file.write("\n]}\n")
+
+
+def chunked(items: Iterator, size: int = CHUNK_SIZE) -> Iterator[List]:
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
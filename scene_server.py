@@ -0,0 +1,501 @@
+""" Serves a scene to clients other than the window over a local socket.
+
+    python scene_server.py --port 8765
+    python scene_server.py --load-test --clients 8 --requests 20000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from connection import ConnectionGraph
+from engine import CollisionEngine, REJECTED
+from store import ALIVE
+
+
+# Coordinates must fit the int32 columns of the store
+COORDINATE_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+
+class Client:
+    """ Connection of one client to the server. """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.subscribed = False
+        # Encoded lines to send at the end of the tick
+        self.outgoing: List[bytes] = []
+
+
+    def send(self, message: dict) -> None:
+        self.outgoing.append(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+
+
+    def flush(self) -> None:
+        if self.outgoing and not self.writer.is_closing():
+            self.writer.write(b"".join(self.outgoing))
+        self.outgoing.clear()
+
+
+class SceneServer:
+    """ Lets clients create, drag, connect and query the rectangles
+    of a scene with the collision rules of the window.
+
+    Requests and responses are JSON objects, one per line:
+
+        {"id": 1, "op": "create", "x": 100, "y": 50}
+        {"id": 1, "result": 7}
+
+    Requests are not handled as they arrive but queued, and the queue is
+    handled once per turn of the event loop, so pipelined requests of all
+    clients are handled together. Consecutive creations are placed in one
+    place_rectangles call and consecutive drags are resolved in one
+    drag_batch call, the last target of a rectangle winning. Subscribers
+    receive the positions of the rectangles created or moved in the turn
+    as a single event:
+
+        {"event": "positions", "positions": [[7, 60, 30], ...]}
+
+    Every request gets a response: a request failing in an unexpected
+    way is answered with an error and the rest of its turn goes on. """
+
+    def __init__(self, engine: CollisionEngine, connections: ConnectionGraph = None):
+        self.engine = engine
+        self.connections = (
+            connections if connections is not None else ConnectionGraph(engine.store)
+        )
+        self.clients: Set[Client] = set()
+        self.tasks: Set[asyncio.Task] = set()
+        self.queue: List[Tuple[Client, dict]] = []
+        self.flush_scheduled = False
+        # Requests of the current turn already answered, by object id
+        self.answered: Set[int] = set()
+
+        # Rectangles created or moved during the current turn
+        self.changed: Dict[int, None] = {}
+        engine.store.move_listeners.append(self.on_moved)
+
+        self.server: asyncio.AbstractServer = None
+
+        self.handlers = {
+            "connect": self.connect,
+            "disconnect": self.disconnect,
+            "rectangle_at": self.rectangle_at,
+            "rectangles_in": self.rectangles_in,
+            "connection_at": self.connection_at,
+            "position": self.position,
+            "subscribe": self.subscribe,
+            "unsubscribe": self.unsubscribe,
+        }
+
+
+    def on_moved(self, rect_id: int) -> None:
+        self.changed[rect_id] = None
+
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """ Starts listening and returns the port. """
+
+        self.server = await asyncio.start_server(self.serve, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for client in list(self.clients):
+            client.writer.close()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = Client(writer)
+        self.clients.add(client)
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    client.send({"error": "Malformed request"})
+                    request = None
+                if isinstance(request, dict):
+                    self.enqueue(client, request)
+                # Slow readers hold back their own requests
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            self.tasks.discard(task)
+            writer.close()
+
+
+    def enqueue(self, client: Client, request: dict) -> None:
+        self.queue.append((client, request))
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+
+    def flush(self) -> None:
+        """ Handles the queued requests in order and sends the responses
+        and the position event of the turn. """
+
+        self.flush_scheduled = False
+        queue, self.queue = self.queue, []
+
+        start = 0
+        while start < len(queue):
+            op = queue[start][1].get("op")
+            end = start + 1
+            if op in ("create", "drag"):
+                while end < len(queue) and queue[end][1].get("op") == op:
+                    end += 1
+            group = queue[start:end]
+            try:
+                if op == "create":
+                    self.create_many(group)
+                elif op == "drag":
+                    self.drag_many(group)
+                else:
+                    self.handle(*group[0])
+            except Exception as error:
+                for client, request in group:
+                    if id(request) not in self.answered:
+                        self.reply(client, request, error="Server error: {!r}".format(error))
+            start = end
+        self.answered.clear()
+
+        if self.changed:
+            store = self.engine.store
+            rect_ids = np.fromiter(self.changed, dtype=np.int64, count=len(self.changed))
+            rect_ids = rect_ids[(store.flags[rect_ids] & ALIVE) != 0]
+            self.changed.clear()
+            event = {"event": "positions", "positions": np.column_stack(
+                (rect_ids, store.x[rect_ids], store.y[rect_ids])
+            ).tolist()}
+            for client in self.clients:
+                if client.subscribed:
+                    client.send(event)
+
+        for client in self.clients:
+            client.flush()
+
+
+    def handle(self, client: Client, request: dict) -> None:
+        handler = self.handlers.get(request.get("op"))
+        if handler is None:
+            self.reply(client, request, error="Unknown operation")
+            return
+        try:
+            result = handler(client, request)
+        except (KeyError, TypeError, ValueError, OverflowError) as error:
+            self.reply(client, request, error="Bad request: {}".format(error))
+        else:
+            self.reply(client, request, result)
+
+
+    def reply(self, client: Client, request: dict, result: Any = None, error: str = None) -> None:
+        self.answered.add(id(request))
+        message = {"id": request.get("id")}
+        if error is None:
+            message["result"] = result
+        else:
+            message["error"] = error
+        client.send(message)
+
+
+    def rect_id(self, value: Any) -> int:
+        rect_id = int(value)
+        if rect_id not in self.engine.store:
+            raise ValueError("no rectangle {}".format(rect_id))
+        return rect_id
+
+
+    @staticmethod
+    def coordinate(value: Any) -> int:
+        coordinate = int(value)
+        if not COORDINATE_RANGE[0] <= coordinate <= COORDINATE_RANGE[1]:
+            raise ValueError("coordinate {} out of range".format(coordinate))
+        return coordinate
+
+
+    def area(self, request: dict) -> Tuple[int, int, int, int]:
+        """ The requested area cut down to the world. """
+
+        x, y = self.coordinate(request["x"]), self.coordinate(request["y"])
+        right = min(x + self.coordinate(request["width"]), self.engine.width)
+        bottom = min(y + self.coordinate(request["height"]), self.engine.height)
+        x, y = max(x, 0), max(y, 0)
+        return x, y, max(right - x, 0), max(bottom - y, 0)
+
+
+    def create_many(self, batch: List[Tuple[Client, dict]]) -> None:
+        """ Creates rectangles centered on the requested points, as
+        double-clicks in the same order would: a taken spot snaps to
+        the closest place the rectangle fits in. """
+
+        engine = self.engine
+        valid = []
+        centers = []
+        for client, request in batch:
+            try:
+                center = self.coordinate(request["x"]), self.coordinate(request["y"])
+            except (KeyError, TypeError, ValueError, OverflowError) as error:
+                self.reply(client, request, error="Bad request: {}".format(error))
+                continue
+            if not (0 <= center[0] <= engine.width and 0 <= center[1] <= engine.height):
+                self.reply(client, request, error="Bad request: point out of the world")
+                continue
+            centers.append(center)
+            valid.append((client, request))
+        if not valid:
+            return
+
+        centers = np.array(centers, dtype=np.int64)
+        rect_ids = engine.place_rectangles(
+            centers[:, 0] - engine.rect_width // 2,
+            centers[:, 1] - engine.rect_height // 2,
+        )
+        for (client, request), rect_id in zip(valid, rect_ids.tolist()):
+            if rect_id == REJECTED:
+                self.reply(client, request, error="No room for a rectangle")
+            else:
+                self.changed[rect_id] = None
+                self.reply(client, request, rect_id)
+
+
+    def drag_many(self, batch: List[Tuple[Client, dict]]) -> None:
+        """ Drags rectangles towards the requested top-left corners,
+        each answered with the position where the rectangle stopped.
+        Targets out of the world stop the rectangles at its edges. """
+
+        targets: Dict[int, Tuple[int, int]] = {}
+        valid = []
+        for client, request in batch:
+            try:
+                rect_id = self.rect_id(request["rect"])
+                target = (self.coordinate(request["x"]), self.coordinate(request["y"]))
+            except (KeyError, TypeError, ValueError, OverflowError) as error:
+                self.reply(client, request, error="Bad request: {}".format(error))
+                continue
+            # A later drag of the same rectangle replaces the earlier one
+            targets.pop(rect_id, None)
+            targets[rect_id] = target
+            valid.append((client, request, rect_id))
+        if not targets:
+            return
+
+        self.engine.drag_batch(targets.keys(), targets.values())
+        for client, request, rect_id in valid:
+            self.reply(client, request, list(self.engine.position(rect_id)))
+
+
+    def connect(self, client: Client, request: dict) -> bool:
+        return self.connections.connect(
+            self.rect_id(request["rect1"]), self.rect_id(request["rect2"])
+        )
+
+
+    def disconnect(self, client: Client, request: dict) -> bool:
+        return self.connections.disconnect(int(request["rect1"]), int(request["rect2"]))
+
+
+    def rectangle_at(self, client: Client, request: dict) -> Optional[int]:
+        return self.engine.rectangle_at(
+            self.coordinate(request["x"]), self.coordinate(request["y"])
+        )
+
+
+    def rectangles_in(self, client: Client, request: dict) -> List[List[int]]:
+        """ Ids and top-left corners of the rectangles meeting the area. """
+
+        store = self.engine.store
+        rect_ids = np.array(self.engine.rectangles_in(*self.area(request)), dtype=np.int64)
+        return np.column_stack((rect_ids, store.x[rect_ids], store.y[rect_ids])).tolist()
+
+
+    def connection_at(self, client: Client, request: dict) -> Optional[List[int]]:
+        key = self.connections.key_at(self.coordinate(request["x"]), self.coordinate(request["y"]))
+        return list(key) if key is not None else None
+
+
+    def position(self, client: Client, request: dict) -> List[int]:
+        return list(self.engine.position(self.rect_id(request["rect"])))
+
+
+    def subscribe(self, client: Client, request: dict) -> bool:
+        client.subscribed = True
+        return True
+
+
+    def unsubscribe(self, client: Client, request: dict) -> bool:
+        client.subscribed = False
+        return True
+
+
+class SceneClient:
+    """ Client of a SceneServer that pipelines its requests:
+    `request` sends at once and waits only for its own response. """
+
+    def __init__(self):
+        self.reader: asyncio.StreamReader = None
+        self.writer: asyncio.StreamWriter = None
+        self.next_id = 0
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.receiver: asyncio.Task = None
+
+
+    async def connect(self, host: str = "127.0.0.1", port: int = 8765) -> None:
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.receiver = asyncio.create_task(self.receive())
+
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+
+    def send(self, op: str, **params) -> asyncio.Future:
+        """ Sends a request without waiting and returns the future
+        of its result. """
+
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[self.next_id] = future
+        params.update(id=self.next_id, op=op)
+        self.writer.write(json.dumps(params, separators=(",", ":")).encode() + b"\n")
+        return future
+
+
+    async def request(self, op: str, **params) -> Any:
+        """ Result of the request, raises RuntimeError if it failed. """
+
+        return await self.send(op, **params)
+
+
+    async def receive(self) -> None:
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if "event" in message:
+                self.events.put_nowait(message)
+                continue
+            future = self.pending.pop(message.get("id"), None)
+            if future is None or future.done():
+                continue
+            if "error" in message:
+                future.set_exception(RuntimeError(message["error"]))
+            else:
+                future.set_result(message["result"])
+
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("The server closed the connection"))
+        self.pending.clear()
+
+
+async def load_test(clients: int, requests: int, size: int, seed: int) -> None:
+    """ Runs a server and clients dragging random rectangles in one process. """
+
+    engine = CollisionEngine(width=20000, height=20000, rect_width=80, rect_height=40)
+    rng = np.random.default_rng(seed)
+    engine.add_rectangles(rng.integers(0, 19920, size), rng.integers(0, 19960, size))
+    server = SceneServer(engine)
+    port = await server.start()
+
+    connected = []
+    for _ in range(clients):
+        client = SceneClient()
+        await client.connect(port=port)
+        connected.append(client)
+    await connected[0].request("subscribe")
+
+    rect_ids = engine.store.ids()
+    latencies: List[float] = []
+
+    async def drive(client: SceneClient, count: int, window: int = 64) -> None:
+        """ Keeps up to `window` drags in flight. """
+
+        in_flight: Set[asyncio.Future] = set()
+        for _ in range(count):
+            rect_id = int(rng.choice(rect_ids))
+            x, y = engine.position(rect_id)
+            sent = time.perf_counter()
+            future = client.send(
+                "drag", rect=rect_id,
+                x=x + int(rng.integers(-200, 201)), y=y + int(rng.integers(-200, 201)),
+            )
+            future.add_done_callback(
+                lambda _, sent=sent: latencies.append(time.perf_counter() - sent)
+            )
+            in_flight.add(future)
+            if len(in_flight) >= window:
+                _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        await asyncio.gather(*in_flight)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(client, requests // clients) for client in connected))
+    elapsed = time.perf_counter() - started
+
+    events = connected[0].events.qsize()
+    for client in connected:
+        await client.close()
+    await server.close()
+
+    timed = np.array(latencies) * 1000
+    print("{} drags from {} clients in {:.2f} s: {:.0f} requests/s, p50 {:.2f} ms, "
+          "p99 {:.2f} ms, {} position events".format(
+              len(latencies), clients, elapsed, len(latencies) / elapsed,
+              np.percentile(timed, 50), np.percentile(timed, 99), events,
+          ))
+
+
+async def serve_forever(host: str, port: int, width: int, height: int, rect_height: int) -> None:
+    engine = CollisionEngine(
+        width=width, height=height, rect_width=rect_height * 2, rect_height=rect_height
+    )
+    server = SceneServer(engine)
+    port = await server.start(host, port)
+    print("Serving on {}:{}".format(host, port))
+    await server.server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Scene server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--width", type=int, default=1200)
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument("--rect-height", type=int, default=80)
+    parser.add_argument("--load-test", action="store_true",
+                        help="run clients against an in-process server and report throughput")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=10000,
+                        help="rectangles in the load test scene")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.load_test:
+        asyncio.run(load_test(args.clients, args.requests, args.size, args.seed))
+    else:
+        asyncio.run(serve_forever(args.host, args.port, args.width, args.height, args.rect_height))
+
+
+if __name__ == "__main__":
+    main()
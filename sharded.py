@@ -0,0 +1,310 @@
+import os
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from batch import NO_BLOCKER, overlapping_on_x, sweep
+from engine import CollisionEngine
+
+
+# Rows of the shared snapshot: ids, x and y of the rectangles sorted by y
+ID, X, Y = range(3)
+
+# Snapshot attached by the worker processes
+_snapshot: Optional[np.ndarray] = None
+_shared: Optional[SharedMemory] = None
+
+
+def _attach(name: str, count: int) -> None:
+    global _snapshot, _shared
+    _shared = SharedMemory(name=name)
+    _snapshot = np.ndarray((3, count), dtype=np.int64, buffer=_shared.buf)
+
+
+def _run(task: tuple) -> Tuple[np.ndarray, object]:
+    kind, queries, args, rect_size = task
+    return queries, KERNELS[kind](_snapshot, *args, *rect_size)
+
+
+def in_area(
+    snapshot: np.ndarray,
+    x1: int,
+    y1: int,
+    x2: int,
+    y2: int,
+) -> np.ndarray:
+    """ Rows of the snapshot rectangles whose top-left corners
+    lie within [x1, x2] x [y1, y2]. """
+
+    lo, hi = np.searchsorted(snapshot[Y], [y1, y2 + 1])
+    band_x = snapshot[X, lo:hi]
+    return lo + np.flatnonzero((band_x >= x1) & (band_x <= x2))
+
+
+def overlap_pairs(
+    snapshot: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    width: np.ndarray,
+    height: np.ndarray,
+    rect_width: int,
+    rect_height: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """ Pairs (query, snapshot row) of the query areas
+    and the rectangles sharing pixels with them. """
+
+    rows = in_area(
+        snapshot,
+        x.min() - rect_width + 1,
+        y.min() - rect_height + 1,
+        (x + width).max() - 1,
+        (y + height).max() - 1,
+    )
+    query, item = overlapping_on_x(snapshot[X, rows], x - rect_width + 1, x + width - 1)
+    rows = rows[item]
+    keep = (
+        (snapshot[Y, rows] >= y[query] - rect_height + 1)
+        & (snapshot[Y, rows] <= y[query] + height[query] - 1)
+    )
+    return query[keep], rows[keep]
+
+
+def overlaps_kernel(
+    snapshot: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    width: np.ndarray,
+    height: np.ndarray,
+    rect_width: int,
+    rect_height: int,
+) -> List[np.ndarray]:
+    query, rows = overlap_pairs(snapshot, x, y, width, height, rect_width, rect_height)
+    rect_ids = snapshot[ID, rows]
+    order = np.lexsort((rect_ids, query))
+    query, rect_ids = query[order], rect_ids[order]
+    return np.split(rect_ids, np.searchsorted(query, np.arange(1, len(x))))
+
+
+def hits_kernel(
+    snapshot: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    rect_width: int,
+    rect_height: int,
+) -> np.ndarray:
+    ones = np.ones(len(x), dtype=np.int64)
+    query, rows = overlap_pairs(snapshot, x, y, ones, ones, rect_width, rect_height)
+    rect_ids = snapshot[ID, rows]
+
+    # The oldest rectangle wins where rectangles share pixels
+    found = np.full(len(x), np.iinfo(np.int64).max)
+    np.minimum.at(found, query, rect_ids)
+    return np.where(found == np.iinfo(np.int64).max, NO_BLOCKER, found)
+
+
+def nearest_kernel(
+    snapshot: np.ndarray,
+    rect_ids: np.ndarray,
+    start_x: np.ndarray,
+    start_y: np.ndarray,
+    target_x: np.ndarray,
+    target_y: np.ndarray,
+    rect_width: int,
+    rect_height: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    x1 = np.minimum(start_x, target_x)
+    y1 = np.minimum(start_y, target_y)
+    query, rows = overlap_pairs(
+        snapshot,
+        x1,
+        y1,
+        np.abs(start_x - target_x) + rect_width,
+        np.abs(start_y - target_y) + rect_height,
+        rect_width,
+        rect_height,
+    )
+    blocker_ids = snapshot[ID, rows]
+    not_self = blocker_ids != rect_ids[query]
+    query, rows, blocker_ids = query[not_self], rows[not_self], blocker_ids[not_self]
+
+    t, _ = sweep(
+        start_x[query], start_y[query],
+        (target_x - start_x)[query], (target_y - start_y)[query],
+        snapshot[X, rows], snapshot[Y, rows], rect_width, rect_height,
+    )
+
+    # Earliest impact first, the oldest rectangle on ties
+    order = np.lexsort((blocker_ids, t, query))
+    query, blocker_ids, t = query[order], blocker_ids[order], t[order]
+    first = np.flatnonzero(np.diff(query, prepend=-1) != 0)
+    first = first[np.isfinite(t[first])]
+
+    nearest = np.full(len(rect_ids), NO_BLOCKER, dtype=np.int64)
+    times = np.full(len(rect_ids), np.inf)
+    nearest[query[first]] = blocker_ids[first]
+    times[query[first]] = t[first]
+    return nearest, times
+
+
+KERNELS = {
+    "overlaps": overlaps_kernel,
+    "hits": hits_kernel,
+    "nearest": nearest_kernel,
+}
+
+
+class ShardedQueries:
+    """ Batched read-only queries over a snapshot of the scene,
+    answered in parallel by a pool of processes.
+
+    The snapshot lives in shared memory. Queries are grouped by the
+    tile of the plane holding their top-left corner, and every tile is
+    answered against the rectangles around it, within a margin of one
+    rectangle. Results are the same as those of the engine. """
+
+    def __init__(
+        self,
+        engine: CollisionEngine,
+        tile_width: int = None,
+        tile_height: int = None,
+        processes: int = None,
+    ):
+        self.rect_width = engine.rect_width
+        self.rect_height = engine.rect_height
+        self.tile_width = tile_width or 32 * engine.rect_width
+        self.tile_height = tile_height or 32 * engine.rect_height
+
+        ids, x, y = engine.store.columns()
+        order = np.argsort(y, kind="stable")
+        self.count = len(ids)
+
+        self.shared = SharedMemory(create=True, size=max(1, 3 * self.count * 8))
+        self.snapshot = np.ndarray((3, self.count), dtype=np.int64, buffer=self.shared.buf)
+        self.snapshot[ID] = ids[order]
+        self.snapshot[X] = x[order]
+        self.snapshot[Y] = y[order]
+
+        # Row of every rectangle in the snapshot, by id
+        self.rows = np.full(engine.store.size, -1, dtype=np.int64)
+        self.rows[ids[order]] = np.arange(self.count)
+
+        self.processes = os.cpu_count() if processes is None else processes
+        self.pool = None
+        if self.processes > 0:
+            self.pool = Pool(
+                self.processes,
+                initializer=_attach,
+                initargs=(self.shared.name, self.count),
+            )
+
+
+    def overlaps(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        width: np.ndarray,
+        height: np.ndarray,
+    ) -> List[np.ndarray]:
+        """ Ids of the rectangles overlapping every area, in ascending order. """
+
+        x, y, width, height = (np.asarray(a, dtype=np.int64) for a in (x, y, width, height))
+        results: List[np.ndarray] = [None] * len(x)
+        for queries, found in self.run("overlaps", x, y, (x, y, width, height)):
+            for query, rect_ids in zip(queries.tolist(), found):
+                results[query] = rect_ids
+        return results
+
+
+    def hits(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """ The rectangle under every point, NO_BLOCKER for none. """
+
+        x, y = np.asarray(x, dtype=np.int64), np.asarray(y, dtype=np.int64)
+        results = np.full(len(x), NO_BLOCKER, dtype=np.int64)
+        for queries, found in self.run("hits", x, y, (x, y)):
+            results[queries] = found
+        return results
+
+
+    def nearest_blockers(
+        self,
+        rect_ids: np.ndarray,
+        target_x: np.ndarray,
+        target_y: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """ The first rectangle hit by every rectangle moving in a straight
+        line to its target top-left corner and the time of impact in [0, 1).
+        NO_BLOCKER and inf for the paths that are free. """
+
+        rect_ids = np.asarray(rect_ids, dtype=np.int64)
+        target_x = np.asarray(target_x, dtype=np.int64)
+        target_y = np.asarray(target_y, dtype=np.int64)
+
+        rows = self.rows[rect_ids]
+        start_x, start_y = self.snapshot[X, rows], self.snapshot[Y, rows]
+
+        nearest = np.full(len(rect_ids), NO_BLOCKER, dtype=np.int64)
+        times = np.full(len(rect_ids), np.inf)
+        tasks = self.run(
+            "nearest",
+            np.minimum(start_x, target_x),
+            np.minimum(start_y, target_y),
+            (rect_ids, start_x, start_y, target_x, target_y),
+        )
+        for queries, (found, found_times) in tasks:
+            nearest[queries] = found
+            times[queries] = found_times
+        return nearest, times
+
+
+    def run(
+        self,
+        kind: str,
+        x: np.ndarray,
+        y: np.ndarray,
+        args: tuple,
+    ) -> Iterator[Tuple[np.ndarray, object]]:
+        """ Splits the queries by the tile of (x, y)
+        and yields (query positions, kernel result) per tile. """
+
+        tiles = (y // self.tile_height) * (2 ** 32) + x // self.tile_width
+        order = np.argsort(tiles, kind="stable")
+        bounds = np.flatnonzero(np.diff(tiles[order], prepend=-1) != 0)
+
+        tasks = []
+        for queries in np.split(order, bounds[1:]):
+            if len(queries):
+                tasks.append((
+                    kind,
+                    queries,
+                    tuple(arg[queries] for arg in args),
+                    (self.rect_width, self.rect_height),
+                ))
+
+        if self.pool is None:
+            for kind, queries, task_args, rect_size in tasks:
+                yield queries, KERNELS[kind](self.snapshot, *task_args, *rect_size)
+        else:
+            chunk_size = max(1, len(tasks) // (4 * self.processes))
+            yield from self.pool.imap_unordered(_run, tasks, chunk_size)
+
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.shared is not None:
+            self.snapshot = None
+            self.shared.close()
+            self.shared.unlink()
+            self.shared = None
+
+
+    def __enter__(self) -> "ShardedQueries":
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
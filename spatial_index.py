@@ -0,0 +1,452 @@
+from typing import Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Inclusive pixel box (left, top, right, bottom), same convention as QRect
+Box = Tuple[int, int, int, int]
+
+
+def to_box(x: int, y: int, width: int, height: int) -> Box:
+    return (x, y, x + width - 1, y + height - 1)
+
+
+def boxes_overlap(a: Box, b: Box) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class SpatialIndex:
+    """ Common interface of the spatial indexes.
+
+    Keys are arbitrary hashable objects, bounds are given
+    as x, y, width, height and follow the QRect semantics. """
+
+    def insert(self, key: Hashable, x: int, y: int, width: int, height: int) -> None:
+        raise NotImplementedError
+
+
+    def insert_many(
+        self,
+        keys: Sequence[Hashable],
+        x: np.ndarray,
+        y: np.ndarray,
+        width: np.ndarray,
+        height: np.ndarray,
+    ) -> None:
+        """ Inserts many new keys at once, bounds are given as arrays. """
+
+        bounds = zip(x.tolist(), y.tolist(), width.tolist(), height.tolist())
+        for key, (key_x, key_y, key_width, key_height) in zip(keys, bounds):
+            self.insert(key, key_x, key_y, key_width, key_height)
+
+
+    def remove(self, key: Hashable) -> None:
+        raise NotImplementedError
+
+
+    def update(self, key: Hashable, x: int, y: int, width: int, height: int) -> None:
+        raise NotImplementedError
+
+
+    def query(self, x: int, y: int, width: int, height: int) -> Iterator[Hashable]:
+        raise NotImplementedError
+
+
+    def query_point(self, x: int, y: int) -> Iterator[Hashable]:
+        return self.query(x, y, 1, 1)
+
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        raise NotImplementedError
+
+
+class GridIndex(SpatialIndex):
+    """ Uniform grid whose cells are usually the size of a rectangle,
+    so every rectangle is stored in at most four buckets. """
+
+    def __init__(self, cell_width: int, cell_height: int):
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+
+        # Dicts are used as ordered sets to keep queries deterministic
+        self.cells: Dict[Tuple[int, int], Dict[Hashable, None]] = {}
+        self.boxes: Dict[Hashable, Box] = {}
+
+
+    def cell_range(self, box: Box) -> Tuple[int, int, int, int]:
+        return (
+            box[0] // self.cell_width,
+            box[1] // self.cell_height,
+            box[2] // self.cell_width,
+            box[3] // self.cell_height,
+        )
+
+
+    def insert(self, key: Hashable, x: int, y: int, width: int, height: int) -> None:
+        if key in self.boxes:
+            self.remove(key)
+
+        box = to_box(x, y, width, height)
+        self.boxes[key] = box
+        self.add_to_cells(key, self.cell_range(box))
+
+
+    def insert_many(
+        self,
+        keys: Sequence[Hashable],
+        x: np.ndarray,
+        y: np.ndarray,
+        width: np.ndarray,
+        height: np.ndarray,
+    ) -> None:
+        keys = list(keys)
+        right = x + width - 1
+        bottom = y + height - 1
+        self.boxes.update(zip(keys, zip(x.tolist(), y.tolist(), right.tolist(), bottom.tolist())))
+
+        cx1, cy1 = x // self.cell_width, y // self.cell_height
+        cx2, cy2 = right // self.cell_width, bottom // self.cell_height
+
+        # (cell, position of the key) pairs for every cell covered by a box
+        pair_cx, pair_cy, pair_key = [], [], []
+        for dx in range(int((cx2 - cx1).max(initial=0)) + 1):
+            for dy in range(int((cy2 - cy1).max(initial=0)) + 1):
+                covered = np.flatnonzero((cx1 + dx <= cx2) & (cy1 + dy <= cy2))
+                pair_cx.append(cx1[covered] + dx)
+                pair_cy.append(cy1[covered] + dy)
+                pair_key.append(covered)
+        pair_cx = np.concatenate(pair_cx)
+        pair_cy = np.concatenate(pair_cy)
+        pair_key = np.concatenate(pair_key)
+
+        # Grouped by cell, keys keep their order within the cells
+        order = np.lexsort((pair_key, pair_cy, pair_cx))
+        pair_cx, pair_cy, pair_key = pair_cx[order], pair_cy[order], pair_key[order]
+        starts = np.flatnonzero(
+            (np.diff(pair_cx, prepend=np.inf) != 0)
+            | (np.diff(pair_cy, prepend=np.inf) != 0)
+        )
+        ends = np.append(starts[1:], len(pair_key))
+
+        pair_key = [keys[i] for i in pair_key.tolist()]
+        cells = self.cells
+        for cell_key, start, end in zip(
+            zip(pair_cx[starts].tolist(), pair_cy[starts].tolist()),
+            starts.tolist(),
+            ends.tolist(),
+        ):
+            cell = cells.get(cell_key)
+            if cell is None:
+                cells[cell_key] = dict.fromkeys(pair_key[start:end])
+            else:
+                cell.update(dict.fromkeys(pair_key[start:end]))
+
+
+    def remove(self, key: Hashable) -> None:
+        box = self.boxes.pop(key)
+        self.remove_from_cells(key, self.cell_range(box))
+
+
+    def update(self, key: Hashable, x: int, y: int, width: int, height: int) -> None:
+        old_range = self.cell_range(self.boxes[key])
+        box = to_box(x, y, width, height)
+        new_range = self.cell_range(box)
+
+        self.boxes[key] = box
+        # Small moves usually stay within the same buckets
+        if old_range != new_range:
+            self.remove_from_cells(key, old_range)
+            self.add_to_cells(key, new_range)
+
+
+    def query(self, x: int, y: int, width: int, height: int) -> Iterator[Hashable]:
+        area = to_box(x, y, width, height)
+        cx1, cy1, cx2, cy2 = self.cell_range(area)
+
+        seen = set()
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                cell = self.cells.get((cx, cy))
+                if not cell:
+                    continue
+                for key in cell:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    if boxes_overlap(area, self.boxes[key]):
+                        yield key
+
+
+    def query_point(self, x: int, y: int) -> Iterator[Hashable]:
+        cell = self.cells.get((x // self.cell_width, y // self.cell_height))
+        if not cell:
+            return
+        for key in cell:
+            box = self.boxes[key]
+            if box[0] <= x <= box[2] and box[1] <= y <= box[3]:
+                yield key
+
+
+    def add_to_cells(self, key: Hashable, cell_range: Tuple[int, int, int, int]) -> None:
+        cx1, cy1, cx2, cy2 = cell_range
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                self.cells.setdefault((cx, cy), {})[key] = None
+
+
+    def remove_from_cells(self, key: Hashable, cell_range: Tuple[int, int, int, int]) -> None:
+        cx1, cy1, cx2, cy2 = cell_range
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                cell = self.cells[(cx, cy)]
+                del cell[key]
+                if not cell:
+                    del self.cells[(cx, cy)]
+
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.boxes
+
+
+class _Node:
+    __slots__ = ("leaf", "boxes", "children", "parent")
+
+    def __init__(self, leaf: bool):
+        self.leaf = leaf
+        self.boxes: List[Box] = []
+        # Keys for the leaves, nested nodes otherwise
+        self.children: list = []
+        self.parent: Optional["_Node"] = None
+
+
+    def bounds(self) -> Box:
+        return (
+            min(b[0] for b in self.boxes),
+            min(b[1] for b in self.boxes),
+            max(b[2] for b in self.boxes),
+            max(b[3] for b in self.boxes),
+        )
+
+
+def _union(a: Box, b: Box) -> Box:
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _area(box: Box) -> int:
+    return (box[2] - box[0] + 1) * (box[3] - box[1] + 1)
+
+
+class RTreeIndex(SpatialIndex):
+    """ R-tree with quadratic split (Guttman), suited for scenes
+    where rectangles are unevenly spread over a large area. """
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self.min_entries = max(2, max_entries // 3)
+
+        self.root = _Node(leaf=True)
+        self.boxes: Dict[Hashable, Box] = {}
+        self.leaves: Dict[Hashable, _Node] = {}
+
+
+    def insert(self, key: Hashable, x: int, y: int, width: int, height: int) -> None:
+        if key in self.boxes:
+            self.remove(key)
+
+        box = to_box(x, y, width, height)
+        self.boxes[key] = box
+        self.insert_entry(key, box)
+
+
+    def remove(self, key: Hashable) -> None:
+        self.boxes.pop(key)
+        leaf = self.leaves.pop(key)
+
+        i = leaf.children.index(key)
+        leaf.children.pop(i)
+        leaf.boxes.pop(i)
+
+        self.condense(leaf)
+
+
+    def update(self, key: Hashable, x: int, y: int, width: int, height: int) -> None:
+        box = to_box(x, y, width, height)
+        leaf = self.leaves[key]
+        parent = leaf.parent
+
+        # The box stays inside its leaf, the tree above remains valid
+        if parent is not None:
+            leaf_box = parent.boxes[parent.children.index(leaf)]
+            if (
+                leaf_box[0] <= box[0] and leaf_box[1] <= box[1]
+                and box[2] <= leaf_box[2] and box[3] <= leaf_box[3]
+            ):
+                self.boxes[key] = box
+                leaf.boxes[leaf.children.index(key)] = box
+                return
+
+        self.remove(key)
+        self.boxes[key] = box
+        self.insert_entry(key, box)
+
+
+    def query(self, x: int, y: int, width: int, height: int) -> Iterator[Hashable]:
+        area = to_box(x, y, width, height)
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            for box, child in zip(node.boxes, node.children):
+                if boxes_overlap(area, box):
+                    if node.leaf:
+                        yield child
+                    else:
+                        stack.append(child)
+
+
+    def insert_entry(self, key: Hashable, box: Box) -> None:
+        node = self.root
+        while not node.leaf:
+            best = None
+            best_cost = None
+            for i, child_box in enumerate(node.boxes):
+                area = _area(child_box)
+                cost = (_area(_union(child_box, box)) - area, area)
+                if best_cost is None or cost < best_cost:
+                    best_cost = cost
+                    best = i
+            node = node.children[best]
+
+        node.boxes.append(box)
+        node.children.append(key)
+        self.leaves[key] = node
+        self.adjust(node)
+
+
+    def adjust(self, node: _Node) -> None:
+        """ Propagates the changed bounds of the node to the root,
+        splitting overflowing nodes on the way up. """
+
+        while True:
+            sibling = None
+            if len(node.children) > self.max_entries:
+                sibling = self.split(node)
+
+            parent = node.parent
+            if parent is None:
+                if sibling is not None:
+                    root = _Node(leaf=False)
+                    for child in (node, sibling):
+                        child.parent = root
+                        root.children.append(child)
+                        root.boxes.append(child.bounds())
+                    self.root = root
+                return
+
+            parent.boxes[parent.children.index(node)] = node.bounds()
+            if sibling is not None:
+                sibling.parent = parent
+                parent.children.append(sibling)
+                parent.boxes.append(sibling.bounds())
+            node = parent
+
+
+    def split(self, node: _Node) -> _Node:
+        entries = list(zip(node.boxes, node.children))
+
+        # Pick the pair of entries wasting the most area as seeds
+        seeds = None
+        worst = None
+        for i in range(len(entries)):
+            for j in range(i + 1, len(entries)):
+                a, b = entries[i][0], entries[j][0]
+                waste = _area(_union(a, b)) - _area(a) - _area(b)
+                if worst is None or waste > worst:
+                    worst = waste
+                    seeds = (i, j)
+
+        groups = ([entries[seeds[0]]], [entries[seeds[1]]])
+        group_boxes = [entries[seeds[0]][0], entries[seeds[1]][0]]
+        rest = [e for k, e in enumerate(entries) if k not in seeds]
+
+        for n, entry in enumerate(rest):
+            remaining = len(rest) - n
+            # Make sure that both groups get at least the minimum of entries
+            if len(groups[0]) + remaining <= self.min_entries:
+                target = 0
+            elif len(groups[1]) + remaining <= self.min_entries:
+                target = 1
+            else:
+                growth = [
+                    _area(_union(group_boxes[g], entry[0])) - _area(group_boxes[g])
+                    for g in (0, 1)
+                ]
+                target = 0 if growth[0] <= growth[1] else 1
+            groups[target].append(entry)
+            group_boxes[target] = _union(group_boxes[target], entry[0])
+
+        sibling = _Node(leaf=node.leaf)
+        for target, group in ((node, groups[0]), (sibling, groups[1])):
+            target.boxes = [box for box, _ in group]
+            target.children = [child for _, child in group]
+
+        for child in sibling.children:
+            if node.leaf:
+                self.leaves[child] = sibling
+            else:
+                child.parent = sibling
+
+        return sibling
+
+
+    def condense(self, node: _Node) -> None:
+        orphans: List[Hashable] = []
+
+        while node.parent is not None:
+            parent = node.parent
+            i = parent.children.index(node)
+            if len(node.children) < self.min_entries:
+                parent.children.pop(i)
+                parent.boxes.pop(i)
+                orphans.extend(self.collect_keys(node))
+            else:
+                parent.boxes[i] = node.bounds()
+            node = parent
+
+        if not self.root.leaf:
+            if not self.root.children:
+                self.root = _Node(leaf=True)
+            elif len(self.root.children) == 1:
+                self.root = self.root.children[0]
+                self.root.parent = None
+
+        for key in orphans:
+            self.insert_entry(key, self.boxes[key])
+
+
+    def collect_keys(self, node: _Node) -> List[Hashable]:
+        keys = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.leaf:
+                keys.extend(node.children)
+            else:
+                stack.extend(node.children)
+        return keys
+
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.boxes
@@ -0,0 +1,196 @@
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+
+# Bits of the flags array
+ALIVE = 1
+HIGHLIGHTED = 2
+SELECTED = 4
+
+
+class RectangleStore:
+    """ Rectangles kept in contiguous int32 arrays indexed by rectangle id.
+
+    Colors are stored as 0xRRGGBB. Ids of removed rectangles are reused,
+    so only the slots with the ALIVE flag hold rectangles. """
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.count = 0
+        self.free_ids: List[int] = []
+
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.width = np.zeros(capacity, dtype=np.int32)
+        self.height = np.zeros(capacity, dtype=np.int32)
+        self.color = np.zeros(capacity, dtype=np.int32)
+        self.flags = np.zeros(capacity, dtype=np.int32)
+
+        # Called with the id of every moved rectangle
+        self.move_listeners: List[Callable[[int], None]] = []
+
+
+    def add(self, x: int, y: int, width: int, height: int, color: int = 0) -> int:
+        if self.free_ids:
+            rect_id = self.free_ids.pop()
+        else:
+            if self.size == len(self.x):
+                self.reserve(2 * self.size)
+            rect_id = self.size
+            self.size += 1
+
+        self.x[rect_id] = x
+        self.y[rect_id] = y
+        self.width[rect_id] = width
+        self.height[rect_id] = height
+        self.color[rect_id] = color
+        self.flags[rect_id] = ALIVE
+        self.count += 1
+        return rect_id
+
+
+    def extend(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        width: np.ndarray,
+        height: np.ndarray,
+        color: np.ndarray,
+    ) -> np.ndarray:
+        """ Adds many rectangles after the last used slot
+        and returns their ids. """
+
+        count = len(x)
+        if self.size + count > len(self.x):
+            self.reserve(max(2 * len(self.x), self.size + count))
+
+        ids = np.arange(self.size, self.size + count)
+        self.x[ids] = x
+        self.y[ids] = y
+        self.width[ids] = width
+        self.height[ids] = height
+        self.color[ids] = color
+        self.flags[ids] = ALIVE
+        self.size += count
+        self.count += count
+        return ids
+
+
+    def restore(
+        self,
+        rect_ids: np.ndarray,
+        x: np.ndarray,
+        y: np.ndarray,
+        width: np.ndarray,
+        height: np.ndarray,
+        color: np.ndarray,
+    ) -> None:
+        """ Puts removed rectangles back under their old ids,
+        which must be free. """
+
+        if len(rect_ids) == 0:
+            return
+        end = int(rect_ids.max()) + 1
+        if end > self.size:
+            self.reserve(max(2 * len(self.x), end))
+            self.free_ids.extend(range(self.size, end))
+            self.size = end
+
+        taken = set(rect_ids.tolist())
+        self.free_ids = [rect_id for rect_id in self.free_ids if rect_id not in taken]
+        self.x[rect_ids] = x
+        self.y[rect_ids] = y
+        self.width[rect_ids] = width
+        self.height[rect_ids] = height
+        self.color[rect_ids] = color
+        self.flags[rect_ids] = ALIVE
+        self.count += len(rect_ids)
+
+
+    def remove(self, rect_id: int) -> None:
+        self.flags[rect_id] = 0
+        self.free_ids.append(rect_id)
+        self.count -= 1
+
+
+    def reserve(self, capacity: int) -> None:
+        if capacity <= len(self.x):
+            return
+        for name in ("x", "y", "width", "height", "color", "flags"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=np.int32)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+
+    def move_to(self, rect_id: int, x: int, y: int) -> None:
+        if self.x[rect_id] == x and self.y[rect_id] == y:
+            return
+        self.x[rect_id] = x
+        self.y[rect_id] = y
+        for listener in self.move_listeners:
+            listener(rect_id)
+
+
+    def position(self, rect_id: int) -> Tuple[int, int]:
+        return int(self.x[rect_id]), int(self.y[rect_id])
+
+
+    def bounds(self, rect_id: int) -> Tuple[int, int, int, int]:
+        return (
+            int(self.x[rect_id]),
+            int(self.y[rect_id]),
+            int(self.width[rect_id]),
+            int(self.height[rect_id]),
+        )
+
+
+    def center(self, rect_id: int) -> Tuple[int, int]:
+        """ Same point as QRect.center(), whose division truncates. """
+
+        x, y, width, height = self.bounds(rect_id)
+        return int((2 * x + width - 1) / 2), int((2 * y + height - 1) / 2)
+
+
+    def centers(self, rect_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        x = 2 * self.x[rect_ids].astype(np.int64) + self.width[rect_ids] - 1
+        y = 2 * self.y[rect_ids].astype(np.int64) + self.height[rect_ids] - 1
+        return np.trunc(x / 2).astype(np.int64), np.trunc(y / 2).astype(np.int64)
+
+
+    def is_alive(self, rect_id: int) -> bool:
+        return 0 <= rect_id < self.size and bool(self.flags[rect_id] & ALIVE)
+
+
+    def set_flag(self, rect_id: int, flag: int, value: bool) -> None:
+        if value:
+            self.flags[rect_id] |= flag
+        else:
+            self.flags[rect_id] &= ~flag
+
+
+    def ids(self) -> np.ndarray:
+        """ Ids of the stored rectangles in ascending order. """
+
+        if not self.free_ids:
+            return np.arange(self.size)
+        return np.flatnonzero(self.flags[:self.size] & ALIVE)
+
+
+    def columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Ids and top-left corners of the stored rectangles.
+        The coordinates are views into the store when no slot is free. """
+
+        if not self.free_ids:
+            return np.arange(self.size), self.x[:self.size], self.y[:self.size]
+        ids = self.ids()
+        return ids, self.x[ids], self.y[ids]
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+    def __contains__(self, rect_id: int) -> bool:
+        return self.is_alive(rect_id)
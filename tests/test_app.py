@@ -0,0 +1,74 @@
+from typing import List, Tuple
+
+from PyQt5.QtCore import QEvent, QPoint, QPointF, Qt
+from PyQt5.QtGui import QMouseEvent
+
+from app import MainWindow
+from store import SELECTED
+
+
+def mouse(kind: QEvent.Type, x: int, y: int) -> QMouseEvent:
+    return QMouseEvent(kind, QPointF(x, y), Qt.LeftButton, Qt.LeftButton, Qt.NoModifier)
+
+
+def jump(window: MainWindow, rect_id: int, to: Tuple[int, int]) -> List[Tuple[int, int]]:
+    """ Drags the rectangle at (20, 60) with a small move that starts the
+    frame timer and a far one coalesced until the release. Returns the
+    position while the far move waits and the one after the release. """
+
+    window.mousePressEvent(mouse(QEvent.MouseButtonPress, 60, 80))
+    window.mouseMoveEvent(mouse(QEvent.MouseMove, 61, 80))
+    window.mouseMoveEvent(mouse(QEvent.MouseMove, *to))
+    waiting = window.engine.position(rect_id)
+    window.mouseReleaseEvent(mouse(QEvent.MouseButtonRelease, *to))
+    return [waiting, window.engine.position(rect_id)]
+
+
+def test_coalesced_jump_reaches_the_target(qapp):
+    window = MainWindow(app_height=600, app_width=900, rect_height=40)
+    rect_id = window.add_rectangle(QPoint(20, 60)).id
+    window.add_rectangle(QPoint(200, 400))
+
+    assert jump(window, rect_id, (700, 300)) == [(21, 60), (660, 280)]
+
+
+def test_coalesced_jump_stops_at_a_blocker_on_the_way(qapp):
+    window = MainWindow(app_height=600, app_width=900, rect_height=40)
+    rect_id = window.add_rectangle(QPoint(20, 60)).id
+    window.add_rectangle(QPoint(300, 60))
+
+    assert jump(window, rect_id, (700, 80)) == [(21, 60), (221, 60)]
+
+
+def test_rubber_band_selects_and_drags_a_group(qapp):
+    window = MainWindow(app_height=600, app_width=900, rect_height=40)
+    first = window.add_rectangle(QPoint(100, 100)).id
+    second = window.add_rectangle(QPoint(200, 100)).id
+    blocker = window.add_rectangle(QPoint(100, 300)).id
+    store = window.engine.store
+
+    window.mousePressEvent(mouse(QEvent.MouseButtonPress, 50, 50))
+    window.mouseMoveEvent(mouse(QEvent.MouseMove, 300, 160))
+    window.mouseReleaseEvent(mouse(QEvent.MouseButtonRelease, 300, 160))
+
+    assert window.selection == {first, second}
+    assert [bool(store.flags[rect_id] & SELECTED) for rect_id in (first, second, blocker)] == [
+        True, True, False
+    ]
+
+    # The group stops when its first member meets the blocker
+    window.mousePressEvent(mouse(QEvent.MouseButtonPress, 120, 110))
+    window.mouseMoveEvent(mouse(QEvent.MouseMove, 120, 111))
+    window.mouseMoveEvent(mouse(QEvent.MouseMove, 120, 360))
+    window.mouseReleaseEvent(mouse(QEvent.MouseButtonRelease, 120, 360))
+
+    assert window.engine.position(first) == (100, 261)
+    assert window.engine.position(second) == (200, 261)
+    assert window.selection == {first, second}
+
+    # Pressing empty space drops the selection
+    window.mousePressEvent(mouse(QEvent.MouseButtonPress, 700, 50))
+    window.mouseReleaseEvent(mouse(QEvent.MouseButtonRelease, 700, 50))
+
+    assert window.selection == set()
+    assert not (store.flags[[first, second, blocker]] & SELECTED).any()
@@ -0,0 +1,23 @@
+from colors import ColorAllocator, HIGHLIGHTED_BORDER_RGB
+
+
+def test_claim_many_replaces_taken_colors():
+    colors = ColorAllocator()
+    taken = colors.allocate()
+
+    claimed = colors.claim_many([taken, HIGHLIGHTED_BORDER_RGB, 0x123456, 0x123456]).tolist()
+
+    assert claimed[2] == 0x123456
+    assert len(set(claimed)) == 4
+    assert taken not in claimed and HIGHLIGHTED_BORDER_RGB not in claimed
+    assert len(colors) == 5
+
+
+def test_release_keeps_colors_still_in_use():
+    colors = ColorAllocator()
+    first = colors.allocate()
+    second = colors.claim_many([first])[0]
+
+    colors.release(second)
+
+    assert first in colors
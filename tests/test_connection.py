@@ -0,0 +1,184 @@
+import numpy as np
+from PyQt5.QtCore import QPoint
+
+from connection import Connection, ConnectionGraph
+from rectangle import Rectangle
+from store import RectangleStore
+
+
+def make_store(count: int) -> RectangleStore:
+    store = RectangleStore()
+    for i in range(count):
+        store.add(100 * i, 0, 40, 20)
+    return store
+
+
+def connect(graph: ConnectionGraph, store: RectangleStore, rect1_id: int, rect2_id: int) -> bool:
+    return graph.add(Connection(Rectangle(store, rect1_id), Rectangle(store, rect2_id)))
+
+
+def test_pairs_are_unordered_and_added_once():
+    store = make_store(3)
+    graph = ConnectionGraph(store)
+
+    assert connect(graph, store, 0, 1)
+    assert not connect(graph, store, 1, 0)
+    assert not connect(graph, store, 0, 1)
+    assert connect(graph, store, 2, 1)
+
+    assert len(graph) == 2
+    assert graph.connected(1, 0) and graph.connected(1, 2)
+    assert not graph.connected(0, 2)
+    assert graph.get(1, 0) is graph.get(0, 1)
+    assert graph.get(1, 0) in graph
+    assert sorted(graph.neighbors(1)) == [0, 2]
+    assert graph.degree(1) == 2 and graph.degree(0) == 1
+
+
+def test_remove_rectangle_takes_its_connections():
+    store = make_store(4)
+    graph = ConnectionGraph(store)
+    for rect1_id, rect2_id in ((0, 1), (0, 2), (3, 0), (1, 2)):
+        connect(graph, store, rect1_id, rect2_id)
+
+    removed = graph.remove_rectangle(0)
+
+    assert sorted(graph.key(conn.rect1.id, conn.rect2.id) for conn in removed) == [
+        (0, 1), (0, 2), (0, 3)
+    ]
+    assert list(graph.edges) == [(1, 2)]
+    assert graph.degree(0) == 0 and graph.degree(3) == 0
+    assert 0 not in graph.adjacency and 3 not in graph.adjacency
+    assert graph.remove_rectangle(0) == []
+
+
+def test_connected_components_match_union_find():
+    rng = np.random.default_rng(0)
+    store = make_store(60)
+    graph = ConnectionGraph(store)
+    for rect1_id, rect2_id in rng.integers(0, 60, (45, 2)).tolist():
+        if rect1_id != rect2_id:
+            connect(graph, store, rect1_id, rect2_id)
+    for rect_id in rng.integers(0, 60, 5).tolist():
+        graph.remove_rectangle(rect_id)
+
+    parent = list(range(60))
+
+    def find(rect_id: int) -> int:
+        while parent[rect_id] != rect_id:
+            rect_id = parent[rect_id]
+        return rect_id
+
+    for rect1_id, rect2_id in graph.edges:
+        parent[find(rect1_id)] = find(rect2_id)
+    expected = {}
+    for rect_id in graph.adjacency:
+        expected.setdefault(find(rect_id), set()).add(rect_id)
+
+    components = graph.connected_components()
+    assert sorted(map(sorted, components)) == sorted(map(sorted, expected.values()))
+
+
+def random_scene(rng: np.random.Generator, count: int = 200, edges: int = 300):
+    store = RectangleStore()
+    for x, y in rng.integers(0, 2000, (count, 2)).tolist():
+        store.add(x, y, 40, 20)
+    graph = ConnectionGraph(store)
+    for rect1_id, rect2_id in rng.integers(0, count, (edges, 2)).tolist():
+        if rect1_id != rect2_id:
+            connect(graph, store, rect1_id, rect2_id)
+    return store, graph
+
+
+def clicks_near_segments(
+    rng: np.random.Generator, store: RectangleStore, graph: ConnectionGraph, count: int
+):
+    """ Points around random segments, some within the tolerance and some past it. """
+
+    keys = list(graph.edges)
+    for i in rng.integers(0, len(keys), count).tolist():
+        (x1, y1), (x2, y2) = store.center(keys[i][0]), store.center(keys[i][1])
+        length = max(np.hypot(x2 - x1, y2 - y1), 1)
+        t, offset = rng.random(), rng.uniform(-13, 13)
+        yield (
+            int(round(x1 + t * (x2 - x1) - offset * (y2 - y1) / length)),
+            int(round(y1 + t * (y2 - y1) + offset * (x2 - x1) / length)),
+        )
+
+
+def earliest_containing(graph: ConnectionGraph, x: int, y: int):
+    point = QPoint(x, y)
+    hits = [key for key, conn in graph.edges.items() if conn.contains(point, graph.variance)]
+    return graph.edges[min(hits, key=graph.order.__getitem__)] if hits else None
+
+
+def test_vectorized_hit_test_matches_connection_at():
+    rng = np.random.default_rng(1)
+    store, graph = random_scene(rng)
+    for rect_id in rng.integers(0, 200, 40).tolist():
+        graph.remove_rectangle(rect_id)
+
+    hits = 0
+    for x, y in clicks_near_segments(rng, store, graph, 500):
+        found = graph.connection_at(x, y)
+        assert graph.connection_at_vectorized(x, y) is found
+        assert earliest_containing(graph, x, y) is found
+        hits += found is not None
+    assert 0 < hits < 500
+
+
+def test_hit_tests_include_points_at_exactly_the_tolerance():
+    store = RectangleStore()
+    # Centers at (100, 100) and (400, 500), a segment 500 long
+    store.add(81, 91, 40, 20)
+    store.add(381, 491, 40, 20)
+    graph = ConnectionGraph(store)
+    connect(graph, store, 0, 1)
+    connection = graph.get(0, 1)
+
+    for x, y in ((258, 294), (242, 306)):
+        assert graph.connection_at(x, y) is connection
+        assert graph.connection_at_vectorized(x, y) is connection
+        assert earliest_containing(graph, x, y) is connection
+    for x, y in ((259, 294), (241, 306)):
+        assert graph.connection_at(x, y) is None
+        assert graph.connection_at_vectorized(x, y) is None
+        assert earliest_containing(graph, x, y) is None
+
+
+def test_segment_rows_of_removed_connections_are_reused():
+    store = make_store(4)
+    graph = ConnectionGraph(store)
+    connect(graph, store, 0, 1)
+    connect(graph, store, 1, 2)
+    row = graph.rows[(0, 1)]
+
+    graph.remove(graph.get(0, 1))
+    connect(graph, store, 2, 3)
+
+    assert graph.rows[(2, 3)] == row
+    assert graph.segments.size == 2
+    assert graph.segments.endpoints(np.array([row])).tolist() == [
+        [*store.center(2), *store.center(3)]
+    ]
+
+
+def test_segments_follow_moved_rectangles():
+    rng = np.random.default_rng(2)
+    store, graph = random_scene(rng)
+
+    for _ in range(3):
+        for rect_id, x, y in zip(
+            rng.integers(0, 200, 50).tolist(), *rng.integers(0, 2000, (2, 50)).tolist()
+        ):
+            store.move_to(rect_id, x, y)
+
+        for x, y in clicks_near_segments(rng, store, graph, 60):
+            assert graph.connection_at(x, y) is earliest_containing(graph, x, y)
+
+        keys = list(graph.edges)
+        rows = np.array([graph.rows[key] for key in keys])
+        assert graph.segments.endpoints(rows).tolist() == [
+            [*store.center(rect1_id), *store.center(rect2_id)] for rect1_id, rect2_id in keys
+        ]
+        assert not graph.stale
@@ -0,0 +1,140 @@
+from typing import Tuple
+
+import numpy as np
+
+from batch import overlapping_boxes
+from engine import CollisionEngine
+
+
+def test_drag_stops_at_contact():
+    engine = CollisionEngine(1200, 800, 80, 40)
+    moved = engine.add(0, 0)
+    blocker = engine.add(100, 0)
+
+    assert engine.drag(moved, (300, 0)) == (21, 0)
+    assert engine.collision_x.rect_id == blocker
+
+
+def test_drag_heads_for_target_after_passing_blocker():
+    engine = CollisionEngine(1200, 800, 80, 40)
+    moved = engine.add(0, 0)
+    engine.add(100, 0)
+
+    assert engine.drag(moved, (300, 200)) == (300, 200)
+    assert engine.collision_x is None and engine.collision_y is None
+
+
+def test_drag_slides_along_blocker_to_its_edge():
+    engine = CollisionEngine(1200, 800, 80, 40)
+    moved = engine.add(0, 0)
+    engine.add(100, 0)
+
+    assert engine.drag(moved, (300, 39)) == (300, 39)
+    assert engine.drag(moved, (0, 20)) == (179, 20)
+
+
+def test_drag_slides_from_a_corner_contact():
+    engine = CollisionEngine(2000, 1500, 40, 20)
+    moved = engine.add(378, 1461)
+    corner = engine.add(417, 1480)
+    side = engine.add(417, 1461)
+
+    assert engine.drag(moved, (1745, 1480)) == (378, 1480)
+    assert engine.collision_x.rect_id in (corner, side)
+
+    engine.move_to(moved, 378, 1461)
+    batch = engine.drag_batch([moved], [(1745, 1480)])
+    assert (int(batch.x[0]), int(batch.y[0])) == (378, 1480)
+
+
+def test_one_drag_settles_the_move():
+    rng = np.random.default_rng(1)
+    engine = CollisionEngine(1000, 800, 40, 20)
+    engine.add_rectangles(rng.integers(0, 960, 400), rng.integers(0, 780, 400))
+    rect_ids = engine.store.ids()
+
+    for _ in range(300):
+        rect_id = int(rng.choice(rect_ids))
+        target = int(rng.integers(-50, 1000)), int(rng.integers(-50, 800))
+        position = engine.drag(rect_id, target)
+        assert engine.drag(rect_id, target) == position
+
+        _, x, y = engine.store.columns()
+        query, item = overlapping_boxes(x, y, x, y, 39, 19)
+        assert not (query < item).any()
+
+
+def test_drag_batch_matches_single_drag():
+    engine = CollisionEngine(1200, 800, 80, 40)
+    moved = engine.add(0, 0)
+    engine.add(100, 0)
+
+    batch = engine.drag_batch([moved], [(300, 200)])
+    assert (int(batch.x[0]), int(batch.y[0])) == (300, 200)
+
+
+def brute_force_group_drag(
+    engine: CollisionEngine, rect_ids: np.ndarray, anchor_id: int, target: Tuple[int, int]
+) -> Tuple[int, int]:
+    """ Position drag_group should reach: the anchor dragged alone among
+    copies of every other rectangle, shifted by the offset of every member,
+    with the target kept where all members stay in the window. """
+
+    w, h = engine.rect_width, engine.rect_height
+    x, y = engine.position(anchor_id)
+    member_x = engine.store.x[rect_ids].astype(np.int64)
+    member_y = engine.store.y[rect_ids].astype(np.int64)
+    target_x = min(max(target[0], x - member_x.min()), engine.width - w - (member_x.max() - x))
+    target_y = min(max(target[1], y - member_y.min()), engine.height - h - (member_y.max() - y))
+
+    others, other_x, other_y = engine.store.columns()
+    keep = ~np.isin(others, rect_ids)
+    copy_x = (other_x[keep][None, :] - (member_x - x)[:, None]).ravel()
+    copy_y = (other_y[keep][None, :] - (member_y - y)[:, None]).ravel()
+
+    # Moved far from the edges, the copies may reach past the window
+    margin = 10 * max(engine.width, engine.height)
+    alone = CollisionEngine(engine.width + 2 * margin, engine.height + 2 * margin, w, h)
+    moved = alone.add(x + margin, y + margin)
+    alone.add_many(copy_x + margin, copy_y + margin)
+    reached = alone.drag(moved, (int(target_x) + margin, int(target_y) + margin))
+    return reached[0] - margin, reached[1] - margin
+
+
+def test_group_drag_matches_brute_force():
+    rng = np.random.default_rng(3)
+    engine = CollisionEngine(1200, 800, 40, 20)
+    engine.add_rectangles(rng.integers(0, 1160, 300), rng.integers(0, 780, 300))
+    rect_ids = engine.store.ids()
+
+    for _ in range(150):
+        anchor_id = int(rng.choice(rect_ids))
+        x, y = engine.position(anchor_id)
+        near = engine.rectangles_in(x - 100, y - 50, 240, 120)
+        near = [rect_id for rect_id in near if rect_id != anchor_id]
+        group = np.array([anchor_id] + near[:5], dtype=np.int64)
+        target = int(rng.integers(-100, 1200)), int(rng.integers(-100, 800))
+
+        expected = brute_force_group_drag(engine, group, anchor_id, target)
+        offsets = engine.store.x[group] - x, engine.store.y[group] - y
+        assert engine.drag_group(group, anchor_id, target) == expected
+        assert (engine.store.x[group] - expected[0] == offsets[0]).all()
+        assert (engine.store.y[group] - expected[1] == offsets[1]).all()
+
+        _, all_x, all_y = engine.store.columns()
+        query, item = overlapping_boxes(all_x, all_y, all_x, all_y, 39, 19)
+        assert not (query < item).any()
+
+
+def test_one_member_group_drag_matches_drag():
+    rng = np.random.default_rng(4)
+    x, y = rng.integers(0, 1160, 300), rng.integers(0, 780, 300)
+    single, group = CollisionEngine(1200, 800, 40, 20), CollisionEngine(1200, 800, 40, 20)
+    single.add_rectangles(x, y)
+    group.add_rectangles(x, y)
+    rect_ids = single.store.ids()
+
+    for _ in range(300):
+        rect_id = int(rng.choice(rect_ids))
+        target = int(rng.integers(-100, 1200)), int(rng.integers(-100, 800))
+        assert group.drag_group(np.array([rect_id]), rect_id, target) == single.drag(rect_id, target)
@@ -0,0 +1,62 @@
+import numpy as np
+
+from engine import CollisionEngine
+from free_space import FreeSpace
+from spatial_index import to_box
+
+
+def assert_consistent(engine: CollisionEngine) -> None:
+    """ Index and free space hold exactly the rectangles of the store. """
+
+    store, index = engine.store, engine.index
+    rect_ids = store.ids().tolist()
+    assert sorted(index.boxes) == sorted(rect_ids)
+    for rect_id in rect_ids:
+        box = to_box(*store.bounds(rect_id))
+        assert index.boxes[rect_id] == box
+        left, top, right, bottom = index.cell_range(box)
+        for column in range(left, right + 1):
+            for row in range(top, bottom + 1):
+                assert rect_id in index.cells[column, row]
+    assert sum(len(keys) for keys in index.cells.values()) == sum(
+        (right - left + 1) * (bottom - top + 1)
+        for left, top, right, bottom in map(index.cell_range, index.boxes.values())
+    )
+
+    assert engine.free_space.positions == {
+        rect_id: store.position(rect_id) for rect_id in rect_ids
+    }
+    recounted = FreeSpace(engine.width, engine.height, engine.rect_width, engine.rect_height)
+    recounted.add_many(*store.columns())
+    assert np.array_equal(engine.free_space.counts, recounted.counts)
+    assert np.array_equal(engine.free_space.free, recounted.free)
+
+
+def test_index_and_free_space_follow_random_edits():
+    rng = np.random.default_rng(0)
+    engine = CollisionEngine(800, 600, 40, 20)
+    removed = []
+
+    for _ in range(300):
+        rect_ids = engine.store.ids()
+        kind = rng.integers(0, 6) if len(rect_ids) > 2 else 0
+        if kind == 0:
+            place = engine.place(int(rng.integers(0, 760)), int(rng.integers(0, 580)))
+            if place is not None:
+                engine.add(*place)
+        elif kind == 1:
+            engine.add_rectangles(rng.integers(0, 760, 8), rng.integers(0, 580, 8))
+        elif kind == 2:
+            rect_id = int(rng.choice(rect_ids))
+            removed.append((rect_id, *engine.position(rect_id), int(engine.store.color[rect_id])))
+            engine.remove(rect_id)
+        elif kind == 3:
+            engine.drag(int(rng.choice(rect_ids)), (int(rng.integers(0, 760)), int(rng.integers(0, 580))))
+        elif kind == 4:
+            movers = rng.choice(rect_ids, min(len(rect_ids), 5), replace=False)
+            engine.drag_batch(movers.tolist(), rng.integers(0, 760, (len(movers), 2)).tolist())
+        elif removed:
+            rect_id, x, y, color = removed.pop()
+            if rect_id not in engine.store and engine.placeable(np.array([x]), np.array([y]))[0]:
+                engine.restore(np.array([rect_id]), np.array([x]), np.array([y]), np.array([color]))
+        assert_consistent(engine)
@@ -0,0 +1,76 @@
+import numpy as np
+
+from free_space import FreeSpace, closest_free
+
+
+def brute_counts(free_space: FreeSpace, width: int, height: int) -> np.ndarray:
+    """ Rectangles sharing a pixel with every cell, cells past the window taken. """
+
+    w, h = free_space.rect_width, free_space.rect_height
+    counts = np.zeros_like(free_space.counts)
+    rows, columns = counts.shape
+    for row in range(rows):
+        for column in range(columns):
+            if (row + 1) * h > height or (column + 1) * w > width:
+                counts[row, column] = 1
+            cell_x, cell_y = column * w, row * h
+            for x, y in free_space.positions.values():
+                if abs(x - cell_x) < w and abs(y - cell_y) < h:
+                    counts[row, column] += 1
+    return counts
+
+
+def test_free_space_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        width, height = int(rng.integers(100, 600)), int(rng.integers(100, 400))
+        w, h = int(rng.integers(10, 50)), int(rng.integers(5, 30))
+        free_space = FreeSpace(width, height, w, h, block=int(rng.integers(2, 6)))
+        count = int(rng.integers(2, 30))
+        free_space.add_many(
+            np.arange(count), rng.integers(0, width - w, count), rng.integers(0, height - h, count)
+        )
+        free_space.remove(0)
+        free_space.move(1, int(rng.integers(0, width - w)), int(rng.integers(0, height - h)))
+        free_space.add(count, int(rng.integers(0, width - w)), int(rng.integers(0, height - h)))
+
+        counts = brute_counts(free_space, width, height)
+        assert (free_space.counts == counts).all()
+        block = free_space.block
+        rows, columns = counts.shape
+        free = (counts == 0).reshape(rows // block, block, columns // block, block).sum(axis=(1, 3))
+        assert (free_space.free == free).all()
+
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        free_rows, free_columns = np.nonzero(counts == 0)
+        found = free_space.nearest(x, y)
+        if len(free_rows) == 0:
+            assert found is None
+        else:
+            distance2 = (free_columns * w - x) ** 2 + (free_rows * h - y) ** 2
+            assert (found[0] - x) ** 2 + (found[1] - y) ** 2 == distance2.min()
+
+
+def test_closest_free_matches_brute_force():
+    rng = np.random.default_rng(1)
+    width, height, w, h = 300, 200, 40, 20
+    for _ in range(20):
+        count = int(rng.integers(1, 40))
+        blocker_x = rng.integers(0, width - w, count)
+        blocker_y = rng.integers(0, height - h, count)
+        x, y, radius = int(rng.integers(0, width)), int(rng.integers(0, height)), int(rng.integers(5, 80))
+
+        found = closest_free(x, y, radius, blocker_x, blocker_y, w, h, width, height)
+
+        corner_y, corner_x = np.mgrid[0:height - h + 1, 0:width - w + 1]
+        corner_x, corner_y = corner_x.ravel(), corner_y.ravel()
+        taken = np.zeros(len(corner_x), dtype=bool)
+        for bx, by in zip(blocker_x.tolist(), blocker_y.tolist()):
+            taken |= (np.abs(corner_x - bx) < w) & (np.abs(corner_y - by) < h)
+        distance2 = (corner_x - x) ** 2 + (corner_y - y) ** 2
+        within = ~taken & (distance2 <= radius * radius)
+        if not within.any():
+            assert found is None
+        else:
+            assert (found[0] - x) ** 2 + (found[1] - y) ** 2 == distance2[within].min()
+            assert not taken[(corner_x == found[0]) & (corner_y == found[1])].any()
@@ -0,0 +1,112 @@
+import numpy as np
+
+from connection import Connection, ConnectionGraph
+from engine import CollisionEngine, REJECTED
+from history import Connect, Create, CreateMany, Delete, History, Move
+from rectangle import Rectangle
+
+
+def scene_state(engine: CollisionEngine, connections: ConnectionGraph) -> tuple:
+    store = engine.store
+    rect_ids, x, y = store.columns()
+    rectangles = sorted(zip(
+        rect_ids.tolist(), x.tolist(), y.tolist(), store.color[rect_ids].tolist()
+    ))
+    return rectangles, sorted(connections.edges)
+
+
+def edit(engine: CollisionEngine, connections: ConnectionGraph, rng: np.random.Generator):
+    """ Makes a random edit of the scene and returns its command. """
+
+    store = engine.store
+    rect_ids = store.ids()
+    kind = rng.integers(0, 5) if len(rect_ids) > 2 else 0
+    place = engine.place(int(rng.integers(0, 760)), int(rng.integers(0, 580)))
+    if kind == 0 and place is not None:
+        rect_id = engine.add(*place)
+        return Create(rect_id, *place, int(store.color[rect_id]))
+    if kind <= 1:
+        added = engine.add_rectangles(rng.integers(0, 760, 5), rng.integers(0, 580, 5))
+        added = added[added != REJECTED]
+        return CreateMany(added, store.x[added], store.y[added], store.color[added], [])
+    if kind == 2:
+        rect_id = int(rng.choice(rect_ids))
+        from_x, from_y = engine.position(rect_id)
+        to_x, to_y = engine.drag(
+            rect_id, (int(rng.integers(0, 760)), int(rng.integers(0, 580)))
+        )
+        return Move(rect_id, from_x, from_y, to_x, to_y)
+    if kind == 3:
+        rect1_id, rect2_id = rng.choice(rect_ids, 2, replace=False).tolist()
+        connections.add(Connection(Rectangle(store, rect1_id), Rectangle(store, rect2_id)))
+        return Connect(rect1_id, rect2_id)
+
+    rect_id = int(rng.choice(rect_ids))
+    x, y = engine.position(rect_id)
+    color = int(store.color[rect_id])
+    removed = connections.remove_rectangle(rect_id)
+    engine.remove(rect_id)
+    return Delete(rect_id, x, y, color, [(conn.rect1.id, conn.rect2.id) for conn in removed])
+
+
+def test_undo_and_redo_walk_back_and_forth_through_the_edits():
+    rng = np.random.default_rng(0)
+    engine = CollisionEngine(800, 600, 40, 20)
+    connections = ConnectionGraph(engine.store)
+    history = History(engine, connections, checkpoint_interval=8, max_checkpoints=4)
+
+    states = [scene_state(engine, connections)]
+    for _ in range(120):
+        history.record(edit(engine, connections, rng))
+        states.append(scene_state(engine, connections))
+
+    for position in range(len(states) - 2, -1, -1):
+        history.undo()
+        assert scene_state(engine, connections) == states[position]
+    assert not history.can_undo
+
+    for position in range(1, len(states)):
+        history.redo()
+        assert scene_state(engine, connections) == states[position]
+    assert not history.can_redo
+
+
+def test_seek_restores_any_position():
+    rng = np.random.default_rng(1)
+    engine = CollisionEngine(800, 600, 40, 20)
+    connections = ConnectionGraph(engine.store)
+    history = History(engine, connections, checkpoint_interval=8, max_checkpoints=4)
+
+    states = [scene_state(engine, connections)]
+    for _ in range(120):
+        history.record(edit(engine, connections, rng))
+        states.append(scene_state(engine, connections))
+
+    for position in rng.integers(0, len(states), 30).tolist():
+        history.seek(position)
+        assert history.position == position
+        assert scene_state(engine, connections) == states[position]
+
+
+def test_recording_after_undo_drops_the_undone_edits():
+    engine = CollisionEngine(800, 600, 40, 20)
+    connections = ConnectionGraph(engine.store)
+    history = History(engine, connections)
+
+    first = engine.add(0, 0)
+    history.record(Create(first, 0, 0, int(engine.store.color[first])))
+    second = engine.add(100, 0)
+    history.record(Create(second, 100, 0, int(engine.store.color[second])))
+    history.undo()
+    third = engine.add(200, 0)
+    history.record(Create(third, 200, 0, int(engine.store.color[third])))
+
+    assert not history.can_redo
+    history.undo()
+    history.undo()
+    assert len(engine.store) == 0
+    history.redo()
+    history.redo()
+    assert sorted(engine.position(rect_id) for rect_id in engine.store.ids().tolist()) == [
+        (0, 0), (200, 0)
+    ]
@@ -0,0 +1,64 @@
+import numpy as np
+
+from batch import overlapping_boxes
+from connection import Connection, ConnectionGraph
+from engine import CollisionEngine
+from layout import ForceLayout
+from rectangle import Rectangle
+
+
+def laid_out(size: int, seed: int) -> ForceLayout:
+    rng = np.random.default_rng(seed)
+    engine = CollisionEngine(2000, 1500, 40, 20)
+    engine.add_rectangles(rng.integers(0, 1960, size), rng.integers(0, 1480, size))
+    connections = ConnectionGraph(engine.store)
+    rect_ids = engine.store.ids()
+    for rect1_id, rect2_id in rng.choice(rect_ids, (len(rect_ids), 2)).tolist():
+        if rect1_id != rect2_id:
+            connections.add(Connection(
+                Rectangle(engine.store, rect1_id), Rectangle(engine.store, rect2_id)
+            ))
+
+    layout = ForceLayout(engine, connections)
+    layout.compute()
+    while not layout.finished:
+        layout.apply()
+    return layout
+
+
+def at_targets(layout: ForceLayout) -> np.ndarray:
+    store = layout.engine.store
+    return (
+        (store.x[layout.rect_ids] == layout.target_x)
+        & (store.y[layout.rect_ids] == layout.target_y)
+    )
+
+
+def test_layout_reaches_the_targets_that_fit_together():
+    layout = laid_out(500, 1)
+    engine = CollisionEngine(2000, 1500, 40, 20)
+    fitting = engine.placeable(layout.target_x, layout.target_y, contact=1)
+
+    assert at_targets(layout).sum() >= 0.9 * fitting.sum()
+
+
+def test_layout_leaves_no_rectangle_that_could_get_closer():
+    layout = laid_out(700, 2)
+    engine = layout.engine
+    left = np.flatnonzero(~at_targets(layout))
+    rect_ids = layout.rect_ids[left]
+    x, y = engine.store.x[rect_ids].copy(), engine.store.y[rect_ids].copy()
+
+    reached = engine.drag_batch(
+        rect_ids, np.stack((layout.target_x[left], layout.target_y[left]), axis=1)
+    )
+
+    assert ((reached.x == x) & (reached.y == y)).all()
+
+
+def test_layout_keeps_rectangles_apart():
+    layout = laid_out(700, 3)
+    _, x, y = layout.engine.store.columns()
+    first, second = overlapping_boxes(x, y, x, y, 39, 19)
+
+    assert (first == second).all()
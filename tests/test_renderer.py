@@ -0,0 +1,44 @@
+import numpy as np
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImage, QPainter, QColor
+
+from connection import ConnectionGraph
+from engine import CollisionEngine
+from renderer import SceneRenderer, POINTS
+
+
+def render(renderer: SceneRenderer, size: QSize) -> QImage:
+    image = QImage(size, QImage.Format_ARGB32_Premultiplied)
+    image.fill(QColor("white"))
+    painter = QPainter(image)
+    renderer.paint(painter, image.rect())
+    painter.end()
+    return image
+
+
+def make_renderer(engine: CollisionEngine, size: QSize) -> SceneRenderer:
+    renderer = SceneRenderer(engine, ConnectionGraph(engine.store))
+    renderer.view.zoom = 0.2
+    renderer.resize(size)
+    return renderer
+
+
+def test_low_detail_repaint_matches_full_paint(qapp):
+    rng = np.random.default_rng(2)
+    engine = CollisionEngine(8000, 8000, 20, 10)
+    engine.add_rectangles(rng.integers(0, 2000, 3000), rng.integers(0, 2000, 3000))
+    size = QSize(400, 400)
+
+    renderer = make_renderer(engine, size)
+    assert renderer.detail() == POINTS
+    render(renderer, size)
+    # Dragged rectangles are active, only their areas are repainted
+    rect_ids, x, y = engine.store.columns()
+    rect_id = int(rect_ids[(abs(x - 1000) < 100) & (abs(y - 1000) < 100)][0])
+    x, y = engine.store.position(rect_id)
+    renderer.set_active([rect_id])
+    engine.drag(rect_id, (x + 30, y + 15))
+    renderer.set_active([])
+    assert engine.store.position(rect_id) != (x, y)
+
+    assert render(renderer, size) == render(make_renderer(engine, size), size)
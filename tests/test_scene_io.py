@@ -0,0 +1,73 @@
+import numpy as np
+
+from connection import Connection, ConnectionGraph
+from engine import CollisionEngine, REJECTED
+from rectangle import Rectangle
+from scene_io import load_scene, save_scene
+
+
+def make_scene():
+    engine = CollisionEngine(1200, 800, 80, 40)
+    connections = ConnectionGraph(engine.store)
+    first = engine.add(0, 0)
+    second = engine.add(79, 0)
+    third = engine.add(300, 300)
+    for rect1_id, rect2_id in ((first, second), (second, third)):
+        connections.add(Connection(
+            Rectangle(engine.store, rect1_id), Rectangle(engine.store, rect2_id)
+        ))
+    return engine, connections
+
+
+def test_load_round_trip(tmp_path):
+    engine, connections = make_scene()
+    path = str(tmp_path / "scene.rcs")
+    save_scene(path, engine, connections)
+
+    loaded = CollisionEngine(1200, 800, 80, 40)
+    loaded_connections = ConnectionGraph(loaded.store)
+    rect_ids = load_scene(path, loaded, loaded_connections)
+
+    assert (rect_ids != REJECTED).all()
+    assert loaded.store.x[rect_ids].tolist() == [0, 79, 300]
+    assert loaded.store.y[rect_ids].tolist() == [0, 0, 300]
+    assert loaded.store.color[rect_ids].tolist() == engine.store.color[engine.store.ids()].tolist()
+    assert len(loaded_connections) == 2
+
+
+def test_loading_twice_adds_nothing(tmp_path):
+    engine, connections = make_scene()
+    path = str(tmp_path / "scene.rcs")
+    save_scene(path, engine, connections)
+
+    rect_ids = load_scene(path, engine, connections)
+
+    assert (rect_ids == REJECTED).all()
+    assert len(engine.store.ids()) == 3
+    assert len(connections) == 2
+
+
+def test_load_rejects_rectangles_outside_the_world(tmp_path):
+    engine, connections = make_scene()
+    path = str(tmp_path / "scene.rcs")
+    save_scene(path, engine, connections)
+
+    small = CollisionEngine(200, 200, 80, 40)
+    small_connections = ConnectionGraph(small.store)
+    rect_ids = load_scene(path, small, small_connections)
+
+    assert (rect_ids[:2] != REJECTED).all() and rect_ids[2] == REJECTED
+    assert len(small_connections) == 1
+
+
+def test_loaded_colors_stay_unique(tmp_path):
+    engine, connections = make_scene()
+    path = str(tmp_path / "scene.rcs")
+    save_scene(path, engine, connections)
+
+    other = CollisionEngine(1200, 800, 80, 40)
+    other.add(600, 600, color=int(engine.store.color[engine.store.ids()[0]]))
+    load_scene(path, other, ConnectionGraph(other.store))
+
+    colors = other.store.color[other.store.ids()]
+    assert len(np.unique(colors)) == len(colors)
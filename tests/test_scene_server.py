@@ -0,0 +1,139 @@
+import asyncio
+import json
+
+from engine import CollisionEngine
+from scene_server import Client, SceneClient, SceneServer
+
+
+def run_turn(server: SceneServer, *requests: dict) -> list:
+    """ Responses to the requests handled in one turn, by request id. """
+
+    client = Client(writer=None)
+    server.queue = [(client, dict(request, id=i)) for i, request in enumerate(requests)]
+    server.flush()
+    responses = [json.loads(line) for line in client.outgoing]
+    return sorted(responses, key=lambda message: message["id"])
+
+
+def make_server() -> SceneServer:
+    return SceneServer(CollisionEngine(1200, 800, 80, 40))
+
+
+def test_out_of_range_coordinates_get_error_replies():
+    server = make_server()
+    responses = run_turn(
+        server,
+        {"op": "create", "x": 1e12, "y": 100},
+        {"op": "create", "x": float("inf"), "y": 100},
+        {"op": "create", "x": 4294967396, "y": 100},
+        {"op": "create", "x": 100, "y": 100},
+    )
+
+    assert [("error" in message) for message in responses] == [True, True, True, False]
+    assert server.engine.store.ids().tolist() == [responses[3]["result"]]
+
+
+def test_drags_out_of_range_fail_and_out_of_world_stop_at_the_edge():
+    server = make_server()
+    rect_id = server.engine.add(100, 100)
+    responses = run_turn(
+        server,
+        {"op": "drag", "rect": rect_id, "x": float("inf"), "y": 0},
+        {"op": "drag", "rect": rect_id, "x": 10 ** 12, "y": 0},
+        {"op": "drag", "rect": rect_id, "x": 5000, "y": 100},
+    )
+
+    assert "error" in responses[0] and "error" in responses[1]
+    assert responses[2]["result"] == [1120, 100]
+
+
+def test_failing_group_does_not_drop_other_replies(monkeypatch):
+    server = make_server()
+    rect_id = server.engine.add(100, 100)
+
+    def fail(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(server.engine, "drag_batch", fail)
+    responses = run_turn(
+        server,
+        {"op": "drag", "rect": rect_id, "x": 300, "y": 100},
+        {"op": "drag", "rect": 99, "x": 300, "y": 100},
+        {"op": "create", "x": 600, "y": 400},
+        {"op": "position", "rect": rect_id},
+    )
+
+    assert len(responses) == 4
+    assert responses[0]["error"].startswith("Server error")
+    assert responses[1]["error"].startswith("Bad request")
+    assert "result" in responses[2]
+    assert responses[3]["result"] == [100, 100]
+
+
+def test_area_queries_are_cut_to_the_world():
+    server = make_server()
+    rect_id = server.engine.add(100, 100)
+    responses = run_turn(server, {
+        "op": "rectangles_in", "x": -10 ** 9, "y": -10 ** 9,
+        "width": 2 ** 31 - 1, "height": 2 ** 31 - 1,
+    })
+
+    assert responses[0]["result"] == [[rect_id, 100, 100]]
+
+
+def test_client_round_trip():
+    async def session():
+        server = make_server()
+        port = await server.start()
+        client = SceneClient()
+        await client.connect(port=port)
+        try:
+            rect_id = await client.request("create", x=140, y=120)
+            position = await client.request("drag", rect=rect_id, x=300, y=100)
+            try:
+                await client.request("create", x=1e12, y=0)
+            except RuntimeError as error:
+                failed = str(error)
+            else:
+                failed = None
+        finally:
+            await client.close()
+            await server.close()
+        return position, failed
+
+    position, failed = asyncio.run(session())
+    assert position == [300, 100]
+    assert failed is not None and failed.startswith("Bad request")
+
+
+def test_connections_are_handled_by_ids():
+    server = make_server()
+    rect1_id = server.engine.add(100, 100)
+    rect2_id = server.engine.add(500, 100)
+    responses = run_turn(
+        server,
+        {"op": "connect", "rect1": rect2_id, "rect2": rect1_id},
+        {"op": "connect", "rect1": rect1_id, "rect2": rect2_id},
+        {"op": "connection_at", "x": 300, "y": 119},
+        {"op": "disconnect", "rect1": rect1_id, "rect2": rect2_id},
+        {"op": "connection_at", "x": 300, "y": 119},
+        {"op": "disconnect", "rect1": rect1_id, "rect2": rect2_id},
+    )
+
+    assert [message["result"] for message in responses] == [
+        True, False, [rect1_id, rect2_id], True, None, False
+    ]
+
+
+def test_creates_on_taken_spots_snap_like_double_clicks():
+    server = make_server()
+    centers = [(300, 200), (300, 200), (310, 205)]
+    responses = run_turn(server, *({"op": "create", "x": x, "y": y} for x, y in centers))
+
+    # Double-clicks at the same points, in the same order
+    window_engine = CollisionEngine(1200, 800, 80, 40)
+    for (x, y), message in zip(centers, responses):
+        place = window_engine.place(x - 40, y - 20)
+        window_engine.add(*place)
+        assert server.engine.position(message["result"]) == place
+    assert len(server.engine.store) == 3
@@ -0,0 +1,78 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+from batch import NO_BLOCKER, sweep
+from engine import CollisionEngine
+from sharded import ShardedQueries
+
+
+def make_engine() -> CollisionEngine:
+    rng = np.random.default_rng(0)
+    engine = CollisionEngine(4000, 4000, 40, 20)
+    engine.add_rectangles(rng.integers(0, 3960, 6000), rng.integers(0, 3980, 6000))
+    return engine
+
+
+def serial_nearest(engine: CollisionEngine, rect_id: int, target_x: int, target_y: int):
+    """ First rectangle met on the straight path, the lowest id on ties. """
+
+    x, y = engine.position(rect_id)
+    blockers = engine.blockers_on_path(rect_id, x, y, target_x, target_y)
+    if len(blockers) == 0:
+        return NO_BLOCKER, np.inf
+    count = len(blockers)
+    t, _ = sweep(
+        np.full(count, x), np.full(count, y),
+        np.full(count, target_x - x), np.full(count, target_y - y),
+        engine.store.x[blockers].astype(np.int64), engine.store.y[blockers].astype(np.int64),
+        engine.rect_width, engine.rect_height,
+    )
+    first = np.lexsort((blockers, t))[0]
+    return (int(blockers[first]), t[first]) if np.isfinite(t[first]) else (NO_BLOCKER, np.inf)
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_sharded_queries_match_the_engine(processes):
+    rng = np.random.default_rng(processes)
+    engine = make_engine()
+    rect_ids = engine.store.ids()
+
+    with ShardedQueries(engine, processes=processes) as sharded:
+        name = sharded.shared.name
+
+        x, y = rng.integers(-100, 4000, 300), rng.integers(-100, 4000, 300)
+        width, height = rng.integers(1, 400, 300), rng.integers(1, 400, 300)
+        overlaps = sharded.overlaps(x, y, width, height)
+        for i in range(300):
+            assert overlaps[i].tolist() == engine.rectangles_in(x[i], y[i], width[i], height[i])
+
+        x, y = rng.integers(0, 4000, 2000), rng.integers(0, 4000, 2000)
+        hits = sharded.hits(x, y)
+        for i in range(2000):
+            found = engine.rectangle_at(int(x[i]), int(y[i]))
+            assert hits[i] == (NO_BLOCKER if found is None else found)
+        assert (hits != NO_BLOCKER).any()
+
+        movers = rng.choice(rect_ids, 300, replace=False)
+        target_x = np.clip(engine.store.x[movers] + rng.integers(-600, 600, 300), 0, 3960)
+        target_y = np.clip(engine.store.y[movers] + rng.integers(-600, 600, 300), 0, 3980)
+        nearest, times = sharded.nearest_blockers(movers, target_x, target_y)
+        for i in range(300):
+            assert (nearest[i], times[i]) == serial_nearest(
+                engine, int(movers[i]), int(target_x[i]), int(target_y[i])
+            )
+        assert (nearest != NO_BLOCKER).any() and (nearest == NO_BLOCKER).any()
+
+    # Free paths are the drags reaching their targets
+    for i in np.flatnonzero(nearest == NO_BLOCKER)[:20].tolist():
+        rect_id = int(movers[i])
+        start = engine.position(rect_id)
+        target = (int(target_x[i]), int(target_y[i]))
+        assert engine.drag(rect_id, target) == target
+        engine.move_to(rect_id, *start)
+
+    # The snapshot is released with the pool
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=name)
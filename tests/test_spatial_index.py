@@ -0,0 +1,61 @@
+import numpy as np
+
+from spatial_index import GridIndex, RTreeIndex, boxes_overlap, to_box
+
+
+def test_rtree_and_grid_answer_queries_like_brute_force():
+    rng = np.random.default_rng(0)
+    rtree, grid = RTreeIndex(max_entries=4), GridIndex(40, 20)
+    boxes = {}
+
+    for step in range(2000):
+        kind = rng.integers(0, 4) if boxes else 0
+        if kind <= 1:
+            key = step
+            bounds = rng.integers(-100, 1000, 2).tolist() + rng.integers(1, 120, 2).tolist()
+            rtree.insert(key, *bounds)
+            grid.insert(key, *bounds)
+            boxes[key] = to_box(*bounds)
+        elif kind == 2:
+            key = int(rng.choice(list(boxes)))
+            bounds = rng.integers(-100, 1000, 2).tolist() + rng.integers(1, 120, 2).tolist()
+            rtree.update(key, *bounds)
+            grid.update(key, *bounds)
+            boxes[key] = to_box(*bounds)
+        else:
+            key = int(rng.choice(list(boxes)))
+            rtree.remove(key)
+            grid.remove(key)
+            del boxes[key]
+
+        assert len(rtree) == len(grid) == len(boxes)
+        if step % 10 == 0:
+            query = rng.integers(-150, 1050, 2).tolist() + rng.integers(1, 300, 2).tolist()
+            expected = sorted(key for key, box in boxes.items() if boxes_overlap(box, to_box(*query)))
+            assert sorted(rtree.query(*query)) == expected
+            assert sorted(grid.query(*query)) == expected
+
+            # Boxes are inclusive, a point on the right or bottom edge is inside
+            key = int(rng.choice(list(boxes)))
+            left, top, right, bottom = boxes[key]
+            assert key in rtree.query_point(right, bottom)
+            assert key in grid.query_point(right, bottom)
+            assert key not in rtree.query_point(right + 1, bottom)
+            assert key not in grid.query_point(right + 1, bottom)
+
+
+def test_insert_many_matches_insert():
+    rng = np.random.default_rng(1)
+    x, y = rng.integers(0, 2000, 500), rng.integers(0, 2000, 500)
+    width, height = np.full(500, 40), np.full(500, 20)
+    keys = list(range(500))
+    for index in (RTreeIndex(), GridIndex(40, 20)):
+        index.insert_many(keys, x, y, width, height)
+        for key in keys:
+            assert key in index
+        for query_x, query_y in rng.integers(0, 2000, (50, 2)).tolist():
+            expected = sorted(
+                key for key in keys
+                if boxes_overlap(to_box(x[key], y[key], 40, 20), to_box(query_x, query_y, 100, 100))
+            )
+            assert sorted(index.query(query_x, query_y, 100, 100)) == expected
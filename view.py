@@ -0,0 +1,70 @@
+import math
+
+from PyQt5.QtGui import QTransform
+from PyQt5.QtCore import QPoint, QRect
+
+
+class View:
+    """ Maps the world, where the rectangles live, to the widget.
+
+    The world point (x, y) is shown in the top-left corner of the widget
+    and world distances are multiplied by zoom on screen. """
+
+    MIN_ZOOM = 1 / 64
+    MAX_ZOOM = 8.0
+
+    def __init__(self):
+        self.x = 0.0
+        self.y = 0.0
+        self.zoom = 1.0
+
+
+    def to_world(self, pos: QPoint) -> QPoint:
+        return QPoint(
+            math.floor(pos.x() / self.zoom + self.x),
+            math.floor(pos.y() / self.zoom + self.y),
+        )
+
+
+    def to_world_rect(self, rect: QRect) -> QRect:
+        """ Smallest world area covering the widget area. """
+
+        left = math.floor(rect.x() / self.zoom + self.x)
+        top = math.floor(rect.y() / self.zoom + self.y)
+        right = math.ceil((rect.x() + rect.width()) / self.zoom + self.x)
+        bottom = math.ceil((rect.y() + rect.height()) / self.zoom + self.y)
+        return QRect(left, top, right - left, bottom - top)
+
+
+    def to_screen_rect(self, rect: QRect) -> QRect:
+        """ Smallest widget area covering the world area. """
+
+        left = math.floor((rect.x() - self.x) * self.zoom)
+        top = math.floor((rect.y() - self.y) * self.zoom)
+        right = math.ceil((rect.x() + rect.width() - self.x) * self.zoom)
+        bottom = math.ceil((rect.y() + rect.height() - self.y) * self.zoom)
+        return QRect(left, top, right - left, bottom - top)
+
+
+    def transform(self) -> QTransform:
+        return QTransform(
+            self.zoom, 0, 0, self.zoom,
+            -self.x * self.zoom, -self.y * self.zoom,
+        )
+
+
+    def pan(self, dx: int, dy: int) -> None:
+        """ Moves the world by a distance in widget pixels. """
+
+        self.x -= dx / self.zoom
+        self.y -= dy / self.zoom
+
+
+    def zoom_at(self, pos: QPoint, factor: float) -> None:
+        """ Zooms keeping the world point under the widget point in place. """
+
+        world_x = pos.x() / self.zoom + self.x
+        world_y = pos.y() / self.zoom + self.y
+        self.zoom = min(self.MAX_ZOOM, max(self.MIN_ZOOM, self.zoom * factor))
+        self.x = world_x - pos.x() / self.zoom
+        self.y = world_y - pos.y() / self.zoom